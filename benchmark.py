@@ -0,0 +1,227 @@
+"""
+Benchmarks for billomapy against the local MockBillomatServer
+
+Measures throughput, request latency and peak memory of the pagination, the fan-out of the flood client,
+bulk creates and pdf downloads. No network access is needed:
+
+    python benchmark.py --records 5000 --latency 0.01 > bench_output.txt
+
+Save a run with --save baseline.json and compare later runs with --baseline baseline.json,
+the script exits with 1 if the throughput of a benchmark dropped more than --tolerance.
+
+The flood benchmarks need tornado<5 (pip install "tornado<5"), because the callback api of the flood client
+was removed in tornado 5. With a newer tornado they are skipped.
+"""
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+import tornado
+
+from billomapy import Billomapy, DeprecatedBillomapy
+from billomapy.mock_server import MockBillomatServer
+from billomapy.pipeline import DocumentPipeline
+from billomapy.resources import *
+
+
+def percentile(samples, percent):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(percent / 100.0 * (len(samples) - 1))))]
+
+
+def timed_session(client, samples):
+    """
+    Wraps the session of the sync client so every request latency gets recorded
+    """
+    request = client.session.request
+
+    def timed_request(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return request(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+
+    client.session.request = timed_request
+    return client
+
+
+def run_benchmark(server, name, function, operations):
+    """
+    Runs function once and returns throughput (operations per second), latency and peak memory
+    """
+    samples = []
+    requests_before = server.request_count
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        function(samples)
+        error = None
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+    seconds = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    requests = server.request_count - requests_before
+
+    return {
+        'name': name,
+        'error': error,
+        'seconds': seconds,
+        'requests': requests,
+        'throughput': operations / seconds if seconds and not error else 0.0,
+        'latency_p50_ms': percentile(samples, 50) * 1000 if samples else seconds / max(requests, 1) * 1000,
+        'latency_p95_ms': percentile(samples, 95) * 1000 if samples else seconds / max(requests, 1) * 1000,
+        'peak_memory_kb': peak_memory / 1024.0,
+    }
+
+
+def sync_client(server, samples):
+    client = Billomapy('BENCHMARK', 'API_KEY', 'APP_ID', 'APP_SECRET')
+    client.api_url = server.api_url
+    return timed_session(client, samples)
+
+
+# the callback api of the flood client was removed in tornado 5
+FLOOD_SUPPORTED = tornado.version_info[0] < 5
+
+
+def flood_client(server):
+    client = DeprecatedBillomapy('BENCHMARK', 'API_KEY', 'APP_ID', 'APP_SECRET')
+    client.api_url = server.api_url
+    return client
+
+
+def benchmarks(server, arguments):
+    records = arguments.records
+    documents = arguments.documents
+
+    def sync_pagination(samples):
+        sync_client(server, samples).get_all_invoices()
+
+    def flood_pagination(samples):
+        flood_client(server).get_all_invoices()
+
+    def flood_item_fan_out(samples):
+        flood_client(server).get_all_invoice_items(range(1, documents + 1))
+
+    def sync_bulk_create(samples):
+        client = sync_client(server, samples)
+        for index in range(documents):
+            client.create_invoice({INVOICE: {'client_id': index % 10 + 1}})
+
+    def flood_bulk_create(samples):
+        client = flood_client(server)
+        for index in range(documents):
+            client.queue_post_request(INVOICES, {INVOICE: {'client_id': index % 10 + 1}})
+        client.start_requests()
+
+    def sync_pdf_download(samples):
+        client = sync_client(server, samples)
+        for invoice_id in range(1, documents + 1):
+            client.invoice_pdf(invoice_id)
+
+    def flood_pdf_download(samples):
+        client = flood_client(server)
+        for invoice_id in range(1, documents + 1):
+            client.queue_get_request(INVOICES + '/{}/{}'.format(invoice_id, PDF))
+        client.start_requests()
+
+    def flood_pdf_pipeline(samples):
+        pipeline = DocumentPipeline(flood_client(server), lambda resource, billomat_id, document: None)
+        pipeline.add(INVOICES, range(1, documents + 1))
+        pipeline.run()
+
+    return [
+        ('sync_pagination', sync_pagination, records),
+        ('flood_pagination', flood_pagination, records),
+        ('flood_item_fan_out', flood_item_fan_out, documents),
+        ('sync_bulk_create', sync_bulk_create, documents),
+        ('flood_bulk_create', flood_bulk_create, documents),
+        ('sync_pdf_download', sync_pdf_download, documents),
+        ('flood_pdf_download', flood_pdf_download, documents),
+        ('flood_pdf_pipeline', flood_pdf_pipeline, documents),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the names of all benchmarks which are slower than the baseline
+    """
+    baseline = dict((result['name'], result) for result in baseline)
+    regressions = []
+    for result in results:
+        old = baseline.get(result['name'])
+        if old and old['throughput'] and result['throughput'] < old['throughput'] * (1 - tolerance):
+            regressions.append(result['name'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=5000, help='invoices served by the mock server')
+    parser.add_argument('--documents', type=int, default=200, help='documents for creates, items and pdfs')
+    parser.add_argument('--payload-bytes', type=int, default=0, help='filler bytes per record')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of latency per response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum seconds of random extra latency')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='probability of 429 responses')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of 500 responses')
+    parser.add_argument('--only', nargs='*', help='names of the benchmarks to run')
+    parser.add_argument('--save', help='write the results as json to this file')
+    parser.add_argument('--baseline', help='compare the results with this json file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed throughput drop to the baseline')
+    arguments = parser.parse_args()
+
+    server = MockBillomatServer(
+        records={INVOICES: arguments.records},
+        default_records=arguments.documents * 3,
+        payload_bytes=arguments.payload_bytes,
+        latency=arguments.latency,
+        jitter=arguments.jitter,
+        rate_limit_rate=arguments.rate_limit_rate,
+        error_rate=arguments.error_rate,
+    )
+
+    if not FLOOD_SUPPORTED:
+        sys.stderr.write('Skipping the flood benchmarks, they need tornado<5 and {} is installed\n'.format(
+            tornado.version
+        ))
+
+    results = []
+    with server:
+        for name, function, operations in benchmarks(server, arguments):
+            if arguments.only and name not in arguments.only:
+                continue
+            if name.startswith('flood_') and not FLOOD_SUPPORTED:
+                continue
+            results.append(run_benchmark(server, name, function, operations))
+
+    print('{:<20} {:>10} {:>9} {:>12} {:>10} {:>10} {:>12}'.format(
+        'benchmark', 'seconds', 'requests', 'ops/s', 'p50 ms', 'p95 ms', 'peak KiB'
+    ))
+    for result in results:
+        if result['error']:
+            print('{:<20} failed: {}'.format(result['name'], result['error']))
+            continue
+        print('{name:<20} {seconds:>10.3f} {requests:>9} {throughput:>12.1f} {latency_p50_ms:>10.2f} '
+              '{latency_p95_ms:>10.2f} {peak_memory_kb:>12.1f}'.format(**result))
+
+    if arguments.save:
+        with open(arguments.save, 'w') as output:
+            json.dump(results, output, indent=4)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), arguments.tolerance)
+        if regressions:
+            print('Regressions: {}'.format(', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Pool of clients for many Billomat accounts with fair scheduling
+
+Every account gets its own client and its own rate limiter. Tasks are queued per account and the workers
+take them round robin from the accounts which have a free slot and budget left, so a busy or throttled
+account never blocks the others:
+
+    pool = AccountPool({
+        'acme': {'billomat_id': 'acme', 'api_key': '...', 'app_id': '...', 'app_secret': '...'},
+        'initech': {'billomat_id': 'initech', 'api_key': '...', 'app_id': '...', 'app_secret': '...'},
+    }, rate=300 / 900.0)
+
+    with pool:
+        invoices = pool.map(lambda billomapy: billomapy.get_all_invoices())
+"""
+import threading
+import collections
+
+from concurrent.futures import Future
+
+from .billomapy import Billomapy
+from .ratelimit import TokenBucket
+
+
+class AccountPool(object):
+    """
+    :param accounts: dict of account name and the keyword arguments of Billomapy or a Billomapy client
+    :param max_workers: how many tasks run at the same time over all accounts. Default: 16
+    :param max_per_account: how many tasks of one account run at the same time. Default: 2
+    :param rate: requests per second per account, a TokenBucket for every client without rate limiter. Default: None
+    :param capacity: burst of the TokenBucket. Default: 1 second of rate
+    :param client_kwargs: further keyword arguments for every created Billomapy e.g: page_size
+    """
+
+    def __init__(self, accounts, max_workers=16, max_per_account=2, rate=None, capacity=None, **client_kwargs):
+        assert (max_workers > 0 and max_per_account > 0)
+        self.max_workers = max_workers
+        self.max_per_account = max_per_account
+        self.clients = collections.OrderedDict()
+        for name, account in accounts.items():
+            if isinstance(account, Billomapy):
+                client = account
+            else:
+                client = Billomapy(**dict(client_kwargs, **account))
+            if rate and client.rate_limiter is None:
+                client.rate_limiter = TokenBucket(rate, capacity)
+            self.clients[name] = client
+
+        self._queues = dict((name, collections.deque()) for name in self.clients)
+        self._running = collections.Counter()
+        self._order = collections.deque(self.clients)
+        self._condition = threading.Condition()
+        self._threads = []
+        self._shutdown = False
+
+    def submit(self, account, function, *args, **kwargs):
+        """
+        Queues function(client, *args, **kwargs) for the client of the account
+
+        :param account: the account name
+        :param function: gets the client as first argument
+        :return: concurrent.futures.Future
+        """
+        if account not in self.clients:
+            raise KeyError('Unknown account {}'.format(account))
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('The pool is shut down')
+            self._queues[account].append((future, function, args, kwargs))
+            self._start_workers()
+            self._condition.notify()
+        return future
+
+    def map(self, function, accounts=None):
+        """
+        Runs function(client) for every account and waits for all of them
+
+        :param function: gets the client of the account
+        :param accounts: the account names. Default: all
+        :return: dict of account name and result
+        """
+        futures = collections.OrderedDict(
+            (name, self.submit(name, function)) for name in (accounts or self.clients)
+        )
+        return collections.OrderedDict((name, future.result()) for name, future in futures.items())
+
+    def _start_workers(self):
+        while len(self._threads) < self.max_workers:
+            thread = threading.Thread(target=self._work, name='billomapy-account-pool-{}'.format(len(self._threads)))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_task(self):
+        """
+        Returns the next task round robin over the accounts, waits while no account may run one
+        Must be called with the condition held.
+        """
+        while True:
+            if self._shutdown and not any(self._queues.values()):
+                return None, None
+
+            wait = None
+            for _ in range(len(self._order)):
+                name = self._order[0]
+                self._order.rotate(-1)
+                if not self._queues[name] or self._running[name] >= self.max_per_account:
+                    continue
+                rate_limiter = self.clients[name].rate_limiter
+                budget_wait = rate_limiter.wait_time() if hasattr(rate_limiter, 'wait_time') else 0.0
+                if budget_wait > 0:
+                    wait = budget_wait if wait is None else min(wait, budget_wait)
+                    continue
+                self._running[name] += 1
+                return name, self._queues[name].popleft()
+            self._condition.wait(wait)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                name, task = self._next_task()
+            if task is None:
+                return
+
+            future, function, args, kwargs = task
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(function(self.clients[name], *args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            with self._condition:
+                self._running[name] -= 1
+                self._condition.notify_all()
+
+    def shutdown(self, wait=True):
+        """
+        Runs the queued tasks and stops the workers
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
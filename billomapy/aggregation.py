@@ -0,0 +1,158 @@
+"""
+Streaming aggregation over the records of paginated reads
+
+The records are added one by one while the pages arrive, so only one value per group and field is held:
+
+    revenue = billomapy.aggregate(INVOICES, group_by='client_id', fields=['total_gross'])
+    revenue['42']['total_gross']['sum']  # Decimal('1190.00')
+
+    by_month = Aggregation(group_by=month('date'), fields=['amount'])
+    by_month.update(billomapy.iter_all(INVOICE_PAYMENTS))
+
+Billomat sends amounts as strings, they are summed as decimal.Decimal, so no cent gets lost.
+An Aggregation can be fed from many threads, or partial aggregations can be merged.
+"""
+import threading
+
+from decimal import Decimal, InvalidOperation
+
+
+def month(field):
+    """
+    Returns a group key function for the month of a date field e.g: 2026-03 for 2026-03-14
+    """
+    def key(record):
+        value = record.get(field)
+        return value[:7] if value else None
+
+    return key
+
+
+def _to_decimal(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, Decimal):
+        return value
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError('{!r} is not a number'.format(value))
+
+
+class _Stats(object):
+
+    def __init__(self):
+        self.count = 0
+        self.sum = Decimal(0)
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max}
+
+
+class Aggregation(object):
+    """
+    Groups records and keeps count, sum, min and max of numeric fields per group, safe to use from many threads
+
+    :param group_by: a field name, a tuple of field names or a function which gets the record. None is one group
+    :param fields: the numeric fields e.g: ['total_gross', 'open_amount'], empty values are skipped
+    """
+
+    def __init__(self, group_by=None, fields=()):
+        self.group_by = group_by
+        self.fields = list(fields)
+        self.records = 0
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    @property
+    def key_fields(self):
+        """
+        Returns the fields the group keys are made of, None if group_by is a function
+        """
+        if self.group_by is None:
+            return []
+        if isinstance(self.group_by, str):
+            return [self.group_by]
+        if isinstance(self.group_by, tuple):
+            return list(self.group_by)
+        return None
+
+    def _key(self, record):
+        if self.group_by is None:
+            return None
+        if isinstance(self.group_by, str):
+            return record.get(self.group_by)
+        if isinstance(self.group_by, tuple):
+            return tuple(record.get(field) for field in self.group_by)
+        return self.group_by(record)
+
+    def add(self, record):
+        key = self._key(record)
+        values = [(field, _to_decimal(record.get(field))) for field in self.fields]
+        with self._lock:
+            self.records += 1
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = [0, dict((field, _Stats()) for field in self.fields)]
+            group[0] += 1
+            for field, value in values:
+                if value is not None:
+                    group[1][field].add(value)
+
+    def update(self, records):
+        """
+        Adds every record of an iterable e.g: the generator of iter_all
+
+        :return: self
+        """
+        for record in records:
+            self.add(record)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the groups of another aggregation with the same fields e.g: of another fetcher
+
+        :return: self
+        """
+        with other._lock:
+            groups = [(key, count, dict(stats)) for key, (count, stats) in other._groups.items()]
+            records = other.records
+        with self._lock:
+            self.records += records
+            for key, count, stats in groups:
+                group = self._groups.get(key)
+                if group is None:
+                    group = self._groups[key] = [0, dict((field, _Stats()) for field in self.fields)]
+                group[0] += count
+                for field, field_stats in stats.items():
+                    group[1][field].merge(field_stats)
+        return self
+
+    def result(self):
+        """
+        Returns dict of group key and dict of count and per field a dict of count, sum, min and max
+        """
+        with self._lock:
+            return dict(
+                (key, dict([('count', count)] + [(field, stats[field].as_dict()) for field in self.fields]))
+                for key, (count, stats) in self._groups.items()
+            )
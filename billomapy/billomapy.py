@@ -1,9 +1,26 @@
-import math
 import json
+import time
+import functools
+import threading
+import contextlib
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 
+from . import streaming, tracing
+from .coalescing import SingleFlight
+from .indexes import indexed
+from .metrics import TransferStats
+from .pagination import resolve_page_size
+from .projection import project, project_page, resolve_fields
+from .aggregation import Aggregation
+from .cancellation import POLL_INTERVAL, Cancelled
+from .circuit import CircuitOpenError
+from .deadline import Deadline, DeadlineExceeded, PartialResult
+from .ratelimit import BULK, INTERACTIVE, PriorityRateLimiter
 from .resources import *
+from .sequence import PagedSequence
 
 
 class Billomapy(object):
@@ -17,25 +34,51 @@ class Billomapy(object):
     :param api_key: The api key that you requested from billomat
     :param app_id: The app_id that you requested by billomat
     :param app_secret: The app_secret that you requested by billomat
+    :param transport: A requests transport adapter for the session e.g: transport.RecordingAdapter
+    :param page_size: per_page of get_all_* as int, pagination.AdaptivePageSize or dict per resource. Default: 1000
+    :param compress: Negotiate gzip/deflate compressed responses. Default: True
+    :param coalesce: Concurrent identical GET requests share one request and its result. Default: True
+    :param fields: Only keep these fields of the records of get_all_* as list or dict per resource. Default: all
+    :param rate_limiter: e.g: ratelimit.TokenBucket, its acquire() is called before every request.
+                         A ratelimit.PriorityRateLimiter lets interactive requests go before get_all_* pages
+    :param cache: e.g: cache.FileCache, successful GET requests of its resources are answered from it
+    :param hedge: e.g: hedging.HedgePolicy, slow GET requests of single records get a second attempt. Default: None
+    :param circuit_breaker: e.g: circuit.CircuitBreaker, requests fail fast or are answered from the stale cache
+                            while too many requests of their endpoint family failed. Default: None
     """
 
-    def __init__(self, billomat_id, api_key, app_id, app_secret):
+    def __init__(self, billomat_id, api_key, app_id, app_secret, transport=None, page_size=None, compress=True,
+                 coalesce=True, fields=None, rate_limiter=None, cache=None, hedge=None, circuit_breaker=None):
         self.billomat_id = billomat_id
         self.api_key = api_key
         self.app_id = app_id
         self.app_secret = app_secret
+        self.page_size = page_size
+        self.fields = fields
+        self.compress = compress
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.hedge = hedge
+        self.circuit_breaker = circuit_breaker
+        self.transfer_stats = TransferStats()
+        self.single_flight = SingleFlight(private_errors=(DeadlineExceeded, Cancelled)) if coalesce else None
+        self._local = threading.local()
 
         self.api_url = "https://{}.billomat.net/api/".format(billomat_id)
         self.session = requests.session()
         self.session.headers.update(
             {
                 'Accept': 'application/json',
+                'Accept-Encoding': 'gzip, deflate' if compress else 'identity',
                 'Content-Type': 'application/json',
                 'X-BillomatApiKey': self.api_key,
                 'X-AppId': self.app_id,
                 'X-AppSecret': self.app_secret,
             }
         )
+        if transport:
+            self.session.mount('https://', transport)
+            self.session.mount('http://', transport)
 
     def _create_get_request(self, resource, billomat_id='', command=None, params=None):
         """
@@ -55,12 +98,33 @@ class Billomapy(object):
 
             if isinstance(billomat_id, int):
                 billomat_id = str(billomat_id)
-        response = self.session.get(
-            url=self.api_url + resource + ('/' + billomat_id if billomat_id else '') + command,
+        url = self.api_url + resource + ('/' + billomat_id if billomat_id else '') + command
+        if not self.single_flight:
+            return self._send_request(method='GET', resource=resource, url=url, params=params)
+        return self.single_flight.do(
+            (url, tuple(sorted((key, str(value)) for key, value in params.items()))),
+            self._send_request,
+            wait=self._wait_for_call,
+            method='GET',
+            resource=resource,
+            url=url,
             params=params,
         )
 
-        return self._handle_response(response)
+    def _wait_for_call(self, event):
+        """
+        Waits for the coalesced request of another thread, but not longer than the deadline of this thread
+        and only until the operation of this thread is cancelled
+        """
+        deadline = getattr(self._local, 'deadline', None)
+        token = getattr(self._local, 'cancellation', None)
+        while True:
+            self._raise_if_cancelled()
+            timeout = deadline.check() if deadline else None
+            if token is not None:
+                timeout = POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL)
+            if event.wait(timeout):
+                return
 
     def _create_post_request(self, resource, send_data, billomat_id='', command=None):
         """
@@ -77,13 +141,13 @@ class Billomapy(object):
         else:
             command = '/' + command
 
-        response = self.session.post(
+        return self._send_request(
+            method='POST',
+            resource=resource,
             url=self.api_url + resource + ('/' + billomat_id if billomat_id else '') + command,
             data=json.dumps(send_data),
         )
 
-        return self._handle_response(response)
-
     def _create_put_request(self, resource, billomat_id, command=None, send_data=None):
         """
         Creates a put request and return the response data
@@ -98,13 +162,13 @@ class Billomapy(object):
         else:
             command = '/' + command
 
-        response = self.session.put(
+        return self._send_request(
+            method='PUT',
+            resource=resource,
             url=self.api_url + resource + '/' + billomat_id + command,
             data=json.dumps(send_data),
         )
 
-        return self._handle_response(response)
-
     def _create_delete_request(self, resource, billomat_id):
         """
         Creates a post request and return the response data
@@ -114,11 +178,239 @@ class Billomapy(object):
         if isinstance(billomat_id, int):
             billomat_id = str(billomat_id)
 
-        response = self.session.delete(
+        return self._send_request(
+            method='DELETE',
+            resource=resource,
             url=self.api_url + resource + '/' + billomat_id,
         )
 
-        return self._handle_response(response)
+    def _send_request(self, method, resource, url, params=None, data=None):
+        """
+        Sends the request with the session inside of a tracing span and return the response data
+
+        :param method: the http method e.g: GET
+        :param resource: the resource e.g: invoices
+        :param url: the full url
+        :param params: the query parameters
+        :param data: the serialized body
+        :return: the handled response
+        """
+        with tracing.span(
+            'billomapy.request',
+            {
+                tracing.METHOD: method,
+                tracing.RESOURCE: resource,
+                tracing.PAGE: params.get('page') if params else None,
+            }
+        ) as span:
+            cache_key = None
+            if method == 'GET' and self.cache and self.cache.caches(resource):
+                prepared_url = requests.Request(method, url, params=params).prepare().url
+                cache_key = self.cache.key(self.billomat_id, prepared_url)
+                body = self.cache.get(cache_key)
+                span.set_attribute(tracing.CACHE_HIT, body is not None)
+                if body is not None:
+                    self._local.response_size = len(body)
+                    return json.loads(body.decode('utf-8'))
+
+            try:
+                self._allow_request(resource)
+            except CircuitOpenError:
+                body = self.cache.get(cache_key, stale=True) if cache_key else None
+                if body is None:
+                    raise
+                span.set_attribute(tracing.STALE, True)
+                self._local.response_size = len(body)
+                return json.loads(body.decode('utf-8'))
+
+            try:
+                self._acquire_rate_limit(INTERACTIVE)
+                timeout = self._operation_timeout()
+            except BaseException:
+                self._cancel_request(resource)
+                raise
+            start = time.monotonic()
+            try:
+                if self.hedge and self.hedge.applies(method, resource, params):
+                    response = self.hedge.request(
+                        functools.partial(
+                            self.session.request, method=method, url=url, params=params, stream=True, timeout=timeout
+                        ),
+                        self._try_acquire_hedge,
+                    )
+                else:
+                    response = self.session.request(method=method, url=url, params=params, data=data, timeout=timeout)
+            except requests.RequestException as e:
+                self._record_request_error(resource, start, e)
+                raise
+            self._count_transfer(response)
+            self._record_request(resource, start, failed=response.status_code >= 500)
+            span.set_attribute(tracing.STATUS_CODE, response.status_code)
+            if cache_key and response.status_code == requests.codes.ok:
+                self.cache.set(cache_key, resource, response.content)
+            elif method != 'GET' and self.cache and self.cache.caches(resource) and 200 <= response.status_code < 300:
+                self.cache.invalidate(resource)
+            if response.status_code == requests.codes.too_many_requests:
+                # rate_limit_exceeded is the place where the request gets retried
+                span.set_attribute(tracing.RETRY, True)
+            return self._handle_response(response)
+
+    @contextlib.contextmanager
+    def priority(self, priority):
+        """
+        Sets the priority of the requests of this thread inside of the with block
+        Without it get_all_* and iter_all pages are BULK and all other requests INTERACTIVE.
+
+            with billomapy.priority(INTERACTIVE):
+                billomapy.get_all_items_of_invoice(42)
+
+        :param priority: ratelimit.INTERACTIVE or ratelimit.BULK
+        """
+        previous = getattr(self._local, 'priority', None)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """
+        Sets a deadline for all requests of this thread inside of the with block
+        Every request gets the time which is left as timeout, get_all_* and get_invoices return a
+        deadline.PartialResult and iter_all stops, when the deadline is exceeded.
+
+            with billomapy.deadline(5.0) as deadline:
+                invoices = billomapy.get_all_invoices()
+
+        :param seconds: how long all requests together may take
+        :return: deadline.Deadline, its exceeded is True if results are missing
+        """
+        previous = getattr(self._local, 'deadline', None)
+        deadline = self._local.deadline = Deadline(seconds, parent=previous)
+        try:
+            yield deadline
+        finally:
+            self._local.deadline = previous
+
+    @contextlib.contextmanager
+    def cancellation(self, token):
+        """
+        Makes the requests of this thread inside of the with block cancellable by the token
+        After token.cancel() no new request starts, get_all_* and get_invoices return a deadline.PartialResult,
+        iter_all stops and a streamed page is closed while it is read.
+
+            token = CancellationToken()
+            with billomapy.cancellation(token):
+                invoices = billomapy.get_all_invoices()
+
+        :param token: cancellation.CancellationToken, which can be cancelled from any thread
+        """
+        previous = getattr(self._local, 'cancellation', None)
+        self._local.cancellation = token
+        try:
+            yield token
+        finally:
+            self._local.cancellation = previous
+
+    def _raise_if_cancelled(self):
+        token = getattr(self._local, 'cancellation', None)
+        if token is not None:
+            token.raise_if_cancelled()
+
+    def _operation_timeout(self):
+        """
+        Returns the seconds which are left for the next request of this thread, None without deadline
+
+        :raises Cancelled: if the operation of this thread is cancelled
+        """
+        self._raise_if_cancelled()
+        deadline = getattr(self._local, 'deadline', None)
+        return deadline.check() if deadline else None
+
+    def _propagate_context(self, function):
+        """
+        Returns function, which runs with the deadline, cancellation and priority of this thread in a worker thread
+        """
+        deadline = getattr(self._local, 'deadline', None)
+        cancellation = getattr(self._local, 'cancellation', None)
+        priority = getattr(self._local, 'priority', None)
+
+        def run(*args, **kwargs):
+            self._local.deadline = deadline
+            self._local.cancellation = cancellation
+            self._local.priority = priority
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.deadline = None
+                self._local.cancellation = None
+                self._local.priority = None
+
+        return run
+
+    def _acquire_rate_limit(self, default_priority):
+        if not self.rate_limiter:
+            return
+        deadline = getattr(self._local, 'deadline', None)
+        if (deadline and hasattr(self.rate_limiter, 'wait_time') and
+                self.rate_limiter.wait_time() > deadline.remaining()):
+            # the budget is not back before the deadline, so do not wait for it
+            deadline.expire()
+        if isinstance(self.rate_limiter, PriorityRateLimiter):
+            priority = getattr(self._local, 'priority', None)
+            self.rate_limiter.acquire(priority=default_priority if priority is None else priority)
+        else:
+            self.rate_limiter.acquire()
+
+    def _allow_request(self, resource):
+        if self.circuit_breaker:
+            self.circuit_breaker.allow(self.billomat_id, resource)
+
+    def _cancel_request(self, resource):
+        if self.circuit_breaker:
+            self.circuit_breaker.cancel(self.billomat_id, resource)
+
+    def _record_request(self, resource, start, failed):
+        if self.circuit_breaker:
+            self.circuit_breaker.record(self.billomat_id, resource, time.monotonic() - start, failed=failed)
+
+    def _record_request_error(self, resource, start, error):
+        """
+        Records a failed request, but raises DeadlineExceeded for a timeout caused by the deadline of this thread,
+        which is not counted as failure of billomat
+        """
+        deadline = getattr(self._local, 'deadline', None)
+        if isinstance(error, requests.Timeout) and deadline and deadline.remaining() <= 0:
+            self._cancel_request(resource)
+            deadline.expire()
+        self._record_request(resource, start, failed=True)
+
+    def _try_acquire_hedge(self):
+        """
+        Takes a token of the rate limiter for a hedge, returns False if there is none left
+        """
+        if not self.rate_limiter:
+            return True
+        if isinstance(self.rate_limiter, PriorityRateLimiter):
+            priority = getattr(self._local, 'priority', None)
+            return self.rate_limiter.try_acquire(priority=INTERACTIVE if priority is None else priority)
+        return self.rate_limiter.try_acquire()
+
+    def _count_transfer(self, response):
+        """
+        Adds the compressed and uncompressed size of the response to the transfer stats
+        """
+        uncompressed_bytes = len(response.content)
+        compressed_bytes = 0
+        if hasattr(response.raw, 'tell'):
+            # urllib3 counts the bytes it read from the wire, before decoding
+            compressed_bytes = response.raw.tell()
+        if not compressed_bytes:
+            compressed_bytes = int(response.headers.get('Content-Length') or uncompressed_bytes)
+
+        self.transfer_stats.add(compressed_bytes, uncompressed_bytes, response.headers.get('Content-Encoding'))
+        self._local.response_size = uncompressed_bytes
 
     def _handle_response(self, response):
         """
@@ -151,30 +443,231 @@ class Billomapy(object):
         else:
             response.raise_for_status()
 
-    @staticmethod
-    def _iterate_through_pages(get_function, resource, **kwargs):
+    def _iter_pages(self, get_function, resource, fields=None, span=tracing.NOOP_SPAN, **kwargs):
+        """
+        Iterate through all pages and yield every page which has data
+        The per_page of every page is chosen by the page size strategy of the resource
+        The records of every page are projected to the fields as soon as it is parsed.
+        :rtype: generator
+        """
+        page_size = resolve_page_size(self.page_size, resource, default=1000)
+        fields = resolve_fields(fields or self.fields, resource)
+        offset = 0
+        pages = 0
+        per_page = page_size.per_page(resource, offset)
+
+        while True:
+            start = time.time()
+            priority = getattr(self._local, 'priority', None)
+            with self.priority(BULK if priority is None else priority):
+                temp_response = get_function(page=offset // per_page + 1, per_page=per_page, **kwargs)
+            total = int(temp_response[resource]['@total'])
+            per_page = int(temp_response[resource]['@per_page'])
+            page_size.observe(
+                resource,
+                records=min(per_page, total - offset),
+                seconds=time.time() - start,
+                size=getattr(self._local, 'response_size', 0),
+            )
+            offset += per_page
+            pages += 1
+            span.set_attribute(tracing.PAGES, pages)
+            if total != 0:
+                yield project_page(temp_response, resource, fields)
+
+            if offset >= total:
+                break
+            next_per_page = page_size.per_page(resource, offset, current=per_page)
+            # billomat may answer with less per_page than requested, then the offset decides
+            if offset % next_per_page == 0:
+                per_page = next_per_page
+
+    def _iterate_through_pages(self, get_function, resource, **kwargs):
         """
         Iterate through all pages and return the collected data
         :rtype: list
         """
+        with tracing.span('billomapy.get_all', {tracing.RESOURCE: resource}) as span:
+            pages = []
+            try:
+                for page in self._iter_pages(get_function, resource, span=span, **kwargs):
+                    pages.append(page)
+            except DeadlineExceeded:
+                span.set_attribute(tracing.DEADLINE_EXCEEDED, True)
+                return PartialResult(pages)
+            except Cancelled:
+                span.set_attribute(tracing.CANCELLED, True)
+                return PartialResult(pages)
+            return pages
+
+    def iter_all(self, resource, params=None, fields=None, stream=False, process=None):
+        """
+        Iterate over all records of a resource, only one page is held in memory at a time
+
+        :param resource: the resource e.g: INVOICES
+        :param params: search params e.g: a query.Query, sub collections need their parent e.g: {'invoice_id': 42}
+        :param fields: only keep these fields of every record. Default: the fields of the client for the resource
+        :param stream: parse every page while it arrives and yield each record as soon as it is parsed, needs ijson
+        :param process: a processing.ProcessStage, its function runs over the records in a process pool
+                        while the next pages are fetched, the results are yielded in order
+        :return: generator of dicts or of the results of the process stage
+        """
+        span = tracing.start_span('billomapy.iter_all', {tracing.RESOURCE: resource})
+        try:
+            if stream:
+                records = self._iter_streamed_records(resource, params, fields, span)
+            else:
+                records = self._iter_page_records(resource, params, fields, span)
+            if process:
+                records = process.map(records)
+            for record in records:
+                yield record
+        except DeadlineExceeded:
+            span.set_attribute(tracing.DEADLINE_EXCEEDED, True)
+        except Cancelled:
+            span.set_attribute(tracing.CANCELLED, True)
+        finally:
+            span.end()
+
+    def aggregate(self, resource, group_by=None, fields=(), params=None, stream=False):
+        """
+        Aggregates all records of a resource while the pages arrive, without keeping them
+
+            billomapy.aggregate(INVOICES, group_by='status', fields=['open_amount'], params={'client_id': 42})
+
+        :param resource: the resource e.g: INVOICES
+        :param group_by: a field, a tuple of fields or a function of the record e.g: aggregation.month('date')
+        :param fields: the numeric fields which are summed as Decimal
+        :param params: search params e.g: a query.Query
+        :param stream: parse the pages while they arrive, needs ijson
+        :return: dict of group key and dict of count and per field a dict of count, sum, min and max
+        """
+        aggregation = Aggregation(group_by, fields)
+        key_fields = aggregation.key_fields
+        projection = key_fields + list(fields) if key_fields is not None else None
+        return aggregation.update(self.iter_all(resource, params=params, fields=projection, stream=stream)).result()
+
+    def sequence(self, resource, params=None, per_page=100, max_pages=16, fields=None):
+        """
+        Returns a lazy sequence of the records of a resource, which only fetches the pages of the requested records
+
+            invoices = billomapy.sequence(INVOICES)
+            len(invoices)   # only the first page
+            invoices[-50:]  # only the last pages
+
+        :param resource: the resource e.g: INVOICES
+        :param params: search params e.g: a query.Query, sub collections need their parent e.g: {'invoice_id': 42}
+        :param per_page: records per page. Default: 100
+        :param max_pages: how many loaded pages are kept. Default: 16
+        :param fields: only keep these fields of every record. Default: the fields of the client for the resource
+        :return: sequence.PagedSequence
+        """
+        return PagedSequence(
+            functools.partial(self._get_resource_per_page, resource, params=params),
+            resource,
+            per_page=per_page,
+            max_pages=max_pages,
+            fields=resolve_fields(fields or self.fields, resource),
+        )
 
-        request_data = True
-        data = []
-        page = 1
-
-        while request_data:
-            temp_response = get_function(page=page, **kwargs)
-            if temp_response[resource]['@total'] != '0':
-                data.append(temp_response)
-
-            page += 1
-            if page > int(
-                math.ceil(
-                    float(temp_response[resource]['@total']) / float(temp_response[resource]['@per_page'])
+    def _iter_page_records(self, resource, params, fields, span):
+        for page in self._iter_pages(
+            functools.partial(self._get_resource_per_page, resource),
+            resource,
+            fields=fields,
+            span=span,
+            params=params,
+        ):
+            for record in self.resolve_response_data(resource, DATA_KEYS[resource], page):
+                yield record
+
+    def _iter_streamed_records(self, resource, params, fields, span):
+        """
+        Iterate through all pages like _iter_pages, but yield the records while every page is parsed
+        """
+        page_size = resolve_page_size(self.page_size, resource, default=1000)
+        fields = resolve_fields(fields or self.fields, resource)
+        offset = 0
+        pages = 0
+        per_page = page_size.per_page(resource, offset)
+
+        while True:
+            start = time.time()
+            page_info = {}
+            for record in self._stream_page(resource, offset // per_page + 1, per_page, params, page_info):
+                yield project(record, fields) if fields else record
+            if '@total' not in page_info:
+                # the failed response was handled by rate_limit_exceeded, so the page is requested again
+                continue
+
+            total = int(page_info['@total'])
+            per_page = int(page_info['@per_page'])
+            page_size.observe(
+                resource,
+                records=min(per_page, total - offset),
+                seconds=time.time() - start,
+                size=getattr(self._local, 'response_size', 0),
+            )
+            offset += per_page
+            pages += 1
+            span.set_attribute(tracing.PAGES, pages)
+
+            if offset >= total:
+                break
+            next_per_page = page_size.per_page(resource, offset, current=per_page)
+            if offset % next_per_page == 0:
+                per_page = next_per_page
+
+    def _stream_page(self, resource, page, per_page, params, page_info):
+        """
+        Requests a list page with a streamed body and yields its records while they arrive
+        Streamed requests are never coalesced, every caller gets its own response.
+        """
+        params = dict(params or {}, per_page=per_page, page=page)
+        span = tracing.start_span(
+            'billomapy.request',
+            {tracing.METHOD: 'GET', tracing.RESOURCE: resource, tracing.PAGE: page}
+        )
+        try:
+            self._allow_request(resource)
+            try:
+                self._acquire_rate_limit(BULK)
+                timeout = self._operation_timeout()
+            except BaseException:
+                self._cancel_request(resource)
+                raise
+            start = time.monotonic()
+            try:
+                response = self.session.request(
+                    method='GET', url=self.api_url + resource, params=params, stream=True, timeout=timeout
                 )
-            ):
-                request_data = False
-        return data
+            except requests.RequestException as e:
+                self._record_request_error(resource, start, e)
+                raise
+            self._record_request(resource, start, failed=response.status_code >= 500)
+        except BaseException:
+            span.end()
+            raise
+        try:
+            span.set_attribute(tracing.STATUS_CODE, response.status_code)
+            if response.status_code != requests.codes.ok:
+                span.set_attribute(tracing.RETRY, response.status_code == requests.codes.too_many_requests)
+                self._handle_failed_response(response)
+                return
+
+            # urllib3 decodes gzip while reading and counts the bytes on the wire in tell()
+            response.raw.decode_content = True
+            body = streaming.CountingReader(response.raw)
+            for record in streaming.iter_records(body, resource, DATA_KEYS[resource], page_info):
+                self._raise_if_cancelled()
+                yield record
+
+            compressed_bytes = response.raw.tell() or body.bytes_read
+            self.transfer_stats.add(compressed_bytes, body.bytes_read, response.headers.get('Content-Encoding'))
+            self._local.response_size = body.bytes_read
+        finally:
+            response.close()
+            span.end()
 
     def _get_resource_per_page(self, resource, per_page=1000, page=1, params=None):
         """
@@ -186,11 +679,12 @@ class Billomapy(object):
         if not params:
             params = common_params
         else:
-            params.update(common_params)
+            # a copy, so the params of the caller e.g: a query.Query stay untouched
+            params = dict(params, **common_params)
         return self._create_get_request(resource=resource, params=params)
 
     @staticmethod
-    def resolve_response_data(head_key, data_key, data):
+    def resolve_response_data(head_key, data_key, data, index_keys=None):
         """
         Resolves the responses you get from billomat
         If you have done a get_one_element request then you will get a dictionary
@@ -199,6 +693,7 @@ class Billomapy(object):
         :param head_key: the head key e.g: CLIENTS
         :param data_key: the data key e.g: CLIENT
         :param data: the responses you got
+        :param index_keys: True or keys e.g: ['id', 'client_id'] to get an indexes.IndexedCollection instead of a list
         :return: dict or list
         """
         new_data = []
@@ -214,11 +709,98 @@ class Billomapy(object):
 
         else:
             if head_key in data and data_key in data[head_key]:
-                new_data += data[head_key][data_key]
+                if isinstance(data[head_key][data_key], list):
+                    new_data += data[head_key][data_key]
+                else:
+                    new_data.append(data[head_key][data_key])
             elif data_key in data:
                     return data[data_key]
+        if index_keys:
+            return indexed(new_data, index_keys)
         return new_data
 
+    def _eager_load(self, resource, get_function, document_ids, include, relations, max_workers):
+        """
+        Fetches documents and the included relations concurrently and stitches them together
+        Children are fetched once per document, parents like the client once per distinct id.
+
+        :param resource: the resource of the documents e.g: INVOICES
+        :param get_function: the function which gets one document
+        :param document_ids: the ids of the documents
+        :param include: the names of the relations e.g: ['client', 'items']
+        :param relations: dict of name and (parent key or None for children, fetch function, resource)
+        :param max_workers: how many requests run at the same time
+        :return: list of documents in the order of document_ids, with a key per included relation.
+                 A deadline.PartialResult without the documents and with None for the relations which missed
+                 the deadline or were cancelled
+        """
+        include = list(include or [])
+        unknown = [name for name in include if name not in relations]
+        if unknown:
+            raise ValueError('Unknown include {}, choose from {}'.format(unknown, sorted(relations)))
+
+        document_ids = [str(document_id) for document_id in document_ids]
+        unique_ids = list(dict.fromkeys(document_ids))
+        documents = {}
+        children = {}
+        parents = {}
+        resolved_parents = {}
+        missed = []
+
+        def resolve(relation_resource, future):
+            try:
+                return self.resolve_response_data(relation_resource, DATA_KEYS[relation_resource], future.result())
+            except (DeadlineExceeded, Cancelled):
+                missed.append(future)
+                return None
+
+        with tracing.span('billomapy.eager_load', {tracing.RESOURCE: resource}) as span, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            get_function = self._propagate_context(get_function)
+            document_futures = dict(
+                (executor.submit(get_function, document_id), document_id) for document_id in unique_ids
+            )
+            for name in include:
+                parent_key, fetch, _ = relations[name]
+                if not parent_key:
+                    fetch = self._propagate_context(fetch)
+                    for document_id in unique_ids:
+                        children[(name, document_id)] = executor.submit(fetch, document_id)
+
+            for future in as_completed(document_futures):
+                document = resolve(resource, future)
+                if document is None:
+                    continue
+                documents[document_futures[future]] = document
+                for name in include:
+                    parent_key, fetch, _ = relations[name]
+                    parent_id = document.get(parent_key) if parent_key else None
+                    if parent_id and (name, parent_id) not in parents:
+                        parents[(name, parent_id)] = executor.submit(self._propagate_context(fetch), parent_id)
+
+            result = []
+            for document_id in document_ids:
+                if document_id not in documents:
+                    continue
+                document = dict(documents[document_id])
+                for name in include:
+                    parent_key, _, relation_resource = relations[name]
+                    if parent_key:
+                        key = (name, document.get(parent_key))
+                        if key in parents and key not in resolved_parents:
+                            resolved_parents[key] = resolve(relation_resource, parents[key])
+                        document[name] = resolved_parents.get(key)
+                    else:
+                        document[name] = resolve(relation_resource, children[(name, document_id)])
+                result.append(document)
+
+            deadline = getattr(self._local, 'deadline', None)
+            token = getattr(self._local, 'cancellation', None)
+            if missed or (deadline is not None and deadline.exceeded) or (token is not None and token.cancelled):
+                span.set_attribute(tracing.DEADLINE_EXCEEDED, True)
+                return PartialResult(result)
+        return result
+
     def rate_limit_exceeded(self, response):
         """
         Overwrite this function to handle the rate limit exceeded error
@@ -984,6 +1566,35 @@ class Billomapy(object):
         """
         return self._create_get_request(resource=INVOICES, billomat_id=invoice_id)
 
+    def get_invoices(self, invoice_ids, include=None, max_workers=8):
+        """
+        Get many invoices with their related resources at once
+        All requests run concurrently and every client is only fetched once.
+
+        :param invoice_ids: the invoice ids
+        :param include: any of client, items, comments, payments, tags. Default: []
+        :param max_workers: how many requests run at the same time. Default: 8
+        :return: list of invoice dicts, every included relation is added under its name
+        """
+        return self._eager_load(
+            resource=INVOICES,
+            get_function=self.get_invoice,
+            document_ids=invoice_ids,
+            include=include,
+            relations={
+                'client': ('client_id', self.get_client, CLIENTS),
+                'items': (None, self.get_all_items_of_invoice, INVOICE_ITEMS),
+                'comments': (None, self.get_all_comments_of_invoice, INVOICE_COMMENTS),
+                'payments': (
+                    None,
+                    lambda invoice_id: self.get_all_invoice_payments(params={'invoice_id': invoice_id}),
+                    INVOICE_PAYMENTS,
+                ),
+                'tags': (None, self.get_all_tags_of_invoice, INVOICE_TAGS),
+            },
+            max_workers=max_workers,
+        )
+
     def create_invoice(self, invoice_dict):
         """
         Creates an invoice
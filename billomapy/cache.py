@@ -0,0 +1,235 @@
+"""
+Persistent on-disk cache for GET requests, shared by processes
+
+Short lived processes which read the same reference data start warm:
+
+    cache = FileCache('/var/cache/billomapy', ttl=3600)
+    billomapy = Billomapy('YOUR_COMPANY', 'API_KEY', 'APP_ID', 'APP_SECRET', cache=cache)
+    billomapy.get_all_units()  # from billomat once per hour, from disk for every other process
+
+Every entry is a file which is written to a temporary file and renamed, so readers never see half written entries.
+The eviction of the oldest entries above max_bytes is serialized over processes with a lock file.
+Every process keeps a running estimate of the size, the directory is only scanned when the estimate is above
+max_bytes or after scan_interval writes, because other processes write too.
+A successful POST, PUT or DELETE of a client removes the entries of its resource, see invalidate.
+"""
+import os
+import json
+import time
+import errno
+import hashlib
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .resources import *
+from .transport import request_key
+
+# Data which rarely changes and which is read by nearly every process
+REFERENCE_RESOURCES = (ARTICLES, UNITS, TEMPLATES, EMAIL_TEMPLATES, USERS)
+# The eviction frees some space below max_bytes, so the next writes do not scan the directory again
+EVICTION_TARGET = 0.9
+
+
+class FileCache(object):
+    """
+    :param directory: the cache directory, it is created if it does not exist
+    :param ttl: seconds an entry is valid, as int or dict per resource (None is the fallback key). Default: 3600
+    :param max_bytes: size of all entries, above which the oldest are evicted. Default: 100 MiB
+    :param resources: the resources which are cached, None caches every GET. Default: REFERENCE_RESOURCES
+    :param stale_ttl: seconds an expired entry is kept to answer requests while the circuit is open. Default: 0
+    :param scan_interval: writes after which the directory is scanned for its size again. Default: 100
+    """
+
+    def __init__(self, directory, ttl=3600, max_bytes=100 * 1024 * 1024, resources=REFERENCE_RESOURCES,
+                 stale_ttl=0, scan_interval=100):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.resources = resources
+        self.stale_ttl = stale_ttl
+        self.scan_interval = scan_interval
+        self.hits = 0
+        self.misses = 0
+        self.scans = 0
+        self._size = None
+        self._writes = 0
+        self._size_lock = threading.Lock()
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def caches(self, resource):
+        """
+        Returns if GET requests of the resource e.g: units or units/42 are cached
+        """
+        return self.resources is None or resource.split('/')[0] in self.resources
+
+    def _ttl(self, resource):
+        if isinstance(self.ttl, dict):
+            return self.ttl.get(resource.split('/')[0], self.ttl.get(None, 0))
+        return self.ttl
+
+    @staticmethod
+    def key(account, url):
+        """
+        Returns the key of a GET request of an account, independent of the order of the query parameters
+
+        :param account: the billomat_id
+        :param url: the full url with query parameters
+        :return: str
+        """
+        return hashlib.sha256('{} {}'.format(account, request_key('GET', url)).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, stale=False):
+        """
+        Returns the cached body or None if there is no valid entry
+
+        :param stale: also return entries which expired less than stale_ttl seconds ago
+        """
+        path = self._path(key)
+        now = time.time()
+        try:
+            with open(path, 'rb') as entry:
+                header = json.loads(entry.readline().decode('utf-8'))
+                if header['expires'] + (self.stale_ttl if stale else 0) < now:
+                    body = None
+                else:
+                    body = entry.read()
+        except (IOError, OSError, ValueError, KeyError):
+            body = None
+            header = None
+
+        if body is None:
+            self.misses += 1
+            if header is not None and header['expires'] + self.stale_ttl < now:
+                self._remove(path)
+            return None
+        self.hits += 1
+        return body
+
+    def set(self, key, resource, body):
+        """
+        Stores the body of a successful response
+
+        :param key: the key of the request
+        :param resource: the resource e.g: units, for the ttl
+        :param body: the response body as bytes
+        """
+        ttl = self._ttl(resource)
+        if ttl <= 0:
+            return
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        header = json.dumps({'expires': time.time() + ttl, 'resource': resource}).encode('utf-8')
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(descriptor, 'wb') as entry:
+                entry.write(header + b'\n')
+                entry.write(body)
+            os.replace(temp_path, path)
+        except BaseException:
+            self._remove(temp_path)
+            raise
+
+        with self._size_lock:
+            self._writes += 1
+            if self._size is not None:
+                self._size += len(header) + 1 + len(body) - replaced
+            scan = self._size is None or self._size > self.max_bytes or self._writes >= self.scan_interval
+        if scan:
+            self._evict()
+
+    def _entries(self):
+        for shard in os.listdir(self.directory):
+            shard_path = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_path):
+                continue
+            for name in os.listdir(shard_path):
+                if name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(shard_path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        """
+        Removes the oldest entries above max_bytes until the entries fit into EVICTION_TARGET of it
+        """
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = sorted(self._entries())
+            size = sum(entry_size for _, entry_size, _ in entries)
+            target = self.max_bytes * EVICTION_TARGET if size > self.max_bytes else self.max_bytes
+            for _, entry_size, path in entries:
+                if size <= target:
+                    break
+                self._remove(path)
+                size -= entry_size
+        with self._size_lock:
+            self.scans += 1
+            self._size = size
+            self._writes = 0
+
+    def invalidate(self, resource):
+        """
+        Removes the entries of a resource, because a write changed it
+        A write to units/42 removes the entries of units, units/42 and every other units/... request.
+        Every entry is read, so only resources which are rarely written should be cached.
+
+        :param resource: the written resource e.g: units/42
+        :return: how many entries were removed
+        """
+        resource = resource.split('/')[0]
+        removed, removed_bytes = 0, 0
+        for _, entry_size, path in list(self._entries()):
+            try:
+                with open(path, 'rb') as entry:
+                    header = json.loads(entry.readline().decode('utf-8'))
+                if header['resource'].split('/')[0] != resource:
+                    continue
+            except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError):
+                continue
+            self._remove(path)
+            removed += 1
+            removed_bytes += entry_size
+        with self._size_lock:
+            if self._size is not None:
+                self._size -= removed_bytes
+        return removed
+
+    def clear(self):
+        for _, _, path in list(self._entries()):
+            self._remove(path)
+        with self._size_lock:
+            self._size = None
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,67 @@
+"""
+Cooperative cancellation of bulk operations
+
+A token is handed to an operation and can be cancelled from any thread, e.g: by an operator.
+The operation starts no new request and returns the results which were collected until then:
+
+    token = CancellationToken()
+    threading.Timer(60, token.cancel).start()
+
+    with billomapy.cancellation(token):
+        invoices = billomapy.get_all_invoices()
+    if token.cancelled:
+        ...  # invoices is a deadline.PartialResult
+"""
+import threading
+
+# How often a thread, which waits for the request of another thread, checks its own token in seconds
+POLL_INTERVAL = 0.05
+
+
+class Cancelled(Exception):
+    """
+    Raised when a request would start after its operation was cancelled
+    """
+
+
+class CancellationToken(object):
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """
+        Cancels the operations of the token and runs its callbacks once
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise Cancelled('The operation was cancelled')
+
+    def add_callback(self, callback):
+        """
+        Runs callback() when the token is cancelled, at once if it already is
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
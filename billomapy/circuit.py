@@ -0,0 +1,149 @@
+"""
+Circuit breaker which fails fast while billomat is down
+
+The breaker tracks the failed and slow requests per account and endpoint family (e.g: invoices for
+invoices/42/pdf). When too many of the latest requests failed, the circuit opens and every further request
+fails immediately with CircuitOpenError, or is answered from the stale entries of the cache of the client.
+After reset_timeout a few probe requests are let through, the circuit closes again when they succeed:
+
+    breaker = CircuitBreaker(failure_rate=0.5, slow_call=5.0, reset_timeout=30)
+    billomapy = Billomapy('YOUR_COMPANY', 'API_KEY', 'APP_ID', 'APP_SECRET', circuit_breaker=breaker)
+    flood_billomapy = FloodBillomapy('YOUR_COMPANY', 'API_KEY', 'APP_ID', 'APP_SECRET', circuit_breaker=breaker)
+
+One breaker can be shared by both clients and by all threads.
+"""
+import time
+import threading
+import collections
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while the circuit of its account and endpoint family is open
+    """
+
+    def __init__(self, account, family, retry_after):
+        super(CircuitOpenError, self).__init__(
+            'The circuit of {} {} is open, retry after {:.1f} seconds'.format(account, family, retry_after)
+        )
+        self.account = account
+        self.family = family
+        self.retry_after = retry_after
+
+
+class _Circuit(object):
+
+    def __init__(self):
+        self.state = CLOSED
+        self.calls = collections.deque()
+        self.opened_at = 0.0
+        self.probes = 0
+
+
+class CircuitBreaker(object):
+    """
+    :param failure_rate: share of failed requests in the window, which opens the circuit. Default: 0.5
+    :param min_requests: how many requests the window needs before the circuit may open. Default: 10
+    :param window: seconds of requests which are considered. Default: 30
+    :param slow_call: seconds after which a successful request counts as failed. Default: None
+    :param reset_timeout: seconds the circuit stays open before it probes. Default: 30
+    :param half_open_probes: how many probe requests run at the same time. Default: 1
+    """
+
+    def __init__(self, failure_rate=0.5, min_requests=10, window=30.0, slow_call=None, reset_timeout=30.0,
+                 half_open_probes=1):
+        assert (0 < failure_rate <= 1 and min_requests > 0 and half_open_probes > 0)
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.rejected = 0
+        self._circuits = collections.defaultdict(_Circuit)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def family(resource):
+        """
+        Returns the endpoint family of a resource e.g: invoices for invoices/42/pdf
+        """
+        return (resource or '').split('/')[0]
+
+    def state(self, account, resource):
+        with self._lock:
+            return self._circuits[(account, self.family(resource))].state
+
+    def allow(self, account, resource):
+        """
+        Checks if a request may be sent, a half open circuit lets half_open_probes requests through
+
+        :raises CircuitOpenError: if the circuit is open
+        """
+        now = time.monotonic()
+        family = self.family(resource)
+        with self._lock:
+            circuit = self._circuits[(account, family)]
+            if circuit.state == OPEN:
+                if now - circuit.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(account, family, self.reset_timeout - (now - circuit.opened_at))
+                circuit.state = HALF_OPEN
+                circuit.probes = 0
+            if circuit.state == HALF_OPEN:
+                if circuit.probes >= self.half_open_probes:
+                    self.rejected += 1
+                    raise CircuitOpenError(account, family, 0.0)
+                circuit.probes += 1
+
+    def record(self, account, resource, seconds, failed=False):
+        """
+        Records the outcome of a request which allow() let through
+
+        :param account: the billomat_id
+        :param resource: the resource of the request
+        :param seconds: how long the request took
+        :param failed: if it failed with a server error or no response at all
+        """
+        failed = failed or (self.slow_call is not None and seconds > self.slow_call)
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits[(account, self.family(resource))]
+            if circuit.state == HALF_OPEN:
+                circuit.probes = max(circuit.probes - 1, 0)
+                if failed:
+                    self._open(circuit, now)
+                else:
+                    circuit.state = CLOSED
+                    circuit.calls.clear()
+                return
+            if circuit.state == OPEN:
+                # a request which was sent before the circuit opened
+                return
+
+            circuit.calls.append((now, failed))
+            while circuit.calls and circuit.calls[0][0] < now - self.window:
+                circuit.calls.popleft()
+            if len(circuit.calls) >= self.min_requests:
+                failures = sum(1 for _, call_failed in circuit.calls if call_failed)
+                if failures >= self.failure_rate * len(circuit.calls):
+                    self._open(circuit, now)
+
+    def cancel(self, account, resource):
+        """
+        Gives back a probe of allow() for a request which was not sent
+        """
+        with self._lock:
+            circuit = self._circuits[(account, self.family(resource))]
+            if circuit.state == HALF_OPEN:
+                circuit.probes = max(circuit.probes - 1, 0)
+
+    @staticmethod
+    def _open(circuit, now):
+        circuit.state = OPEN
+        circuit.opened_at = now
+        circuit.calls.clear()
@@ -0,0 +1,83 @@
+"""
+Single-flight deduplication of concurrent identical requests
+
+While a request for a key is in flight, every further call for the same key waits for it
+and gets the result (or exception) instead of sending its own request.
+The waiting callers get a deep copy of the result, so every caller may mutate its own.
+
+Errors which belong to the leading caller only, e.g: its deadline, are not handed to the waiting callers,
+they send the request themselves. A waiting caller can stop waiting on its own, e.g: at its own deadline.
+"""
+import copy
+import threading
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Runs a function at most once at a time per key, safe to use from multiple threads
+
+        single_flight = SingleFlight()
+        single_flight.do(('GET', url), send_request)
+
+    :param private_errors: exception types of the leader which are not handed to the waiting callers
+    """
+
+    def __init__(self, private_errors=()):
+        self.coalesced = 0
+        self.private_errors = tuple(private_errors)
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, wait=None, **kwargs):
+        """
+        Runs the function or waits for the call which is already running for the key
+
+        :param key: a hashable key e.g: the url and the params of a GET request
+        :param function: the function which sends the request
+        :param wait: called with the event of the running call instead of event.wait(), it may raise
+                     e.g: when the deadline of the waiting caller is exceeded
+        :return: the result of the function, a deep copy of it for the waiting callers
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    self.coalesced += 1
+
+            if leader:
+                break
+            if wait is None:
+                call.event.wait()
+            else:
+                wait(call.event)
+            if call.error is None:
+                return copy.deepcopy(call.result)
+            if not isinstance(call.error, self.private_errors):
+                raise call.error
+            # the leader failed for its own reason, try it again
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -1,11 +1,27 @@
+import io
 import json
 import math
+import heapq
 import logging
-import collections
+import itertools
+import contextlib
+
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
 
 from tornado import ioloop, httpclient
 from tornado.httputil import url_concat
 
+from . import tracing
+from .circuit import CircuitOpenError
+from .deadline import Deadline, PartialResult
+from .indexes import indexed
+from .metrics import TransferStats
+from .pagination import resolve_page_size
+from .projection import project_page, resolve_fields
+from .ratelimit import BULK, INTERACTIVE
 from .resources import *
 
 logger = logging.getLogger(__name__)
@@ -24,6 +40,7 @@ class BillomapyResponseError(Exception):
 class BillomapyParseError(Exception):
 
     def __init__(self, content):
+        super(BillomapyParseError, self).__init__(content)
         self.content = content
 
     def __str__(self):
@@ -41,17 +58,48 @@ class BillomapyRateLimitReachedError(Exception):
 
 class Billomapy(object):
 
-    def __init__(self, billomat_id, api_key, app_id, app_secret):
+    def __init__(self, billomat_id, api_key, app_id, app_secret, transport=None, page_size=None, compress=True,
+                 coalesce=True, fields=None, cache=None, max_in_flight=10, reserved_in_flight=2, circuit_breaker=None):
         """
         :param billomat_id: Mostly the name of your company for example https://YOUR_COMPANY.billomat.net/api/
         :param api_key: The api key that you requested from billomat
         :param app_id: The app_id that you requested by billomat
         :param app_secret: The app_secret that you requested by billomat
+        :param transport: A client with the fetch api of AsyncHTTPClient e.g: transport.ReplayHTTPClient
+        :param page_size: per_page as int, pagination.AdaptivePageSize or dict per resource. Default: 100
+        :param compress: Negotiate gzip compressed responses. Default: True
+        :param coalesce: Queued GET requests for an url which is in flight share its response. Default: True
+        :param fields: Only keep these fields of the records of paginated reads as list or dict per resource
+        :param cache: e.g: cache.FileCache, successful GET requests of its resources are answered from it
+        :param max_in_flight: how many requests run at the same time, the others wait ordered by priority.
+                              None hands every request to the http client at once. Default: 10
+        :param reserved_in_flight: slots of max_in_flight, which only interactive requests use. Default: 2
+        :param circuit_breaker: e.g: circuit.CircuitBreaker, while the circuit is open requests get the stale cache
+                                entry or are not sent, then start_requests raises circuit.CircuitOpenError after
+                                the other requests are done. Default: None
         """
         self.billomat_id = billomat_id
         self.api_key = api_key
         self.app_id = app_id
         self.app_secret = app_secret
+        self.page_size = page_size
+        self.fields = fields
+        self.cache = cache
+        self.circuit_breaker = circuit_breaker
+        self.compress = compress
+        self.coalesce = coalesce
+        self.transfer_stats = TransferStats()
+        self.coalesced = 0
+        self._in_flight = {}
+        self.max_in_flight = max_in_flight
+        self.reserved_in_flight = reserved_in_flight
+        self.running = 0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._deadline = None
+        self._cancellation = None
+        self._generation = 0
+        self._circuit_error = None
 
         self.billomat_header = {
             'Accept': 'application/json',
@@ -62,13 +110,13 @@ class Billomapy(object):
         }
 
         self.api_url = "https://{}.billomat.net/api/".format(billomat_id)
-        self.http_client = httpclient.AsyncHTTPClient()
+        self.http_client = transport or httpclient.AsyncHTTPClient()
         self.request_counter = 0
         self.responses = []
 
     def gen_dict_extract(self, key, var):
-        if hasattr(var, 'iteritems'):
-            for k, v in var.iteritems():
+        if hasattr(var, 'items'):
+            for k, v in var.items():
                 if k == key:
                     yield v
                 if isinstance(v, dict):
@@ -80,8 +128,14 @@ class Billomapy(object):
                             yield result
 
     def _save_response_to_responses(self, response):
+        """
+        Parses the response and stores it, the records of list pages are projected to the fields of the resource
+        """
         try:
             temp_response_body = json.loads(response.body)
+            resource = getattr(response.request, 'resource', None)
+            if resource:
+                temp_response_body = project_page(temp_response_body, resource, resolve_fields(self.fields, resource))
             self.responses.append(temp_response_body)
         except (ValueError, TypeError) as e:
             if response.request.method != 'PUT' and response.request.method != 'DELETE' and response.body:
@@ -119,6 +173,7 @@ class Billomapy(object):
                 )
             )
 
+        resource = response.request.resource
         temp_response_body = self._save_response_to_responses(response)
         total = [total for total in self.gen_dict_extract('@total', temp_response_body)]
         per_page = [per_page for per_page in self.gen_dict_extract('@per_page', temp_response_body)]
@@ -127,15 +182,30 @@ class Billomapy(object):
             self._handle_request_counter()
             return
 
-        for page in range(1, int(math.ceil(float(total[0]) / float(per_page[0])))):
-            response.request.params['page'] = (
-                response.request.params['page'] + 1
-                if 'page' in response.request.params else 2
-            )
-
+        total = int(total[0])
+        per_page = int(per_page[0])
+        page = int(response.request.params.get('page', 1))
+        offset = page * per_page
+
+        page_size = resolve_page_size(self.page_size, resource, default=100)
+        page_size.observe(
+            resource,
+            records=min(per_page, total - offset + per_page),
+            seconds=response.request_time or 0.0,
+            size=len(response.body or b''),
+        )
+        # The remaining pages can only use a per_page which divides the records of the first page
+        next_per_page = page_size.per_page(resource, offset, current=per_page)
+        if offset % next_per_page != 0:
+            next_per_page = per_page
+
+        for next_page in range(offset // next_per_page + 1, int(math.ceil(float(total) / next_per_page)) + 1):
+            next_params = dict(response.request.params)
+            next_params.update({'page': next_page, 'per_page': next_per_page})
             self.queue_get_request(
-                resource=response.request.resource,
-                params=response.request.params,
+                resource=resource,
+                params=next_params,
+                priority=BULK,
             )
 
         self._handle_request_counter()
@@ -147,36 +217,236 @@ class Billomapy(object):
             connect_timeout=1000,
             request_timeout=1000,
             headers=self.billomat_header,
+            decompress_response=self.compress,
         )
 
         http_request.resource = resource
         http_request.params = params
         return http_request
 
-    def queue_pagination_request(self, resource, params=None):
+    def _fetch(self, http_request, callback, resource=None, params=None, priority=INTERACTIVE):
+        """
+        Fetches the request with a tracing span, which ends as soon as the response arrives
+        A GET for an url which is already in flight only adds its callback to the running fetch.
+        Above max_in_flight the request waits, interactive requests before bulk requests.
+
+        :return: False if the request was not queued, because the operation is cancelled or its circuit is open.
+                 The CircuitOpenError is kept for start_requests then.
+        """
+        if self._cancellation is not None and self._cancellation.cancelled:
+            # the operation is cancelled, so no new request is queued
+            return False
+        callback = self._drop_if_stale(callback)
+        cache_key = None
+        if self.cache and http_request.method == 'GET' and self.cache.caches(resource or ''):
+            cache_key = self.cache.key(self.billomat_id, http_request.url)
+            body = self.cache.get(cache_key)
+            if body is not None:
+                self.request_counter += 1
+                ioloop.IOLoop.instance().add_callback(
+                    callback, httpclient.HTTPResponse(http_request, 200, buffer=io.BytesIO(body))
+                )
+                return True
+
+        if self.circuit_breaker:
+            try:
+                self.circuit_breaker.allow(self.billomat_id, resource)
+            except CircuitOpenError as e:
+                body = self.cache.get(cache_key, stale=True) if cache_key else None
+                if body is None:
+                    # nothing is stored, start_requests raises the error
+                    self._circuit_error = self._circuit_error or e
+                    return False
+                self.request_counter += 1
+                ioloop.IOLoop.instance().add_callback(
+                    callback, httpclient.HTTPResponse(http_request, 200, buffer=io.BytesIO(body))
+                )
+                return True
+
+        if self.coalesce and http_request.method == 'GET':
+            waiting_callbacks = self._in_flight.get(http_request.url)
+            if waiting_callbacks is not None:
+                waiting_callbacks.append(callback)
+                self.coalesced += 1
+                self.request_counter += 1
+                return True
+
+            self._in_flight[http_request.url] = [callback]
+
+            def shared_callback(response):
+                for waiting_callback in self._in_flight.pop(http_request.url, []):
+                    waiting_callback(response)
+
+            callback = shared_callback
+
+        span = tracing.start_span(
+            'billomapy.request',
+            {
+                tracing.METHOD: http_request.method,
+                tracing.RESOURCE: resource,
+                tracing.PAGE: params.get('page') if params else None,
+            }
+        )
+
+        def traced_callback(response):
+            span.set_attribute(tracing.STATUS_CODE, response.code)
+            span.end()
+            self._count_transfer(response)
+            if self.circuit_breaker:
+                self.circuit_breaker.record(
+                    self.billomat_id, resource, response.request_time or 0.0, failed=response.code >= 500
+                )
+            if cache_key and response.code == 200:
+                self.cache.set(cache_key, resource, response.body)
+            elif (self.cache and http_request.method != 'GET' and self.cache.caches(resource or '') and
+                  200 <= response.code < 300):
+                self.cache.invalidate(resource)
+            callback(response)
+
+        heapq.heappush(self._queue, (priority, next(self._sequence), http_request, traced_callback, resource))
+        self.request_counter += 1
+        self._dispatch()
+        return True
+
+    def _dispatch(self):
+        """
+        Hands the queued requests to the http client while there are free slots
+        Bulk requests leave reserved_in_flight slots free for interactive requests.
+        """
+        while self._queue:
+            priority = self._queue[0][0]
+            if self.max_in_flight is not None:
+                limit = self.max_in_flight if priority == INTERACTIVE else self.max_in_flight - self.reserved_in_flight
+                if self.running >= max(limit, 1):
+                    return
+            remaining = self._deadline.remaining() if self._deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                # tornado takes a timeout of 0 as its default, so the request would run unbounded.
+                # It stays queued until the operation is aborted at its deadline.
+                self._deadline.exceeded = True
+                return
+            _, _, http_request, callback, _ = heapq.heappop(self._queue)
+            if remaining is not None:
+                # no request may run longer than the operation has left
+                http_request.connect_timeout = min(http_request.connect_timeout or remaining, remaining)
+                http_request.request_timeout = min(http_request.request_timeout or remaining, remaining)
+            self.running += 1
+            self.http_client.fetch(http_request, self._make_dispatch_callback(callback))
+
+    def _make_dispatch_callback(self, callback):
+        def dispatch_callback(response):
+            self.running -= 1
+            try:
+                callback(response)
+            finally:
+                self._dispatch()
+
+        return dispatch_callback
+
+    def _drop_if_stale(self, callback):
+        """
+        Returns callback, which ignores the response if the operation was aborted by its deadline meanwhile
+        """
+        generation = self._generation
+
+        def current_callback(response):
+            if generation == self._generation:
+                callback(response)
+
+        return current_callback
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """
+        Sets a deadline for the operations inside of the with block
+        Every request gets the time which is left as timeout. When the deadline is exceeded the queued requests
+        are dropped, the responses of the running ones are ignored and the data methods return the responses
+        which arrived until then as deadline.PartialResult.
+
+            with billomapy.deadline(5.0) as deadline:
+                items = billomapy.get_all_invoice_items(invoice_ids)
+
+        :param seconds: how long all requests together may take
+        :return: deadline.Deadline, its exceeded is True if responses are missing
+        """
+        previous = self._deadline
+        self._deadline = Deadline(seconds, parent=previous)
+        try:
+            yield self._deadline
+        finally:
+            self._deadline = previous
+
+    @contextlib.contextmanager
+    def cancellation(self, token):
+        """
+        Makes the operations inside of the with block cancellable by the token, also from other threads
+        After token.cancel() no new request is queued, the queued requests are dropped, the responses of the
+        running ones are ignored and the data methods return the responses which arrived until then
+        as deadline.PartialResult.
+
+            token = CancellationToken()
+            with billomapy.cancellation(token):
+                items = billomapy.get_all_invoice_items(invoice_ids)
+
+        :param token: cancellation.CancellationToken
+        """
+        previous = self._cancellation
+        self._cancellation = token
+        try:
+            yield token
+        finally:
+            self._cancellation = previous
+
+    def _abort(self):
+        """
+        Aborts the outstanding requests of the operation, because its deadline is exceeded or it is cancelled
+        """
+        self._generation += 1
+        if self.circuit_breaker:
+            for _, _, _, _, resource in self._queue:
+                self.circuit_breaker.cancel(self.billomat_id, resource)
+        self._queue = []
+        self._in_flight = {}
+        self.request_counter = 0
+
+    def _count_transfer(self, response):
+        """
+        Adds the compressed and uncompressed size of the response to the transfer stats
+        Tornado removes the Content-Encoding header when it decompresses, but keeps the Content-Length
+        """
+        uncompressed_bytes = len(response.body or b'')
+        compressed_bytes = int(response.headers.get('Content-Length') or uncompressed_bytes)
+        encoding = response.headers.get('X-Consumed-Content-Encoding') or response.headers.get('Content-Encoding')
+        self.transfer_stats.add(compressed_bytes, uncompressed_bytes, encoding)
+
+    def queue_pagination_request(self, resource, params=None, priority=BULK):
         if not params:
             params = {}
 
-        self.http_client.fetch(
+        self._fetch(
             self._create_http_get_request(resource, params),
-            self.handle_pagination_request
+            self.handle_pagination_request,
+            resource=resource,
+            params=params,
+            priority=priority,
         )
-        self.request_counter += 1
 
-    def queue_get_request(self, resource, params=None):
+    def queue_get_request(self, resource, params=None, priority=INTERACTIVE):
         if not params:
             params = {}
-        self.http_client.fetch(
+        self._fetch(
             self._create_http_get_request(resource, params),
-            self.handle_request
+            self.handle_request,
+            resource=resource,
+            params=params,
+            priority=priority,
         )
-        self.request_counter += 1
 
     def queue_post_request(self, resource, post_data, params=None):
         if not params:
             params = {}
 
-        self.http_client.fetch(
+        self._fetch(
             httpclient.HTTPRequest(
                 url=url_concat(self.api_url + resource, params),
                 method='POST',
@@ -184,16 +454,18 @@ class Billomapy(object):
                 connect_timeout=500,
                 request_timeout=500,
                 headers=self.billomat_header,
+                decompress_response=self.compress,
             ),
-            self.handle_request
+            self.handle_request,
+            resource=resource,
+            params=params,
         )
-        self.request_counter += 1
 
     def queue_put_request(self, resource, put_data, params):
         if not params:
             params = {}
 
-        self.http_client.fetch(
+        self._fetch(
             httpclient.HTTPRequest(
                 url=url_concat(self.api_url + resource, params),
                 method='PUT',
@@ -201,59 +473,108 @@ class Billomapy(object):
                 connect_timeout=500,
                 request_timeout=500,
                 headers=self.billomat_header,
+                decompress_response=self.compress,
             ),
-            self.handle_request
+            self.handle_request,
+            resource=resource,
+            params=params,
         )
-        self.request_counter += 1
 
     def queue_delete_request(self, resource, params):
         if not params:
             params = {}
 
-        self.http_client.fetch(
+        self._fetch(
             httpclient.HTTPRequest(
                 url=url_concat(self.api_url + resource, params),
                 method='DELETE',
                 connect_timeout=500,
                 request_timeout=500,
                 headers=self.billomat_header,
+                decompress_response=self.compress,
             ),
-            self.handle_request
+            self.handle_request,
+            resource=resource,
+            params=params,
         )
-        self.request_counter += 1
 
     def start_requests(self):
+        """
+        Runs the queued requests until all responses are stored in responses
+
+        :raises CircuitOpenError: if a request was not sent, because its circuit is open
+        """
+        deadline, token = self._deadline, self._cancellation
+        if deadline is not None and deadline.remaining() <= 0:
+            deadline.exceeded = True
+        if (deadline is not None and deadline.exceeded) or (token is not None and token.cancelled):
+            self._abort()
         if self.request_counter > 0:
-            ioloop.IOLoop.instance().start()
+            io_loop = ioloop.IOLoop.instance()
+            generation = self._generation
+
+            def abort():
+                # only while the requests of this call are outstanding
+                if generation == self._generation and self.request_counter > 0:
+                    self._abort()
+                    io_loop.stop()
+
+            def exceed():
+                deadline.exceeded = True
+                abort()
+
+            def cancel():
+                # the token may be cancelled from another thread
+                io_loop.add_callback(abort)
+
+            timeout = io_loop.call_later(deadline.remaining(), exceed) if deadline is not None else None
+            if token is not None:
+                token.add_callback(cancel)
+            try:
+                io_loop.start()
+            finally:
+                if timeout:
+                    io_loop.remove_timeout(timeout)
+                if token is not None:
+                    token.remove_callback(cancel)
+        if (deadline is not None and deadline.exceeded) or (token is not None and token.cancelled):
+            self.responses = PartialResult(self.responses)
+        circuit_error, self._circuit_error = self._circuit_error, None
+        if circuit_error is not None:
+            raise circuit_error
 
     def _get_all_data(self, resource, params=None):
         self.responses = []
+        per_page = resolve_page_size(self.page_size, resource, default=100).per_page(resource, 0)
         if not params:
-            params = {'per_page': 100, 'page': 1}
+            params = {'per_page': per_page, 'page': 1}
         else:
-            temp_params = {'per_page': 100, 'page': 1}
+            temp_params = {'per_page': per_page, 'page': 1}
             temp_params.update(params)
             params = temp_params
 
-        self.queue_pagination_request(resource, params)
-        self.start_requests()
+        with tracing.span('billomapy.get_all', {tracing.RESOURCE: resource}):
+            self.queue_pagination_request(resource, params)
+            self.start_requests()
         return self.responses
 
     def _get_item_data(self, resource, foreign_ids, foreign_key, params=None):
-        assert (isinstance(foreign_ids, collections.Iterable))
+        assert (isinstance(foreign_ids, Iterable))
         self.responses = []
+        per_page = resolve_page_size(self.page_size, resource, default=100).per_page(resource, 0)
         if not params:
-            params = {'per_page': 100, 'page': 1}
+            params = {'per_page': per_page, 'page': 1}
         else:
-            temp_params = {'per_page': 100, 'page': 1}
+            temp_params = {'per_page': per_page, 'page': 1}
             temp_params.update(params)
             params = temp_params
 
-        for foreign_id in foreign_ids:
-            temp_params = params.copy()
-            temp_params.update({foreign_key: foreign_id})
-            self.queue_pagination_request(resource, temp_params)
-        self.start_requests()
+        with tracing.span('billomapy.get_items', {tracing.RESOURCE: resource}):
+            for foreign_id in foreign_ids:
+                temp_params = params.copy()
+                temp_params.update({foreign_key: foreign_id})
+                self.queue_pagination_request(resource, temp_params)
+            self.start_requests()
         return self.responses
 
     def _get_specific_data(self, billomat_id, resource, params=None):
@@ -301,13 +622,18 @@ class Billomapy(object):
         self.start_requests()
         return self.responses
 
-    def resolve_response_data(self, responses, head_key=None, data_key=None):
+    def resolve_response_data(self, responses, head_key=None, data_key=None, index_keys=None):
+        """
+        :param index_keys: True or keys e.g: ['id', 'client_id'] to get an indexes.IndexedCollection instead of a list
+        """
         temp_data = []
         for response in responses:
             if head_key and data_key:
                 temp_data += self._resolve_group_response_data(response, head_key, data_key)
             elif not head_key and data_key:
                 temp_data += self._resolve_specific_response_data(response, data_key)
+        if index_keys:
+            return indexed(temp_data, index_keys)
         return temp_data
 
     def _resolve_group_response_data(self, response, head_key, data_key):
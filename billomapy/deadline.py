@@ -0,0 +1,65 @@
+"""
+Deadlines for operations which send many requests
+
+A deadline is shared by all requests of an operation. Every request gets the time which is left as timeout,
+no request is started after the deadline and get_all_* returns the pages which arrived until then:
+
+    with billomapy.deadline(5.0) as deadline:
+        invoices = billomapy.get_all_invoices()
+    if deadline.exceeded:
+        ...  # invoices is a PartialResult
+
+Inner deadlines never extend the outer one.
+"""
+import time
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a request would start or run after the deadline
+    """
+
+
+class Deadline(object):
+    """
+    :param seconds: how long the operation may take
+    :param parent: the deadline of the outer operation, the earlier one wins
+    """
+
+    def __init__(self, seconds, parent=None):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+        if parent is not None:
+            self.expires = min(self.expires, parent.expires)
+        self.parent = parent
+        self.exceeded = False
+
+    def remaining(self):
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def expire(self):
+        """
+        Marks the deadline as exceeded and raises DeadlineExceeded
+        """
+        self.exceeded = True
+        if self.parent is not None and self.parent.expires <= self.expires:
+            self.parent.exceeded = True
+        raise DeadlineExceeded('The deadline of {} seconds is exceeded'.format(self.seconds))
+
+    def check(self):
+        """
+        Returns the seconds which are left, to be used as timeout of the next request
+
+        :raises DeadlineExceeded: if no time is left
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            self.expire()
+        return remaining
+
+
+class PartialResult(list):
+    """
+    The results which arrived before the deadline, partial marks them as incomplete
+    """
+    partial = True
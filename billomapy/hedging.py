@@ -0,0 +1,126 @@
+"""
+Hedged requests for idempotent GET requests
+
+If the first attempt takes longer than a percentile of the latest latencies, a second attempt is sent
+and the response which arrives first is used, the other one is closed:
+
+    billomapy = Billomapy('YOUR_COMPANY', 'API_KEY', 'APP_ID', 'APP_SECRET', hedge=HedgePolicy(percentile=95))
+    billomapy.get_invoice(42)
+
+A hedge is only sent if the rate limiter of the client has a token left for it.
+"""
+import time
+import threading
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .metrics import LatencyTracker
+
+
+class HedgePolicy(object):
+    """
+    :param percentile: the first attempt is hedged when it takes longer than this percentile of the latencies.
+                       Default: 95
+    :param min_delay: the shortest delay before a hedge in seconds. Default: 0.01
+    :param max_delay: the longest delay before a hedge in seconds. Default: None
+    :param initial_delay: the delay while fewer than min_samples latencies are known. Default: 1.0
+    :param min_samples: how many latencies are needed for the percentile. Default: 20
+    :param resources: the resources whose GET requests are hedged, None hedges every resource. Default: None
+    :param max_workers: threads which send the attempts. Default: 16
+    """
+
+    def __init__(self, percentile=95, min_delay=0.01, max_delay=None, initial_delay=1.0, min_samples=20,
+                 resources=None, max_workers=16):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.resources = resources
+        self.max_workers = max_workers
+        self.latency = LatencyTracker()
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='billomapy-hedge'
+                )
+            return self._executor
+
+    def applies(self, method, resource, params=None):
+        """
+        Returns if the request gets hedged, only GET requests of single records and no pages
+        """
+        if method != 'GET' or (params and 'page' in params):
+            return False
+        return self.resources is None or resource in self.resources
+
+    def delay(self):
+        """
+        Returns the seconds after which the first attempt gets hedged
+        """
+        if len(self.latency) < self.min_samples:
+            delay = self.initial_delay
+        else:
+            delay = self.latency.percentile(self.percentile)
+        delay = max(delay, self.min_delay)
+        if self.max_delay is not None:
+            delay = min(delay, self.max_delay)
+        return delay
+
+    def _timed(self, send):
+        start = time.monotonic()
+        response = send()
+        self.latency.add(time.monotonic() - start)
+        return response
+
+    def request(self, send, try_acquire=None):
+        """
+        Runs send() and once more if it takes longer than delay(), returns the response which arrives first
+
+        :param send: sends the request and returns the response, it should not read the body yet (stream=True)
+        :param try_acquire: returns if the budget allows a hedge e.g: rate_limiter.try_acquire
+        :return: the response
+        """
+        first = self.executor.submit(self._timed, send)
+        done, _ = wait([first], timeout=self.delay())
+        if done or (try_acquire is not None and not try_acquire()):
+            return first.result()
+
+        with self._lock:
+            self.hedged += 1
+        second = self.executor.submit(self._timed, send)
+        done, _ = wait([first, second], return_when=FIRST_COMPLETED)
+        winner = first if first in done and first.exception() is None else second
+        if winner is second and second.done() and second.exception() is not None:
+            # the hedge failed, so the first attempt decides
+            winner = first
+        loser = second if winner is first else first
+
+        response = winner.result()
+        if winner is second:
+            with self._lock:
+                self.hedge_wins += 1
+        if not loser.cancel():
+            loser.add_done_callback(_close_response)
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+def _close_response(future):
+    """
+    Closes the response of the attempt which lost, its body is not downloaded
+    """
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
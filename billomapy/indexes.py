@@ -0,0 +1,116 @@
+"""
+In-memory hash indexes over fetched collections
+
+    invoices = billomapy.resolve_response_data(INVOICES, INVOICE, billomapy.get_all_invoices(), index_keys=True)
+    payments = billomapy.resolve_response_data(INVOICE_PAYMENTS, INVOICE_PAYMENT, ..., index_keys=True)
+
+    for invoice in invoices.lookup('client_id', 42):
+        paid = payments.lookup('invoice_id', invoice['id'])
+"""
+from .resources import PARENT_KEYS
+
+DEFAULT_INDEX_KEYS = ('id', 'client_id', 'status') + tuple(sorted(set(PARENT_KEYS.values()) - {'client_id'}))
+
+
+def _normalize(value):
+    """
+    Billomat sends ids as strings, so 42 and '42' have to find the same records
+    """
+    return None if value is None else str(value)
+
+
+def _invalidating(method):
+    def wrapper(self, *args, **kwargs):
+        self._indexes.clear()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class IndexedCollection(list):
+    """
+    A list of records which builds a hash index per key on the first lookup of that key
+    Changing the list drops the indexes, they are built again on the next lookup.
+
+    :param records: the records e.g: the result of resolve_response_data
+    :param keys: the keys which can be looked up. Default: DEFAULT_INDEX_KEYS
+    """
+
+    def __init__(self, records=(), keys=DEFAULT_INDEX_KEYS):
+        super(IndexedCollection, self).__init__(records)
+        self.keys = tuple(keys)
+        self._indexes = {}
+
+    def _index(self, key):
+        if key not in self.keys:
+            raise KeyError('{} is not an index key, choose from {}'.format(key, self.keys))
+        index = self._indexes.get(key)
+        if index is None:
+            index = {}
+            for record in self:
+                index.setdefault(_normalize(record.get(key)), []).append(record)
+            self._indexes[key] = index
+        return index
+
+    def lookup(self, key, value):
+        """
+        Returns all records whose key equals the value
+
+        :param key: the index key e.g: invoice_id
+        :param value: the value e.g: 42
+        :return: list
+        """
+        return list(self._index(key).get(_normalize(value), ()))
+
+    def get(self, key, value, default=None):
+        """
+        Returns the first record whose key equals the value or default
+        """
+        records = self._index(key).get(_normalize(value))
+        return records[0] if records else default
+
+    def by_id(self, billomat_id, default=None):
+        return self.get('id', billomat_id, default)
+
+    def group_by(self, key):
+        """
+        Returns a dict of value and the list of records with that value
+        """
+        return dict((value, list(records)) for value, records in self._index(key).items())
+
+    def join(self, other, foreign_key, key='id'):
+        """
+        Joins every record with the records of another collection which reference it, in O(n + m)
+        e.g: invoices.join(items, 'invoice_id') yields (invoice, [items of invoice])
+
+        :param other: the IndexedCollection with the foreign key
+        :param foreign_key: the key in other which references key in this collection
+        :param key: the referenced key. Default: id
+        :return: generator of (record, list)
+        """
+        for record in self:
+            yield record, other.lookup(foreign_key, record.get(key))
+
+    append = _invalidating(list.append)
+    extend = _invalidating(list.extend)
+    insert = _invalidating(list.insert)
+    remove = _invalidating(list.remove)
+    pop = _invalidating(list.pop)
+    clear = _invalidating(list.clear)
+    __setitem__ = _invalidating(list.__setitem__)
+    __delitem__ = _invalidating(list.__delitem__)
+    __iadd__ = _invalidating(list.__iadd__)
+
+
+def indexed(records, index_keys=True):
+    """
+    Wraps records in an IndexedCollection
+
+    :param records: list of records
+    :param index_keys: True for DEFAULT_INDEX_KEYS or an iterable of keys
+    :return: IndexedCollection
+    """
+    if index_keys is True:
+        return IndexedCollection(records)
+    return IndexedCollection(records, keys=index_keys)
@@ -0,0 +1,99 @@
+"""
+Metrics which both clients collect about their requests
+"""
+import math
+import threading
+import collections
+
+
+class TransferStats(object):
+    """
+    Counts the responses of a client and their size on the wire (compressed) and after decoding (uncompressed)
+
+        billomapy.get_all_invoices()
+        print(billomapy.transfer_stats.as_dict())
+    """
+
+    def __init__(self):
+        self.responses = 0
+        self.compressed_responses = 0
+        self.compressed_bytes = 0
+        self.uncompressed_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, compressed_bytes, uncompressed_bytes, encoding=None):
+        """
+        Adds one response
+
+        :param compressed_bytes: size of the body on the wire
+        :param uncompressed_bytes: size of the decoded body
+        :param encoding: the content encoding of the response e.g: gzip
+        """
+        with self._lock:
+            self.responses += 1
+            self.compressed_bytes += compressed_bytes
+            self.uncompressed_bytes += uncompressed_bytes
+            if encoding and encoding != 'identity':
+                self.compressed_responses += 1
+
+    @property
+    def saved_bytes(self):
+        return self.uncompressed_bytes - self.compressed_bytes
+
+    @property
+    def ratio(self):
+        """
+        Uncompressed bytes per compressed byte, e.g: 10.0 if the responses compressed 10x
+        """
+        if not self.compressed_bytes:
+            return 1.0
+        return float(self.uncompressed_bytes) / self.compressed_bytes
+
+    def reset(self):
+        with self._lock:
+            self.responses = 0
+            self.compressed_responses = 0
+            self.compressed_bytes = 0
+            self.uncompressed_bytes = 0
+
+    def as_dict(self):
+        return {
+            'responses': self.responses,
+            'compressed_responses': self.compressed_responses,
+            'compressed_bytes': self.compressed_bytes,
+            'uncompressed_bytes': self.uncompressed_bytes,
+            'saved_bytes': self.saved_bytes,
+            'ratio': self.ratio,
+        }
+
+
+class LatencyTracker(object):
+    """
+    Keeps the latest latencies of requests to estimate their percentiles
+
+    :param size: how many latencies are kept. Default: 1000
+    """
+
+    def __init__(self, size=1000):
+        self._latencies = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def __len__(self):
+        return len(self._latencies)
+
+    def percentile(self, percentile):
+        """
+        Returns the latency below which percentile percent of the kept latencies are, None without latencies
+
+        :param percentile: e.g: 95
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        index = int(math.ceil(percentile / 100.0 * len(latencies))) - 1
+        return latencies[min(max(index, 0), len(latencies) - 1)]
@@ -0,0 +1,208 @@
+"""
+Local persistent mirror of Billomat data in SQLite
+
+The mirror syncs resources through the get_all_* functions of a Billomapy client and answers
+queries by client, invoice, status and date range locally:
+
+    mirror = BillomatMirror(billomapy, 'billomat.sqlite')
+    mirror.sync()
+    open_invoices = mirror.query(INVOICES, client_id=42, status='OPEN', date_from='2026-01-01')
+"""
+import json
+import time
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .deadline import PartialResult
+from .resources import *
+
+SYNCABLE_RESOURCES = (CLIENTS, INVOICES, INVOICE_ITEMS, INVOICE_PAYMENTS, ARTICLES)
+INDEXED_FIELDS = ('client_id', 'invoice_id', 'status', 'date')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    resource TEXT NOT NULL,
+    id TEXT NOT NULL,
+    client_id TEXT,
+    invoice_id TEXT,
+    status TEXT,
+    date TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (resource, id)
+);
+CREATE INDEX IF NOT EXISTS records_client_id ON records (resource, client_id);
+CREATE INDEX IF NOT EXISTS records_invoice_id ON records (resource, invoice_id);
+CREATE INDEX IF NOT EXISTS records_status_date ON records (resource, status, date);
+CREATE INDEX IF NOT EXISTS records_date ON records (resource, date);
+CREATE TABLE IF NOT EXISTS syncs (
+    resource TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL,
+    records INTEGER NOT NULL
+);
+"""
+
+
+class BillomatMirror(object):
+    """
+    Mirrors Billomat resources into an indexed SQLite database
+
+    :param billomapy: the Billomapy client which fetches the data
+    :param path: path of the SQLite database. Default: in memory
+    :param max_workers: how many invoices get their items fetched at the same time. Default: 8
+    """
+
+    def __init__(self, billomapy, path=':memory:', max_workers=8):
+        self.billomapy = billomapy
+        self.path = path
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def _fetch(self, resource, params=None):
+        """
+        Fetches all records of a resource through the get_all_* functions of the client
+
+        :return: list of records, a deadline.PartialResult if the deadline was exceeded or the sync was cancelled
+        """
+        if resource == CLIENTS:
+            data = self.billomapy.get_all_clients(params=params)
+        elif resource == INVOICES:
+            data = self.billomapy.get_all_invoices(params=params)
+        elif resource == INVOICE_PAYMENTS:
+            data = self.billomapy.get_all_invoice_payments(params=params)
+        elif resource == ARTICLES:
+            data = self.billomapy.get_all_articles(params=params)
+        elif resource == INVOICE_ITEMS:
+            data = self._fetch_invoice_items()
+        else:
+            raise ValueError('The mirror can not sync {}, choose from {}'.format(resource, SYNCABLE_RESOURCES))
+        records = self.billomapy.resolve_response_data(head_key=resource, data_key=DATA_KEYS[resource], data=data)
+        return PartialResult(records) if isinstance(data, PartialResult) else records
+
+    def _fetch_invoice_items(self):
+        """
+        Fetches the items of every mirrored invoice concurrently, Billomat only lists the items of one invoice
+        The workers run with the deadline and cancellation of the calling thread, like the eager loading.
+        """
+        invoice_ids = [invoice['id'] for invoice in self.query(INVOICES)]
+        fetch = self.billomapy._propagate_context(self.billomapy.get_all_items_of_invoice)
+        data = []
+        partial = False
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for pages in executor.map(fetch, invoice_ids):
+                partial = partial or isinstance(pages, PartialResult)
+                data += pages
+        return PartialResult(data) if partial else data
+
+    def sync(self, resources=SYNCABLE_RESOURCES, params=None):
+        """
+        Replaces the mirrored records of the resources with the current data of Billomat
+        Every resource is replaced in one transaction, so queries never see a half synced resource.
+        A resource which was only partly fetched, because the deadline was exceeded or the sync was cancelled,
+        keeps its mirrored records.
+        Sync INVOICES before INVOICE_ITEMS, the items are fetched per mirrored invoice.
+
+        :param resources: the resources to sync. Default: SYNCABLE_RESOURCES
+        :param params: search params for the get_all_* functions as dict per resource (None is the fallback key)
+                       e.g: {INVOICES: {'status': 'OPEN'}}, INVOICE_ITEMS take no params
+        :return: dict of resource and number of synced records, without the resources which were not replaced
+        """
+        params = params or {}
+        synced = {}
+        for resource in resources:
+            records = self._fetch(resource, params=params.get(resource, params.get(None)))
+            if isinstance(records, PartialResult):
+                continue
+            rows = [
+                (resource, str(record['id'])) +
+                tuple(record.get(field) for field in INDEXED_FIELDS) +
+                (json.dumps(record),)
+                for record in records
+            ]
+            with self._lock, self._connection:
+                self._connection.execute('DELETE FROM records WHERE resource = ?', (resource,))
+                self._connection.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)', (resource, time.time(), len(rows))
+                )
+            synced[resource] = len(rows)
+        return synced
+
+    def synced_at(self, resource):
+        """
+        Returns the unix timestamp of the last sync of the resource or None
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT synced_at FROM syncs WHERE resource = ?', (resource,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, resource, billomat_id):
+        """
+        Returns a mirrored record or None
+
+        :param resource: the resource e.g: invoices
+        :param billomat_id: the id of the record
+        :return: dict
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT data FROM records WHERE resource = ? AND id = ?', (resource, str(billomat_id))
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @staticmethod
+    def _where(resource, client_id=None, invoice_id=None, status=None, date_from=None, date_to=None):
+        conditions = ['resource = ?']
+        values = [resource]
+        if client_id is not None:
+            conditions.append('client_id = ?')
+            values.append(str(client_id))
+        if invoice_id is not None:
+            conditions.append('invoice_id = ?')
+            values.append(str(invoice_id))
+        if status is not None:
+            statuses = [status] if isinstance(status, str) else list(status)
+            conditions.append('status IN ({})'.format(', '.join('?' * len(statuses))))
+            values += statuses
+        if date_from is not None:
+            conditions.append('date >= ?')
+            values.append(date_from)
+        if date_to is not None:
+            conditions.append('date <= ?')
+            values.append(date_to)
+        return ' AND '.join(conditions), values
+
+    def query(self, resource, limit=None, **filters):
+        """
+        Returns the mirrored records of a resource which match all given filters, ordered by date and id
+
+        :param resource: the resource e.g: invoices
+        :param limit: maximum number of records
+        :param client_id: the client id
+        :param invoice_id: the invoice id, e.g: for INVOICE_ITEMS or INVOICE_PAYMENTS
+        :param status: a status or a list of statuses e.g: ['OPEN', 'OVERDUE']
+        :param date_from: first date (inclusive) e.g: 2026-01-01
+        :param date_to: last date (inclusive) e.g: 2026-12-31
+        :return: list
+        """
+        where, values = self._where(resource, **filters)
+        sql = 'SELECT data FROM records WHERE {} ORDER BY date, CAST(id AS INTEGER)'.format(where)
+        if limit is not None:
+            sql += ' LIMIT {:d}'.format(limit)
+        with self._lock:
+            rows = self._connection.execute(sql, values).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self, resource, **filters):
+        """
+        Returns how many mirrored records match the filters, see query
+        """
+        where, values = self._where(resource, **filters)
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM records WHERE ' + where, values).fetchone()[0]
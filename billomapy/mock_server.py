@@ -0,0 +1,441 @@
+"""
+Local stand-ins for the Billomat api and for a Redis server
+
+It serves generated, paginated fixtures for every resource in resources.DATA_KEYS
+and can inject latency, rate limit errors (429) and server errors (5xx).
+Use it for tests and benchmarks, it does not need any network access:
+
+    with MockBillomatServer(records={INVOICES: 5000}, latency=0.05) as server:
+        billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+        billomapy.api_url = server.api_url
+        billomapy.get_all_invoices()
+
+MockRedisServer speaks enough of the Redis protocol for ratelimit.RedisRateLimiter.
+"""
+import json
+import gzip
+import time
+import base64
+import random
+import threading
+import collections
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from urllib.parse import urlsplit, parse_qsl
+
+from .ratelimit import SLIDING_WINDOW_SCRIPT, SLIDING_WINDOW_SHA
+from .resources import *
+
+DOCUMENT_RESOURCES = (INVOICES, OFFERS, CREDIT_NOTES, CONFIRMATIONS, REMINDERS, DELIVERY_NOTES, LETTERS, RECURRINGS)
+STATUSES = ('DRAFT', 'OPEN', 'PAID', 'OVERDUE', 'CANCELED')
+PAGINATION_PARAMS = ('page', 'per_page', 'order_by')
+
+
+class MockBillomatServer(object):
+    """
+    Serves generated Billomat data on http://127.0.0.1:<port>/api/
+
+    :param records: How many records a resource has e.g: {INVOICES: 5000}. Default: default_records
+    :param default_records: How many records every other resource has. Default: 25
+    :param children_per_parent: How many records of a sub collection (e.g: invoice-items) belong to one parent
+    :param payload_bytes: Size of a filler field in every record to simulate fat rows
+    :param pdf_bytes: Size of the generated pdf files
+    :param latency: Seconds every response gets delayed
+    :param jitter: Maximum of random seconds which get added to the latency
+    :param rate_limit_rate: Probability of a 429 response
+    :param error_rate: Probability of a 500 response
+    :param compress: Gzip the responses if the client accepts it. Default: True
+    :param seed: Seed for the random generator, so runs are reproducible
+    :param port: The port to listen on. Default: a free port
+    """
+
+    def __init__(self, records=None, default_records=25, children_per_parent=3, payload_bytes=0, pdf_bytes=20000,
+                 latency=0.0, jitter=0.0, rate_limit_rate=0.0, error_rate=0.0, compress=True, seed=0, port=0):
+        self.records = records or {}
+        self.default_records = default_records
+        self.children_per_parent = children_per_parent
+        self.payload_bytes = payload_bytes
+        self.pdf_bytes = pdf_bytes
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.compress = compress
+        self.port = port
+
+        self.request_count = 0
+        self.requests_by_method = collections.Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._store = {}
+        self._server = None
+        self._thread = None
+
+    @property
+    def api_url(self):
+        return 'http://127.0.0.1:{}/api/'.format(self.port)
+
+    def start(self):
+        handler = type('Handler', (_MockBillomatHandler,), {'mock_server': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', self.port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _record_count(self, resource):
+        return self.records.get(resource, self.default_records)
+
+    def _make_record(self, resource, index):
+        record = {
+            'id': str(index),
+            'created': '2026-01-01T12:00:00+01:00',
+            'name': '{} {}'.format(DATA_KEYS[resource], index),
+            'date': '2026-{:02d}-{:02d}'.format(index % 12 + 1, index % 28 + 1),
+        }
+        if resource in PARENT_KEYS:
+            record[PARENT_KEYS[resource]] = str((index - 1) // self.children_per_parent + 1)
+        if resource in DOCUMENT_RESOURCES:
+            record.update({
+                'client_id': str(index % max(self._record_count(CLIENTS), 1) + 1),
+                'status': STATUSES[index % len(STATUSES)],
+                'invoice_number': 'RE{:06d}'.format(index),
+                'currency_code': 'EUR',
+                'total_net': '{:.2f}'.format(index * 10.0),
+                'total_gross': '{:.2f}'.format(index * 11.9),
+            })
+        if resource in (INVOICE_ITEMS, OFFER_ITEMS, CREDIT_NOTE_ITEMS, CONFIRMATION_ITEMS, REMINDER_ITEMS,
+                        DELIVERY_NOTE_ITEMS, RECURRING_ITEMS):
+            record.update({'quantity': '1', 'unit_price': '{:.2f}'.format(index * 1.5), 'title': 'Item'})
+        if resource in (INVOICE_PAYMENTS, INCOMING_PAYMENTS, CREDIT_NOTE_PAYMENTS):
+            record.update({'amount': '{:.2f}'.format(index * 5.0), 'type': 'BANK_TRANSFER'})
+        if self.payload_bytes:
+            record['note'] = 'x' * self.payload_bytes
+        return record
+
+    def _collection(self, resource):
+        """
+        Returns the ordered records of a resource and generates them on first access
+        """
+        with self._lock:
+            if resource not in self._store:
+                self._store[resource] = collections.OrderedDict(
+                    (str(index), self._make_record(resource, index))
+                    for index in range(1, self._record_count(resource) + 1)
+                )
+            return self._store[resource]
+
+    def _filter(self, records, params):
+        for key, value in params.items():
+            if key in PAGINATION_PARAMS:
+                continue
+            if key == 'from':
+                records = [record for record in records if record.get('date', '') >= value]
+            elif key == 'to':
+                records = [record for record in records if record.get('date', '') <= value]
+            else:
+                values = value.split(',')
+                records = [record for record in records if record.get(key) in values]
+        if params.get('order_by'):
+            # the last field is sorted first, the stable sorts keep its order for equal values of the former
+            for order in reversed(params['order_by'].split(',')):
+                field, _, direction = order.strip().partition(' ')
+                records.sort(key=lambda record: record.get(field, ''), reverse=direction.upper() == 'DESC')
+        return records
+
+    def list(self, resource, params):
+        per_page = int(params.get('per_page', 100))
+        page = int(params.get('page', 1))
+        records = self._filter(list(self._collection(resource).values()), params)
+        page_records = records[(page - 1) * per_page:page * per_page]
+
+        body = {
+            '@page': str(page),
+            '@per_page': str(per_page),
+            '@total': str(len(records)),
+        }
+        if len(page_records) == 1:
+            # Billomat returns a single element as dict instead of a list
+            body[DATA_KEYS[resource]] = page_records[0]
+        elif page_records:
+            body[DATA_KEYS[resource]] = page_records
+        return 200, {resource: body}
+
+    def get(self, resource, billomat_id, command=None):
+        record = self._collection(resource).get(billomat_id)
+        if record is None:
+            return 404, {'errors': {'error': 'Not found'}}
+        if command == PDF:
+            content = (b'%PDF-1.4 ' + str(billomat_id).encode('ascii') + b' ' * self.pdf_bytes)[:self.pdf_bytes]
+            return 200, {
+                'pdf': {
+                    'id': billomat_id,
+                    'created': record['created'],
+                    'filename': '{}_{}.pdf'.format(DATA_KEYS[resource], billomat_id),
+                    'mimetype': 'application/pdf',
+                    'filesize': str(len(content)),
+                    'base64file': base64.b64encode(content).decode('ascii'),
+                }
+            }
+        return 200, {DATA_KEYS[resource]: record}
+
+    def create(self, resource, data):
+        collection = self._collection(resource)
+        with self._lock:
+            record = dict(data.get(DATA_KEYS[resource], {}))
+            record['id'] = str(max([int(key) for key in collection] or [0]) + 1)
+            collection[record['id']] = record
+        return 201, {DATA_KEYS[resource]: record}
+
+    def update(self, resource, billomat_id, data, command=None):
+        collection = self._collection(resource)
+        if billomat_id not in collection:
+            return 404, {'errors': {'error': 'Not found'}}
+        if command:
+            return 200, None
+        with self._lock:
+            collection[billomat_id].update(data.get(DATA_KEYS[resource], {}))
+        return 200, {DATA_KEYS[resource]: collection[billomat_id]}
+
+    def delete(self, resource, billomat_id):
+        collection = self._collection(resource)
+        with self._lock:
+            collection.pop(billomat_id, None)
+        return 200, None
+
+    def handle(self, method, path, params, data):
+        """
+        Routes a request and returns the status code, the extra headers and the response body
+        """
+        with self._lock:
+            self.request_count += 1
+            self.requests_by_method[method] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter) if self.jitter else self.latency
+            fault = self._random.random()
+
+        if delay:
+            time.sleep(delay)
+        if fault < self.rate_limit_rate:
+            return 429, {'X-Rate-Limit-Remaining': '0', 'X-Rate-Limit-Reset': str(int(time.time()) + 1)}, None
+        if fault < self.rate_limit_rate + self.error_rate:
+            return 500, {}, {'errors': {'error': 'Internal Server Error'}}
+
+        parts = [part for part in path.split('/') if part][1:]
+        if not parts or parts[0] not in DATA_KEYS:
+            return 404, {}, {'errors': {'error': 'Unknown resource'}}
+        resource = parts[0]
+        billomat_id = parts[1] if len(parts) > 1 else None
+        command = parts[2] if len(parts) > 2 else None
+
+        if method == 'GET' and billomat_id is None:
+            status, body = self.list(resource, params)
+        elif method == 'GET':
+            status, body = self.get(resource, billomat_id, command)
+        elif method == 'POST' and billomat_id is None:
+            status, body = self.create(resource, data)
+        elif method == 'POST':
+            status, body = 200, None
+        elif method == 'PUT':
+            status, body = self.update(resource, billomat_id, data, command)
+        elif method == 'DELETE':
+            status, body = self.delete(resource, billomat_id)
+        else:
+            status, body = 405, None
+        return status, {}, body
+
+
+class _MockBillomatHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    mock_server = None
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_data = self.rfile.read(length) if length else b''
+        try:
+            data = json.loads(raw_data.decode('utf-8')) if raw_data else {}
+        except ValueError:
+            data = {}
+
+        status, headers, body = self.mock_server.handle(self.command, url.path, dict(parse_qsl(url.query)), data)
+        content = json.dumps(body).encode('utf-8') if body is not None else b''
+        if content and self.mock_server.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            content = gzip.compress(content)
+            headers = dict(headers, **{'Content-Encoding': 'gzip'})
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockRedisServer(object):
+    """
+    Serves GET, SET, DEL, INCR, INCRBY, PEXPIRE, PTTL, PING, AUTH and SELECT of the Redis protocol
+    on 127.0.0.1:<port> from memory. EVAL and EVALSHA only run ratelimit.SLIDING_WINDOW_SCRIPT,
+    as its python equivalent.
+
+    :param port: The port to listen on. Default: a free port
+    """
+
+    def __init__(self, port=0):
+        self.port = port
+        self.command_count = 0
+        self._lock = threading.Lock()
+        self._values = {}
+        self._expires = {}
+        self._scripts = set()
+        self._server = None
+
+    def start(self):
+        handler = type('Handler', (_MockRedisHandler,), {'mock_server': self})
+        self._server = ThreadingTCPServer(('127.0.0.1', self.port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _get(self, key):
+        if key in self._expires and self._expires[key] <= time.time():
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+        return self._values.get(key)
+
+    def _sliding_window(self, key, sequence_key, window, limit, tokens, acquire):
+        now = int(time.time() * 1000)
+        window, limit, tokens = int(window), int(limit), int(tokens)
+        log = [timestamp for timestamp in self._get(key) or [] if timestamp > now - window]
+        self._values[key] = log
+        if len(log) + tokens > limit:
+            return max(log[len(log) + tokens - limit - 1] + window - now, 1)
+        if acquire == b'1':
+            log.extend([now] * tokens)
+            self._expires[key] = time.time() + (window + 1000) / 1000.0
+        return 0
+
+    def execute(self, command, *args):
+        """
+        Returns the reply of a command, an Exception is sent as error reply
+        """
+        command = command.upper()
+        with self._lock:
+            self.command_count += 1
+            if command == b'PING':
+                return b'PONG'
+            if command in (b'AUTH', b'SELECT'):
+                return b'OK'
+            if command == b'GET':
+                return self._get(args[0])
+            if command == b'SET':
+                self._values[args[0]] = args[1]
+                self._expires.pop(args[0], None)
+                return b'OK'
+            if command == b'DEL':
+                deleted = [key for key in args if self._get(key) is not None]
+                for key in args:
+                    self._values.pop(key, None)
+                    self._expires.pop(key, None)
+                return len(deleted)
+            if command in (b'INCR', b'INCRBY'):
+                try:
+                    value = int(self._get(args[0]) or 0) + (int(args[1]) if command == b'INCRBY' else 1)
+                except ValueError:
+                    return ValueError('ERR value is not an integer or out of range')
+                self._values[args[0]] = str(value).encode('ascii')
+                return value
+            if command == b'PEXPIRE':
+                if self._get(args[0]) is None:
+                    return 0
+                self._expires[args[0]] = time.time() + int(args[1]) / 1000.0
+                return 1
+            if command in (b'EVAL', b'EVALSHA'):
+                if command == b'EVAL':
+                    if args[0].decode('utf-8') != SLIDING_WINDOW_SCRIPT:
+                        return ValueError('ERR the mock server only runs ratelimit.SLIDING_WINDOW_SCRIPT')
+                    self._scripts.add(SLIDING_WINDOW_SHA)
+                elif args[0].decode('ascii') not in self._scripts:
+                    return ValueError('NOSCRIPT No matching script. Please use EVAL.')
+                return self._sliding_window(*args[2:])
+            if command == b'PTTL':
+                if self._get(args[0]) is None:
+                    return -2
+                if args[0] not in self._expires:
+                    return -1
+                return int((self._expires[args[0]] - time.time()) * 1000)
+        return ValueError("ERR unknown command '{}'".format(command.decode('utf-8', 'replace')))
+
+
+class _MockRedisHandler(StreamRequestHandler):
+    disable_nagle_algorithm = True
+    mock_server = None
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # inline command e.g: PING from telnet
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    @staticmethod
+    def _encode(reply):
+        if isinstance(reply, Exception):
+            return b'-' + str(reply).encode('utf-8') + b'\r\n'
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, int):
+            return b':' + str(reply).encode('ascii') + b'\r\n'
+        if reply in (b'OK', b'PONG'):
+            return b'+' + reply + b'\r\n'
+        return b'$' + str(len(reply)).encode('ascii') + b'\r\n' + reply + b'\r\n'
+
+    def handle(self):
+        while True:
+            args = self._read_command()
+            if not args:
+                return
+            self.wfile.write(self._encode(self.mock_server.execute(*args)))
+            self.wfile.flush()
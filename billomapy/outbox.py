@@ -0,0 +1,459 @@
+"""
+Durable write-behind outbox for creates, updates and deletes in SQLite
+
+Writes are stored locally at once and sent to Billomat by a background worker. The writes of one entity
+(e.g: an order) are sent in the order they were enqueued, and a write waits for the writes it references:
+
+    outbox = Outbox(billomapy, 'outbox.sqlite', on_status=notify)
+    outbox.start()
+
+    invoice = outbox.create(INVOICES, {'invoice': {'client_id': 42}}, entity='order-7', key='order-7-invoice')
+    outbox.create(INVOICE_ITEMS, {'invoice-item': {'invoice_id': Ref(invoice), 'unit_price': 10}}, entity='order-7')
+
+A Ref is replaced by the id Billomat gave the referenced write. Enqueueing the same key twice stores the
+write once. Updates and deletes which were running when the process died are sent again after a restart.
+
+A create is not sent again when Billomat may have done it already, e.g: after a read timeout, a connection reset
+while waiting for the response, a 500 or a restart while it was running. It becomes unknown and the later writes
+of its entity and the writes which reference it wait, until it is reviewed:
+
+    for entry in outbox.entries(UNKNOWN):
+        invoice = find_invoice(entry)  # e.g: by a number or note of the payload
+        if invoice:
+            outbox.resolve(entry['key'], invoice['id'])
+        else:
+            outbox.retry(entry['key'])
+"""
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from urllib3.exceptions import NewConnectionError
+
+from .circuit import CircuitOpenError
+from .resources import *
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+UNKNOWN = 'unknown'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    entity TEXT NOT NULL,
+    method TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    billomat_id TEXT,
+    data TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    result_id TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS outbox_entity ON outbox (entity, id);
+CREATE TABLE IF NOT EXISTS outbox_dependencies (
+    key TEXT NOT NULL,
+    depends_on TEXT NOT NULL,
+    PRIMARY KEY (key, depends_on)
+);
+CREATE INDEX IF NOT EXISTS outbox_dependencies_depends_on ON outbox_dependencies (depends_on);
+"""
+
+COLUMNS = (
+    'id', 'key', 'entity', 'method', 'resource', 'billomat_id', 'data', 'status', 'attempts', 'next_attempt_at',
+    'result_id', 'error', 'created_at', 'updated_at',
+)
+
+
+class Ref(object):
+    """
+    Reference to the billomat id of the record which another write of the outbox creates
+
+    :param key: the idempotency key of the write
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def __repr__(self):
+        return 'Ref({!r})'.format(self.key)
+
+
+def _encode(value, references):
+    if isinstance(value, Ref):
+        references.add(value.key)
+        return {'$ref': value.key}
+    if isinstance(value, dict):
+        return dict((key, _encode(item, references)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_encode(item, references) for item in value]
+    return value
+
+
+def _transient(error):
+    """
+    Returns if an error of a write may pass: connection errors, timeouts, an open circuit, 5xx and 429
+    Every other error e.g: a 4xx or a TypeError of a broken payload fails the write at once.
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, CircuitOpenError)):
+        return True
+    status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code is not None and (status_code >= 500 or status_code == requests.codes.too_many_requests)
+
+
+def _ambiguous(error):
+    """
+    Returns if Billomat may have done the write of an error: a read timeout, a connection reset after the request
+    was sent or a 5xx. Connect errors, 429 and 503 are raised before Billomat does anything.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return False
+    if isinstance(error, requests.ConnectionError):
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return not isinstance(reason, NewConnectionError)
+    if isinstance(error, requests.Timeout):
+        return True
+    status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code is not None and status_code >= 500 and status_code != requests.codes.service_unavailable
+
+
+def _resolve(value, ids):
+    if isinstance(value, dict):
+        if set(value) == {'$ref'}:
+            return ids[value['$ref']]
+        return dict((key, _resolve(item, ids)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_resolve(item, ids) for item in value]
+    return value
+
+
+class Outbox(object):
+    """
+    :param billomapy: the Billomapy client which sends the writes
+    :param path: path of the SQLite database. Default: in memory
+    :param max_workers: how many writes are sent at the same time. Default: 4
+    :param batch_size: how many ready writes are claimed at once. Default: 50
+    :param max_attempts: how often a write is sent before it fails. Default: 5
+    :param retry_delay: seconds before the first retry, doubled for every further one. Default: 1
+    :param on_status: callable(entry), called when a write is done, failed or unknown, entry is a dict of its row
+    """
+
+    def __init__(self, billomapy, path=':memory:', max_workers=4, batch_size=50, max_attempts=5, retry_delay=1.0,
+                 on_status=None):
+        self.billomapy = billomapy
+        self.path = path
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.on_status = on_status
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+        with self._connection:
+            # the writes of a process which died while sending them are sent again, but the creates may be done
+            self._connection.execute(
+                'UPDATE outbox SET status = CASE method WHEN ? THEN ? ELSE ? END WHERE status = ?',
+                ('POST', UNKNOWN, PENDING, RUNNING)
+            )
+
+    def close(self):
+        self.stop()
+        self._connection.close()
+
+    def enqueue(self, method, resource, data=None, billomat_id=None, entity=None, key=None):
+        """
+        Stores a write, which is sent by drain() or the background worker
+
+        :param method: POST, PUT or DELETE
+        :param resource: the resource e.g: INVOICES, with a command e.g: invoices/complete
+        :param data: the body, may contain Ref values
+        :param billomat_id: the id for PUT and DELETE, may be a Ref
+        :param entity: the writes of an entity are sent in order. Default: the key, so no order
+        :param key: the idempotency key. Default: a random key
+        :return: the key
+        """
+        assert (method in ('POST', 'PUT', 'DELETE'))
+        key = key or uuid.uuid4().hex
+        references = set()
+        data = _encode(data, references)
+        billomat_id = _encode(billomat_id, references)
+        now = time.time()
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                'INSERT OR IGNORE INTO outbox (key, entity, method, resource, billomat_id, data, status, '
+                'created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, entity or key, method, resource, json.dumps(billomat_id), json.dumps(data), PENDING, now, now)
+            )
+            if cursor.rowcount:
+                self._connection.executemany(
+                    'INSERT INTO outbox_dependencies VALUES (?, ?)', [(key, reference) for reference in references]
+                )
+        self._wakeup.set()
+        return key
+
+    def create(self, resource, data, entity=None, key=None):
+        return self.enqueue('POST', resource, data=data, entity=entity, key=key)
+
+    def update(self, resource, billomat_id, data, entity=None, key=None):
+        return self.enqueue('PUT', resource, data=data, billomat_id=billomat_id, entity=entity, key=key)
+
+    def delete(self, resource, billomat_id, entity=None, key=None):
+        return self.enqueue('DELETE', resource, billomat_id=billomat_id, entity=entity, key=key)
+
+    def get(self, key):
+        """
+        Returns the write as dict or None
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT {} FROM outbox WHERE key = ?'.format(', '.join(COLUMNS)), (key,)
+            ).fetchone()
+        return self._entry(row) if row else None
+
+    def count(self, status=None):
+        with self._lock:
+            if status is None:
+                return self._connection.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+            return self._connection.execute('SELECT COUNT(*) FROM outbox WHERE status = ?', (status,)).fetchone()[0]
+
+    def entries(self, status):
+        """
+        Returns the writes of a status as list of dicts e.g: the unknown ones for a review
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT {} FROM outbox WHERE status = ? ORDER BY id'.format(', '.join(COLUMNS)), (status,)
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def resolve(self, key, result_id):
+        """
+        Marks an unknown write as done, because Billomat did it, so the writes which wait for it are sent
+
+        :param key: the idempotency key of the write
+        :param result_id: the id of the record Billomat created
+        """
+        self._review(key, 'status = ?, result_id = ?, error = NULL', (DONE, str(result_id)))
+
+    def retry(self, key):
+        """
+        Sends an unknown write again, because Billomat did not do it
+        """
+        self._review(key, 'status = ?, next_attempt_at = 0', (PENDING,))
+
+    def _review(self, key, assignments, values):
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                'UPDATE outbox SET {}, updated_at = ? WHERE key = ? AND status = ?'.format(assignments),
+                values + (time.time(), key, UNKNOWN)
+            )
+        if not cursor.rowcount:
+            raise ValueError('The write {} is not unknown'.format(key))
+        self._wakeup.set()
+        self._notify(key)
+
+    @staticmethod
+    def _entry(row):
+        entry = dict(zip(COLUMNS, row))
+        entry['data'] = json.loads(entry['data'])
+        entry['billomat_id'] = json.loads(entry['billomat_id'])
+        return entry
+
+    def _claim(self):
+        """
+        Marks the writes as running, which are due, first of their entity and whose references are done
+        Writes which reference a failed write fail as well.
+
+        :return: list of entries and dict of the referenced keys and their billomat ids
+        """
+        now = time.time()
+        failed = []
+        with self._lock, self._connection:
+            rows = self._connection.execute(
+                'SELECT {} FROM outbox AS o WHERE status = ? AND next_attempt_at <= ? AND NOT EXISTS ('
+                'SELECT 1 FROM outbox AS p WHERE p.entity = o.entity AND p.id < o.id AND p.status != ?'
+                ') ORDER BY id LIMIT ?'.format(', '.join('o.' + column for column in COLUMNS)),
+                (PENDING, now, DONE, self.batch_size)
+            ).fetchall()
+            entries = []
+            ids = {}
+            for row in rows:
+                entry = self._entry(row)
+                references = self._connection.execute(
+                    'SELECT d.depends_on, o.status, o.result_id FROM outbox_dependencies AS d '
+                    'LEFT JOIN outbox AS o ON o.key = d.depends_on WHERE d.key = ?', (entry['key'],)
+                ).fetchall()
+                broken = [reference for reference, status, _ in references if status in (None, FAILED)]
+                if broken:
+                    failed.append((entry, 'The referenced write {} failed or does not exist'.format(broken[0])))
+                    continue
+                if any(status != DONE for _, status, _ in references):
+                    continue
+                ids.update((reference, result_id) for reference, _, result_id in references)
+                entries.append(entry)
+            self._connection.executemany(
+                'UPDATE outbox SET status = ?, updated_at = ? WHERE id = ?',
+                [(RUNNING, now, entry['id']) for entry in entries]
+            )
+        for entry, error in failed:
+            self._fail(entry, error)
+        return entries, ids
+
+    def _send(self, entry, ids):
+        data = _resolve(entry['data'], ids)
+        billomat_id = _resolve(entry['billomat_id'], ids)
+        resource, _, command = entry['resource'].partition('/')
+        if entry['method'] == 'POST':
+            return self.billomapy._create_post_request(
+                resource, data, billomat_id=billomat_id or '', command=command or None
+            )
+        if entry['method'] == 'PUT':
+            return self.billomapy._create_put_request(resource, billomat_id, command=command or None, send_data=data)
+        return self.billomapy._create_delete_request(resource, billomat_id)
+
+    def _process(self, entry, ids):
+        try:
+            result = self._send(entry, ids)
+        except Exception as e:
+            if entry['method'] == 'POST' and _ambiguous(e):
+                self._unknown(entry, str(e))
+            else:
+                self._retry_or_fail(entry, str(e), _transient(e))
+            return
+        if result is None:
+            # the rate_limit_exceeded hook swallowed a 429, so the write was not done
+            self._retry_or_fail(entry, 'The write was rate limited', True)
+            return
+
+        result_id = None
+        resource, _, command = entry['resource'].partition('/')
+        data_key = DATA_KEYS.get(resource)
+        if isinstance(result, dict) and isinstance(result.get(data_key), dict):
+            result_id = result[data_key].get('id')
+        if result_id is None and entry['method'] == 'POST' and not command:
+            # a create without id can not be referenced, sending it again could create it twice
+            self._fail(entry, 'The response of the create has no {} id'.format(data_key), entry['attempts'] + 1)
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE outbox SET status = ?, attempts = attempts + 1, result_id = ?, error = NULL, updated_at = ? '
+                'WHERE id = ?', (DONE, result_id, time.time(), entry['id'])
+            )
+        self._notify(entry['key'])
+
+    def _retry_or_fail(self, entry, error, transient):
+        """
+        Schedules a retry for transient errors until max_attempts, every other error fails at once
+
+        :param error: the error message
+        :param transient: if the error may pass
+        """
+        attempts = entry['attempts'] + 1
+        if not transient or attempts >= self.max_attempts:
+            self._fail(entry, error, attempts)
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, error = ?, updated_at = ? '
+                'WHERE id = ?',
+                (PENDING, attempts, time.time() + self.retry_delay * 2 ** (attempts - 1), error, time.time(),
+                 entry['id'])
+            )
+
+    def _unknown(self, entry, error):
+        """
+        Keeps a create for a review, because sending it again could create it twice
+        The later writes of its entity and the writes which reference it wait for the review.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE outbox SET status = ?, attempts = attempts + 1, error = ?, updated_at = ? WHERE id = ?',
+                (UNKNOWN, error, time.time(), entry['id'])
+            )
+        self._notify(entry['key'])
+
+    def _fail(self, entry, error, attempts=None):
+        """
+        Fails the write, the later writes of its entity and the writes which reference it
+        """
+        keys = []
+        with self._lock, self._connection:
+            pending = [(entry['id'], entry['entity'], entry['key'])]
+            while pending:
+                entry_id, entity, key = pending.pop()
+                self._connection.execute(
+                    'UPDATE outbox SET status = ?, attempts = COALESCE(?, attempts), error = ?, updated_at = ? '
+                    'WHERE id = ?', (FAILED, attempts, error, time.time(), entry_id)
+                )
+                keys.append(key)
+                attempts = None
+                error = 'The write {} failed before'.format(key)
+                pending += self._connection.execute(
+                    'SELECT id, entity, key FROM outbox WHERE status = ? AND ((entity = ? AND id > ?) OR key IN ('
+                    'SELECT key FROM outbox_dependencies WHERE depends_on = ?))', (PENDING, entity, entry_id, key)
+                ).fetchall()
+        for key in keys:
+            self._notify(key)
+
+    def _notify(self, key):
+        if self.on_status:
+            self.on_status(self.get(key))
+
+    def drain(self):
+        """
+        Sends all writes which are ready, concurrently and in batches, until none is ready anymore
+
+        :return: how many writes were sent
+        """
+        sent = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while not self._stopped.is_set():
+                entries, ids = self._claim()
+                if not entries:
+                    break
+                list(executor.map(lambda entry: self._process(entry, ids), entries))
+                sent += len(entries)
+        return sent
+
+    def start(self, interval=1.0):
+        """
+        Starts the background worker, which drains the outbox after every enqueue and every interval seconds
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+
+        def work():
+            while not self._stopped.is_set():
+                self._wakeup.clear()
+                self.drain()
+                self._wakeup.wait(interval)
+
+        self._thread = threading.Thread(target=work, name='billomapy-outbox')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
@@ -0,0 +1,138 @@
+"""
+Page size strategies for the paginated reads of both clients
+
+A strategy decides the per_page of the next page request. The next page has to start exactly where the
+records fetched so far end, so a new per_page must divide the offset of records fetched so far.
+
+    # adaptive for every resource
+    billomapy = Billomapy('YOUR_COMPANY', 'API_KEY', 'APP_ID', 'APP_SECRET', page_size=AdaptivePageSize())
+
+    # fixed 250 for invoices, adaptive for everything else
+    billomapy = Billomapy(
+        'YOUR_COMPANY', 'API_KEY', 'APP_ID', 'APP_SECRET',
+        page_size={INVOICES: 250, None: AdaptivePageSize()}
+    )
+"""
+import threading
+
+MIN_PER_PAGE = 1
+MAX_PER_PAGE = 1000
+
+
+class FixedPageSize(object):
+    """
+    Always uses the same per_page
+
+    :param per_page: How many objects per page
+    """
+
+    def __init__(self, per_page):
+        self._per_page = int(per_page)
+
+    def per_page(self, resource, offset, current=None):
+        return self._per_page
+
+    def observe(self, resource, records, seconds, size):
+        pass
+
+
+class AdaptivePageSize(object):
+    """
+    Measures the response time and payload size per record and chooses the biggest per_page,
+    which stays below target_seconds and max_bytes per response.
+    The measurements are kept per resource, so one instance can serve all resources of a client.
+
+    :param initial: per_page of the first page of a resource without measurements. Default: 100
+    :param minimum: smallest per_page. Default: 10
+    :param maximum: biggest per_page, the api allows 1000. Default: 1000
+    :param target_seconds: wanted response time of one page. Default: 2.0
+    :param max_bytes: wanted maximum payload size of one page. Default: 5 MiB
+    :param smoothing: weight of the newest measurement. Default: 0.5
+    """
+
+    def __init__(self, initial=100, minimum=10, maximum=MAX_PER_PAGE, target_seconds=2.0,
+                 max_bytes=5 * 1024 * 1024, smoothing=0.5):
+        assert (MIN_PER_PAGE <= minimum <= initial <= maximum <= MAX_PER_PAGE)
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.smoothing = smoothing
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def observe(self, resource, records, seconds, size):
+        """
+        Adds the measurement of one page
+
+        :param resource: the resource e.g: invoices
+        :param records: how many records the page had
+        :param seconds: response time of the page
+        :param size: payload size of the page in bytes
+        """
+        if records <= 0:
+            return
+        seconds_per_record = float(seconds) / records
+        bytes_per_record = float(size) / records
+        with self._lock:
+            if resource not in self._stats:
+                self._stats[resource] = (seconds_per_record, bytes_per_record)
+            else:
+                old_seconds, old_bytes = self._stats[resource]
+                self._stats[resource] = (
+                    self.smoothing * seconds_per_record + (1 - self.smoothing) * old_seconds,
+                    self.smoothing * bytes_per_record + (1 - self.smoothing) * old_bytes,
+                )
+
+    def target(self, resource):
+        """
+        The per_page the measurements suggest, without looking at the offset
+        """
+        with self._lock:
+            stats = self._stats.get(resource)
+        if not stats:
+            return self.initial
+
+        seconds_per_record, bytes_per_record = stats
+        target = self.maximum
+        if seconds_per_record > 0:
+            target = min(target, self.target_seconds / seconds_per_record)
+        if self.max_bytes and bytes_per_record > 0:
+            target = min(target, self.max_bytes / bytes_per_record)
+        return int(max(self.minimum, target))
+
+    def per_page(self, resource, offset, current=None):
+        """
+        Returns the per_page for the page which starts at offset
+
+        :param resource: the resource e.g: invoices
+        :param offset: how many records were fetched so far
+        :param current: the per_page of the last page, which always divides the offset
+        :return: int
+        """
+        target = self.target(resource)
+        if not offset:
+            return target
+        for per_page in range(min(target, offset), self.minimum - 1, -1):
+            if offset % per_page == 0:
+                return per_page
+        return current or self.minimum
+
+
+def resolve_page_size(page_size, resource, default):
+    """
+    Returns the page size strategy of a resource
+
+    :param page_size: None, an int, a strategy or a dict of resource to int or strategy (None is the fallback key)
+    :param resource: the resource e.g: invoices
+    :param default: the per_page if nothing is configured
+    :return: strategy
+    """
+    if isinstance(page_size, dict):
+        page_size = page_size.get(resource, page_size.get(None))
+    if page_size is None:
+        page_size = default
+    if isinstance(page_size, int):
+        return FixedPageSize(page_size)
+    return page_size
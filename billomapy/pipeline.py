@@ -0,0 +1,294 @@
+"""
+Pipeline for the flood client which downloads document binaries with bounded memory
+
+Every document is handed to a sink as soon as it arrives instead of being collected in Billomapy.responses.
+The pipeline keeps at most max_in_flight requests running and starts no new request while the documents
+which were handed to the sink, but not released by it, exceed the high water mark:
+
+    def sink(resource, billomat_id, document):
+        with open(document['filename'], 'wb') as pdf:
+            pdf.write(document['content'])
+
+    pipeline = DocumentPipeline(billomapy, sink, max_in_flight=10, high_water_mark=50 * 1024 * 1024)
+    pipeline.add(INVOICES, invoice_ids)
+    pipeline.add(INBOX_DOCUMENTS, inbox_document_ids)
+    pipeline.run()
+
+A sink which returns a Future (e.g: tornado.queues.Queue.put) holds the memory of the document until it resolves.
+Inside of billomapy.cancellation(token) the pipeline starts no new request after token.cancel()
+and run() returns as soon as the running ones arrived, the other documents stay queued.
+Inside of billomapy.deadline(seconds) run() returns at the deadline, the responses of the running requests
+are ignored and their documents stay queued like the not started ones.
+"""
+import json
+import base64
+import collections
+
+from tornado import ioloop
+from tornado.concurrent import is_future
+
+from .damn_flood_billomapy import BillomapyParseError, BillomapyRateLimitReachedError
+from .ratelimit import BULK
+from .resources import *
+
+# resource and (command, data key of the response)
+DOCUMENT_BINARIES = {
+    INVOICES: (PDF, PDF),
+    OFFERS: (PDF, PDF),
+    CREDIT_NOTES: (PDF, PDF),
+    CONFIRMATIONS: (PDF, PDF),
+    REMINDERS: (PDF, PDF),
+    DELIVERY_NOTES: (PDF, PDF),
+    INBOX_DOCUMENTS: (None, INBOX_DOCUMENT),
+}
+
+
+def decode_document(body, data_key, function=None):
+    """
+    Parses a document response and decodes its base64file into content
+
+    :param body: the response body
+    :param data_key: the key of the document in the response e.g: pdf
+    :param function: a transform which gets the decoded document
+    :return: the document or what function returns
+    """
+    try:
+        document = json.loads(body)[data_key]
+    except (ValueError, TypeError, KeyError):
+        raise BillomapyParseError(body)
+    document['content'] = base64.b64decode(document.pop('base64file', '') or '')
+    return function(document) if function else document
+
+
+class DocumentPipeline(object):
+    """
+    :param billomapy: the flood Billomapy client
+    :param sink: callable(resource, billomat_id, document), document is the dict of billomat with the decoded
+                 file in content instead of base64file. If it returns a Future the document counts until it resolves
+    :param max_in_flight: how many requests run at the same time. Default: 10
+    :param high_water_mark: bytes of documents in the sink, above which no new request is started. Default: 50 MiB
+    :param process: a processing.ProcessStage, which decodes the documents and runs its function over them
+                    in a process pool. The sink then gets the results in the order the documents were added.
+    """
+
+    def __init__(self, billomapy, sink, max_in_flight=10, high_water_mark=50 * 1024 * 1024, process=None):
+        assert (max_in_flight > 0)
+        self.billomapy = billomapy
+        self.sink = sink
+        self.max_in_flight = max_in_flight
+        self.high_water_mark = high_water_mark
+        self.process = process
+
+        self.pending = collections.deque()
+        self.in_flight = 0
+        self.held_bytes = 0
+        self.held_documents = 0
+        self.peak_held_bytes = 0
+        self.fetched = 0
+        self.failed = []
+        self._error = None
+        self._sequence = 0
+        self._next_sequence = 0
+        self._ready = {}
+        self._running = {}
+        self._looping = False
+
+    def add(self, resource, billomat_ids):
+        """
+        Queues the documents of a resource
+
+        :param resource: one of DOCUMENT_BINARIES e.g: INVOICES
+        :param billomat_ids: the ids of the documents
+        """
+        if resource not in DOCUMENT_BINARIES:
+            raise ValueError('{} has no document binaries, choose from {}'.format(resource, sorted(DOCUMENT_BINARIES)))
+        for billomat_id in billomat_ids:
+            self.pending.append((resource, str(billomat_id)))
+
+    @property
+    def done(self):
+        return not self.pending and not self.in_flight and not self.held_documents
+
+    def run(self):
+        """
+        Downloads all queued documents and returns when the sink has released all of them
+        Failed downloads are collected in failed as (resource, billomat_id, code).
+
+        :raises BillomapyRateLimitReachedError: if billomat answers with 429, the not downloaded documents stay queued
+        :raises CircuitOpenError: if the circuit of a resource is open, the not downloaded documents stay queued
+        At the deadline of billomapy.deadline(seconds) it returns, the not downloaded documents stay queued.
+        """
+        self._error = None
+        self.billomapy._circuit_error = None
+        token, deadline = self.billomapy._cancellation, self.billomapy._deadline
+        io_loop = ioloop.IOLoop.instance()
+
+        def cancel():
+            # the token may be cancelled from another thread
+            io_loop.add_callback(self._pump)
+
+        if token is not None:
+            token.add_callback(cancel)
+        timeout = io_loop.call_later(max(deadline.remaining(), 0), self._pump) if deadline is not None else None
+        try:
+            self._pump()
+            if not self.done and not ((self._error or self._stopped) and not self.in_flight):
+                self._looping = True
+                io_loop.start()
+        finally:
+            self._looping = False
+            if timeout:
+                io_loop.remove_timeout(timeout)
+            if token is not None:
+                token.remove_callback(cancel)
+        if self._error:
+            raise self._error
+
+    @property
+    def _cancelled(self):
+        token = self.billomapy._cancellation
+        return token is not None and token.cancelled
+
+    @property
+    def _expired(self):
+        deadline = self.billomapy._deadline
+        if deadline is not None and not deadline.exceeded and deadline.remaining() <= 0:
+            deadline.exceeded = True
+        return deadline is not None and deadline.exceeded
+
+    @property
+    def _stopped(self):
+        return self._cancelled or self._expired
+
+    def _stop(self):
+        # a stop before the start would end the next run of the loop at once
+        if self._looping:
+            ioloop.IOLoop.instance().stop()
+
+    def _pump(self):
+        """
+        Starts requests while there are free slots and the sink is below the high water mark
+        """
+        if self._running and self._expired:
+            self._requeue_running()
+        while (self.pending and self.in_flight < self.max_in_flight and self.held_bytes < self.high_water_mark and
+               not self._error and not self._stopped):
+            resource, billomat_id = self.pending.popleft()
+            command, _ = DOCUMENT_BINARIES[resource]
+            path = resource + '/' + billomat_id + ('/' + command if command else '')
+            self.in_flight += 1
+            queued = self.billomapy._fetch(
+                self.billomapy._create_http_get_request(path, {}),
+                self._make_callback(resource, billomat_id, self._sequence),
+                resource=resource,
+                priority=BULK,
+            )
+            if not queued:
+                self.in_flight -= 1
+                self.pending.appendleft((resource, billomat_id))
+                # the request was not sent, because the operation is cancelled or the circuit is open
+                self._error, self.billomapy._circuit_error = self.billomapy._circuit_error, None
+                break
+            self._running[self._sequence] = (resource, billomat_id)
+            self._sequence += 1
+
+        if self.done or ((self._error or self._stopped) and not self.in_flight):
+            self._stop()
+
+    def _requeue_running(self):
+        """
+        Puts the documents of the running requests back in front of pending, because the deadline is exceeded
+        The client drops its queued requests and ignores the responses of the running ones.
+        """
+        self.billomapy._abort()
+        for sequence in sorted(self._running, reverse=True):
+            self.pending.appendleft(self._running.pop(sequence))
+            self._skip(sequence)
+        self.in_flight = 0
+
+    def _make_callback(self, resource, billomat_id, sequence):
+        def callback(response):
+            # the pipeline counts its own requests, the request counter of the client is not used
+            self.billomapy.request_counter -= 1
+            self.in_flight -= 1
+            self._running.pop(sequence, None)
+            try:
+                self._handle_response(resource, billomat_id, sequence, response)
+            except Exception as e:
+                self._error = e
+            self._pump()
+
+        return callback
+
+    def _handle_response(self, resource, billomat_id, sequence, response):
+        if response.code == 599 and self._expired:
+            # the request timed out at the deadline, the document stays queued
+            self._skip(sequence)
+            self.pending.appendleft((resource, billomat_id))
+            return
+        if response.code == 429:
+            self._skip(sequence)
+            self.pending.appendleft((resource, billomat_id))
+            raise BillomapyRateLimitReachedError()
+        if response.code != 200:
+            self._skip(sequence)
+            self.failed.append((resource, billomat_id, response.code))
+            return
+
+        data_key = DOCUMENT_BINARIES[resource][1]
+        if not self.process:
+            document = decode_document(response.body, data_key)
+            size = len(document['content'])
+            self._hold(size)
+            self._deliver(resource, billomat_id, document, size)
+            return
+
+        size = len(response.body)
+        self._hold(size)
+        future = self.process.submit_call(decode_document, response.body, data_key, self.process.function)
+        ioloop.IOLoop.instance().add_future(
+            future, lambda future: self._processed(resource, billomat_id, sequence, future, size)
+        )
+
+    def _processed(self, resource, billomat_id, sequence, future, size):
+        try:
+            self._ready[sequence] = (resource, billomat_id, future.result(), size)
+        except Exception as e:
+            self._error = e
+            self._ready[sequence] = None
+            self._release(size)
+        self._deliver_ready()
+        self._pump()
+
+    def _skip(self, sequence):
+        if self.process:
+            self._ready[sequence] = None
+            self._deliver_ready()
+
+    def _deliver_ready(self):
+        """
+        Hands the processed documents to the sink in the order they were added
+        """
+        while self._next_sequence in self._ready:
+            entry = self._ready.pop(self._next_sequence)
+            self._next_sequence += 1
+            if entry:
+                self._deliver(*entry)
+
+    def _deliver(self, resource, billomat_id, document, size):
+        self.fetched += 1
+        result = self.sink(resource, billomat_id, document)
+        if is_future(result):
+            ioloop.IOLoop.instance().add_future(result, lambda future: self._release(size))
+        else:
+            self._release(size)
+
+    def _hold(self, size):
+        self.held_documents += 1
+        self.held_bytes += size
+        self.peak_held_bytes = max(self.peak_held_bytes, self.held_bytes)
+
+    def _release(self, size):
+        self.held_documents -= 1
+        self.held_bytes -= size
+        self._pump()
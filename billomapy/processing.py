@@ -0,0 +1,107 @@
+"""
+Process pool stage for CPU heavy decode and transform callbacks
+
+The network bound fetching stays in the client, the callbacks run on all cores and the results keep their order:
+
+    def summarize(invoice):
+        return invoice['id'], parse_and_render(invoice)
+
+    with ProcessStage(summarize, max_workers=4, chunksize=100) as stage:
+        for invoice_id, summary in billomapy.iter_all(INVOICES, process=stage):
+            ...
+
+The function and the items are pickled, so the function has to be defined at module level.
+"""
+import itertools
+import collections
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _apply(function, chunk):
+    return [function(item) for item in chunk]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ProcessStage(object):
+    """
+    Runs a function over items in a process pool
+
+    :param function: the callback, a function at module level
+    :param max_workers: how many processes. Default: number of cpus
+    :param chunksize: how many items are sent to a process at once. Default: 1
+    :param max_pending: how many chunks run ahead of the consumer. Default: 2 per process
+    """
+
+    def __init__(self, function, max_workers=None, chunksize=1, max_pending=None):
+        assert (chunksize > 0)
+        self.function = function
+        self.max_workers = max_workers
+        self.chunksize = chunksize
+        self.max_pending = max_pending
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            if self.max_pending is None:
+                self.max_pending = 2 * self._executor._max_workers
+        return self._executor
+
+    def submit(self, *args):
+        """
+        Runs function(*args) in the pool
+
+        :return: concurrent.futures.Future
+        """
+        return self.executor.submit(self.function, *args)
+
+    def submit_call(self, function, *args):
+        """
+        Runs another function in the pool, e.g: a decode step which calls self.function itself
+        """
+        return self.executor.submit(function, *args)
+
+    def map(self, iterable):
+        """
+        Yields function(item) for every item in the order of iterable
+        The iterable is consumed while the pool works, but at most max_pending chunks ahead.
+
+        :param iterable: the items e.g: the generator of iter_all
+        :return: generator
+        """
+        executor = self.executor
+        pending = collections.deque()
+        try:
+            for chunk in _chunks(iterable, self.chunksize):
+                pending.append(executor.submit(_apply, self.function, chunk))
+                if len(pending) >= self.max_pending:
+                    for result in pending.popleft().result():
+                        yield result
+            while pending:
+                for result in pending.popleft().result():
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
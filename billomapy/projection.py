@@ -0,0 +1,58 @@
+"""
+Field projection, which drops the fields of the records nobody needs as soon as a page is parsed
+
+    # only these fields of invoices are kept, every other resource stays complete
+    billomapy = Billomapy(
+        'YOUR_COMPANY', 'API_KEY', 'APP_ID', 'APP_SECRET',
+        fields={INVOICES: ['id', 'client_id', 'total_gross', 'status', 'date']}
+    )
+"""
+from .resources import DATA_KEYS
+
+
+def resolve_fields(fields, resource):
+    """
+    Returns the fields which are kept for a resource or None for all fields
+
+    :param fields: None, a list of fields or a dict of resource to list of fields (None is the fallback key)
+    :param resource: the resource e.g: invoices
+    :return: frozenset or None
+    """
+    if isinstance(fields, dict):
+        fields = fields.get(resource, fields.get(None))
+    if not fields:
+        return None
+    return frozenset(fields)
+
+
+def project(record, fields):
+    """
+    Returns a new dict with only the fields of the record which are in fields
+    """
+    return dict((key, value) for key, value in record.items() if key in fields)
+
+
+def project_page(page, resource, fields):
+    """
+    Returns a new page with the projection of the records of a list page
+    The page itself is not changed, because coalesced requests share it with other callers.
+
+    :param page: the parsed response of a list request e.g: {'invoices': {'@total': '1', 'invoice': [...]}}
+    :param resource: the resource e.g: invoices
+    :param fields: the fields which are kept, None keeps all
+    :return: the projected page or the page if nothing is projected
+    """
+    if not fields or not isinstance(page, dict):
+        return page
+    body = page.get(resource)
+    data_key = DATA_KEYS.get(resource)
+    if not isinstance(body, dict) or data_key not in body:
+        return page
+
+    records = body[data_key]
+    if isinstance(records, list):
+        records = [project(record, fields) for record in records]
+    else:
+        # billomat returns a single record as dict
+        records = project(records, fields)
+    return dict(page, **{resource: dict(body, **{data_key: records})})
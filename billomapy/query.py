@@ -0,0 +1,141 @@
+"""
+Query builder for the list filters of Billomat, so filtering happens on the server
+
+A Query is the params dict of a get_all_* or *_per_page function, validated against the filters of its resource:
+
+    query = Query(INVOICES).status('OPEN', 'OVERDUE').client(42).between('2026-01-01', date.today())
+    invoices = billomapy.get_all_invoices(params=query)
+
+    Query(INVOICES, invoice_number='RE0042')
+    Query(INVOICES).where(tags=['vip', 'export'])
+    Query(INVOICES).order_by('-date', 'invoice_number')
+"""
+import datetime
+
+from .resources import *
+
+_DOCUMENT_FILTERS = ('client_id', 'contact_id', 'status', 'from', 'to', 'label', 'intro', 'note', 'tags', 'article_id')
+_PAYMENT_FILTERS = ('from', 'to', 'type', 'user_id')
+
+FILTERS = {
+    CLIENTS: ('name', 'client_number', 'email', 'first_name', 'last_name', 'country_code', 'note', 'invoice_id',
+              'tags'),
+    SUPPLIERS: ('name', 'email', 'first_name', 'last_name', 'country_code', 'creditor_identifier', 'note', 'tags'),
+    ARTICLES: ('article_number', 'title', 'description', 'currency_code', 'unit_id', 'tags', 'supplier_id'),
+    UNITS: ('name',),
+    INVOICES: _DOCUMENT_FILTERS + ('invoice_number', 'payment_type'),
+    OFFERS: _DOCUMENT_FILTERS + ('offer_number',),
+    CREDIT_NOTES: _DOCUMENT_FILTERS + ('credit_note_number', 'invoice_id'),
+    CONFIRMATIONS: _DOCUMENT_FILTERS + ('confirmation_number',),
+    REMINDERS: ('client_id', 'contact_id', 'invoice_id', 'status', 'from', 'to', 'label', 'intro', 'note'),
+    DELIVERY_NOTES: _DOCUMENT_FILTERS + ('delivery_note_number',),
+    LETTERS: ('client_id', 'contact_id', 'subject', 'from', 'to', 'tags'),
+    RECURRINGS: ('client_id', 'contact_id', 'name', 'payment_type', 'cycle', 'label', 'intro', 'note', 'tags'),
+    INCOMINGS: ('supplier_id', 'incoming_number', 'status', 'from', 'to', 'note', 'client_number', 'article_id',
+                'tags'),
+    INVOICE_PAYMENTS: ('invoice_id',) + _PAYMENT_FILTERS,
+    CREDIT_NOTE_PAYMENTS: ('credit_note_id',) + _PAYMENT_FILTERS,
+    INCOMING_PAYMENTS: ('incoming_id',) + _PAYMENT_FILTERS,
+}
+# Sub collections can be filtered by their parent e.g: invoice-items by invoice_id
+for _resource, _parent_key in PARENT_KEYS.items():
+    FILTERS.setdefault(_resource, (_parent_key,))
+# Every list of billomat can be sorted
+for _resource in FILTERS:
+    FILTERS[_resource] += ('order_by',)
+
+STATUSES = {
+    INVOICES: ('DRAFT', 'OPEN', 'OVERDUE', 'PAID', 'CANCELED'),
+    OFFERS: ('DRAFT', 'OPEN', 'WON', 'LOST', 'CANCELED', 'CLEARED'),
+    CREDIT_NOTES: ('DRAFT', 'OPEN', 'PAID', 'CANCELED'),
+    CONFIRMATIONS: ('DRAFT', 'COMPLETED', 'CANCELED', 'CLEARED'),
+    REMINDERS: ('DRAFT', 'OPEN', 'OVERDUE', 'PAID', 'CANCELED'),
+    DELIVERY_NOTES: ('DRAFT', 'CREATED', 'CANCELED', 'CLEARED'),
+    INCOMINGS: ('OPEN', 'OVERDUE', 'PAID'),
+}
+
+
+def _format(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return ','.join(_format(element) for element in value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+class Query(dict):
+    """
+    Params dict of a resource which only accepts the filters billomat supports for it
+    Lists become comma separated values and dates become YYYY-MM-DD.
+
+    :param resource: the resource e.g: INVOICES
+    :param filters: filters as keyword arguments e.g: client_id=42
+    """
+
+    def __init__(self, resource, **filters):
+        super(Query, self).__init__()
+        if resource not in FILTERS:
+            raise ValueError('{} has no list filters'.format(resource))
+        self.resource = resource
+        self.where(**filters)
+
+    def __setitem__(self, key, value):
+        if key not in FILTERS[self.resource]:
+            raise ValueError(
+                '{} can not be filtered by {}, choose from {}'.format(self.resource, key, FILTERS[self.resource])
+            )
+        if value is None:
+            self.pop(key, None)
+            return
+        value = _format(value)
+        if key == 'status' and self.resource in STATUSES:
+            unknown = [status for status in value.split(',') if status not in STATUSES[self.resource]]
+            if unknown:
+                raise ValueError('Unknown status {} for {}, choose from {}'.format(
+                    unknown, self.resource, STATUSES[self.resource]
+                ))
+        super(Query, self).__setitem__(key, value)
+
+    def where(self, **filters):
+        """
+        Adds filters, a trailing underscore is removed so from_ becomes from
+        None removes a filter.
+
+        :return: the query
+        """
+        for key, value in filters.items():
+            self[key.rstrip('_')] = value
+        return self
+
+    def status(self, *statuses):
+        return self.where(status=list(statuses))
+
+    def client(self, client_id):
+        return self.where(client_id=client_id)
+
+    def tags(self, *tags):
+        return self.where(tags=list(tags))
+
+    def between(self, date_from=None, date_to=None):
+        """
+        Filters by the document date, both dates are inclusive
+
+        :param date_from: first date as date or YYYY-MM-DD
+        :param date_to: last date as date or YYYY-MM-DD
+        :return: the query
+        """
+        return self.where(from_=date_from, to=date_to)
+
+    def order_by(self, *fields):
+        """
+        Sorts the list on the server, a leading minus sorts descending
+        e.g: order_by('-date', 'invoice_number') becomes order_by=date DESC,invoice_number ASC
+
+        :return: the query
+        """
+        return self.where(order_by=[
+            '{} DESC'.format(field[1:]) if field.startswith('-') else '{} ASC'.format(field) for field in fields
+        ] or None)
+
+    def copy(self):
+        return Query(self.resource, **self)
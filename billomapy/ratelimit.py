@@ -0,0 +1,384 @@
+"""
+Client side rate limiting
+
+Billomat limits the requests per account, so every client can get a rate limiter which is asked before every request:
+
+    # 300 requests per 15 minutes, with bursts of up to 50 requests
+    billomapy = Billomapy(
+        'YOUR_COMPANY', 'API_KEY', 'APP_ID', 'APP_SECRET', rate_limiter=TokenBucket(rate=300 / 900.0, capacity=50)
+    )
+
+A rate limiter has acquire(), try_acquire() and wait_time(). TokenBucket only limits one process,
+FileTokenBucket limits all processes of a host and RedisRateLimiter all processes of all hosts,
+which use the same file or key for the same billomat_id:
+
+    FileTokenBucket('/var/run/billomapy/YOUR_COMPANY.bucket', rate=300 / 900.0, capacity=50)
+    RedisRateLimiter(RedisConnection('redis.local'), 'billomapy:YOUR_COMPANY', limit=300, window=900)
+"""
+import os
+import json
+import time
+import errno
+import socket
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Priorities of requests, a lower value goes first
+INTERACTIVE = 0
+BULK = 1
+
+
+class TokenBucket(object):
+    """
+    Allows rate requests per second on average and bursts of up to capacity requests, safe to use from multiple threads
+
+    :param rate: tokens which are added per second
+    :param capacity: maximum tokens in the bucket. Default: 1 second of rate, at least 1
+    """
+
+    def __init__(self, rate, capacity=None):
+        assert (rate > 0)
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, tokens=1):
+        """
+        Seconds until the tokens are available, 0.0 if they are available now
+        """
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def try_acquire(self, tokens=1):
+        """
+        Takes the tokens if they are available now
+
+        :return: bool
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """
+        Waits until the tokens are available and takes them
+
+        :return: seconds waited
+        """
+        waited = 0.0
+        while not self.try_acquire(tokens):
+            wait = max(self.wait_time(tokens), 0.001)
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+
+class FileTokenBucket(object):
+    """
+    A TokenBucket whose state lives in a file, so all processes of a host which use the file share one budget
+    The file is locked with flock while the state is read and written.
+
+    :param path: the state file e.g: one per billomat_id
+    :param rate: tokens which are added per second
+    :param capacity: maximum tokens in the bucket. Default: 1 second of rate, at least 1
+    """
+
+    def __init__(self, path, rate, capacity=None):
+        assert (rate > 0)
+        if fcntl is None:
+            raise RuntimeError('FileTokenBucket needs fcntl')
+        self.path = path
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        directory = os.path.dirname(path)
+        if directory:
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _update(self, tokens, take):
+        """
+        Refills the bucket and takes the tokens if take and they are available, in one locked read and write
+
+        :return: (taken, seconds until the tokens are available)
+        """
+        with open(self.path, 'a+') as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            state_file.seek(0)
+            try:
+                state = json.loads(state_file.read())
+            except ValueError:
+                state = {'tokens': self.capacity, 'updated': time.time()}
+
+            now = time.time()
+            available = min(self.capacity, state['tokens'] + max(0.0, now - state['updated']) * self.rate)
+            taken = take and available >= tokens
+            if taken:
+                available -= tokens
+
+            state_file.seek(0)
+            state_file.truncate()
+            state_file.write(json.dumps({'tokens': available, 'updated': now}))
+            return taken, max(0.0, (tokens - available) / self.rate)
+
+    def wait_time(self, tokens=1):
+        return self._update(tokens, take=False)[1]
+
+    def try_acquire(self, tokens=1):
+        return self._update(tokens, take=True)[0]
+
+    def acquire(self, tokens=1):
+        waited = 0.0
+        while True:
+            taken, wait = self._update(tokens, take=True)
+            if taken:
+                return waited
+            wait = max(wait, 0.001)
+            time.sleep(wait)
+            waited += wait
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection(object):
+    """
+    A minimal client for the Redis protocol (RESP), safe to use from multiple threads
+
+    :param host: the host of the redis server. Default: localhost
+    :param port: the port. Default: 6379
+    :param password: sent with AUTH after connecting
+    :param db: selected after connecting. Default: 0
+    :param timeout: socket timeout in seconds. Default: 5.0
+    """
+
+    def __init__(self, host='localhost', port=6379, password=None, db=0, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.db = db
+        self.timeout = timeout
+        self._socket = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._socket = socket.create_connection((self.host, self.port), self.timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._socket.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.db:
+            self._call('SELECT', self.db)
+
+    def close(self):
+        with self._lock:
+            if self._socket:
+                self._reader.close()
+                self._socket.close()
+                self._socket = None
+
+    @staticmethod
+    def _encode(args):
+        parts = [b'*' + str(len(args)).encode('ascii') + b'\r\n']
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$' + str(len(arg)).encode('ascii') + b'\r\n' + arg + b'\r\n')
+        return b''.join(parts)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError('The redis server closed the connection')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            raise RedisError(payload.decode('utf-8'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError('Unknown reply {!r}'.format(line))
+
+    def _call(self, *args):
+        self._socket.sendall(self._encode(args))
+        return self._read_reply()
+
+    def execute(self, *args):
+        """
+        Sends a command and returns its reply, a broken connection is opened again once
+
+        :param args: the command and its arguments e.g: 'INCR', 'key'
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._socket is None:
+                        self._connect()
+                    return self._call(*args)
+                except (socket.error, ConnectionError):
+                    self._socket = None
+                    if attempt:
+                        raise
+
+
+# A sliding window log: KEYS[1] is a sorted set of the times of the requests of the last window in milliseconds,
+# KEYS[2] numbers them. The check and the update run atomically in redis, so a denied request takes nothing.
+SLIDING_WINDOW_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local tokens = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local used = redis.call('ZCARD', KEYS[1])
+if used + tokens > limit then
+    local index = used + tokens - limit - 1
+    local oldest = redis.call('ZRANGE', KEYS[1], index, index, 'WITHSCORES')
+    return math.max(tonumber(oldest[2]) + window - now, 1)
+end
+if ARGV[4] == '1' then
+    for _ = 1, tokens do
+        redis.call('ZADD', KEYS[1], now, redis.call('INCR', KEYS[2]))
+    end
+    redis.call('PEXPIRE', KEYS[1], window + 1000)
+    redis.call('PEXPIRE', KEYS[2], window + 1000)
+end
+return 0
+"""
+SLIDING_WINDOW_SHA = hashlib.sha1(SLIDING_WINDOW_SCRIPT.encode('utf-8')).hexdigest()
+
+
+class RedisRateLimiter(object):
+    """
+    Allows limit requests per window of seconds for all clients which use the same key, over processes and hosts
+    The times of the requests of the last window are kept in redis, so never more than limit requests
+    pass in any window. The time is the clock of the redis server.
+
+    :param connection: a RedisConnection
+    :param key: the key e.g: billomapy:YOUR_COMPANY
+    :param limit: requests per window
+    :param window: seconds of a window
+    """
+
+    def __init__(self, connection, key, limit, window):
+        assert (limit > 0 and window > 0)
+        self.connection = connection
+        self.key = key
+        self.limit = limit
+        self.window = float(window)
+
+    def _sliding_window(self, tokens, acquire):
+        """
+        Returns the seconds until the tokens are available, takes them if they are and acquire is True
+        """
+        if tokens > self.limit:
+            raise ValueError('{} tokens are more than the limit of {}'.format(tokens, self.limit))
+        args = (2, self.key, self.key + ':sequence', int(self.window * 1000), self.limit, tokens, 1 if acquire else 0)
+        try:
+            wait = self.connection.execute('EVALSHA', SLIDING_WINDOW_SHA, *args)
+        except RedisError as e:
+            if not str(e).startswith('NOSCRIPT'):
+                raise
+            # EVAL also caches the script for the next EVALSHA
+            wait = self.connection.execute('EVAL', SLIDING_WINDOW_SCRIPT, *args)
+        return wait / 1000.0
+
+    def wait_time(self, tokens=1):
+        return self._sliding_window(tokens, acquire=False)
+
+    def try_acquire(self, tokens=1):
+        return self._sliding_window(tokens, acquire=True) == 0
+
+    def acquire(self, tokens=1):
+        waited = 0.0
+        while True:
+            wait = self._sliding_window(tokens, acquire=True)
+            if wait == 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+
+class PriorityRateLimiter(object):
+    """
+    Wraps a rate limiter, so interactive requests go first and bulk requests leave headroom for them
+    Bulk requests only take a token if reserved tokens stay in the budget and no interactive request waits.
+
+    :param rate_limiter: e.g: TokenBucket, FileTokenBucket or RedisRateLimiter
+    :param reserved: tokens only interactive requests may use, the rate limiter has to hold at least one more.
+                     Default: 1
+    """
+
+    def __init__(self, rate_limiter, reserved=1):
+        capacity = getattr(rate_limiter, 'capacity', getattr(rate_limiter, 'limit', None))
+        if capacity is not None and reserved + 1 > capacity:
+            # bulk requests wait for reserved + 1 tokens, which the rate limiter would never hold
+            raise ValueError(
+                'reserved={} leaves no token for bulk requests, the rate limiter holds {} tokens'.format(
+                    reserved, capacity
+                )
+            )
+        self.rate_limiter = rate_limiter
+        self.reserved = reserved
+        self._interactive_waiting = 0
+        self._lock = threading.Lock()
+
+    def wait_time(self, tokens=1, priority=BULK):
+        return self.rate_limiter.wait_time(tokens + (self.reserved if priority != INTERACTIVE else 0))
+
+    def try_acquire(self, tokens=1, priority=BULK):
+        with self._lock:
+            # the check and the take are one step, so no other thread takes the reserved tokens in between
+            if priority != INTERACTIVE:
+                if self._interactive_waiting or self.rate_limiter.wait_time(tokens + self.reserved) > 0:
+                    return False
+            return self.rate_limiter.try_acquire(tokens)
+
+    def acquire(self, tokens=1, priority=BULK):
+        if priority == INTERACTIVE:
+            with self._lock:
+                self._interactive_waiting += 1
+        try:
+            waited = 0.0
+            while not self.try_acquire(tokens, priority):
+                # bulk requests check again soon, an interactive request may have taken the token
+                wait = min(max(self.wait_time(tokens, priority), 0.001), 0.05)
+                time.sleep(wait)
+                waited += wait
+            return waited
+        finally:
+            if priority == INTERACTIVE:
+                with self._lock:
+                    self._interactive_waiting -= 1
@@ -182,6 +182,107 @@ EMAIL_TEMPLATE = 'email-template'
 USER = 'users'
 USERS = 'users'
 
+"""
+DATA_KEYS maps the key of a collection (e.g: invoices) to the key of its elements (e.g: invoice)
+"""
+
+DATA_KEYS = {
+    CLIENTS: CLIENT,
+    CLIENT_PROPERTIES: CLIENT_PROPERTY,
+    CLIENT_TAGS: CLIENT_TAG,
+    CONTACTS: CONTACT,
+    SUPPLIERS: SUPPLIER,
+    SUPPLIER_PROPERTIES: SUPPLIER_PROPERTY,
+    SUPPLIER_TAGS: SUPPLIER_TAG,
+    ARTICLES: ARTICLE,
+    ARTICLE_PROPERTIES: ARTICLE_PROPERTY,
+    ARTICLE_TAGS: ARTICLE_TAG,
+    UNITS: UNIT,
+    INVOICES: INVOICE,
+    INVOICE_ITEMS: INVOICE_ITEM,
+    INVOICE_COMMENTS: INVOICE_COMMENT,
+    INVOICE_PAYMENTS: INVOICE_PAYMENT,
+    INVOICE_TAGS: INVOICE_TAG,
+    RECURRINGS: RECURRING,
+    RECURRING_ITEMS: RECURRING_ITEM,
+    RECURRING_TAGS: RECURRING_TAG,
+    RECURRING_EMAIL_RECEIVERS: RECURRING_EMAIL_RECEIVER,
+    INCOMINGS: INCOMING,
+    INCOMING_COMMENTS: INCOMING_COMMENT,
+    INCOMING_PAYMENTS: INCOMING_PAYMENT,
+    INCOMING_PROPERTIES: INCOMING_PROPERTY,
+    INCOMING_TAGS: INCOMING_TAG,
+    INBOX_DOCUMENTS: INBOX_DOCUMENT,
+    OFFERS: OFFER,
+    OFFER_ITEMS: OFFER_ITEM,
+    OFFER_COMMENTS: OFFER_COMMENT,
+    OFFER_TAGS: OFFER_TAG,
+    CREDIT_NOTES: CREDIT_NOTE,
+    CREDIT_NOTE_ITEMS: CREDIT_NOTE_ITEM,
+    CREDIT_NOTE_COMMENTS: CREDIT_NOTE_COMMENT,
+    CREDIT_NOTE_PAYMENTS: CREDIT_NOTE_PAYMENT,
+    CREDIT_NOTE_TAGS: CREDIT_NOTE_TAG,
+    CONFIRMATIONS: CONFIRMATION,
+    CONFIRMATION_ITEMS: CONFIRMATION_ITEM,
+    CONFIRMATION_COMMENTS: CONFIRMATION_COMMENT,
+    CONFIRMATION_TAGS: CONFIRMATION_TAG,
+    REMINDERS: REMINDER,
+    REMINDER_ITEMS: REMINDER_ITEM,
+    REMINDER_TAGS: REMINDER_TAG,
+    DELIVERY_NOTES: DELIVERY_NOTE,
+    DELIVERY_NOTE_ITEMS: DELIVERY_NOTE_ITEM,
+    DELIVERY_NOTE_COMMENTS: DELIVERY_NOTE_COMMENT,
+    DELIVERY_NOTE_TAGS: DELIVERY_NOTE_TAG,
+    LETTERS: LETTER,
+    LETTER_COMMENTS: LETTER_COMMENT,
+    LETTER_TAGS: LETTER_TAG,
+    TEMPLATES: TEMPLATE,
+    EMAIL_TEMPLATES: EMAIL_TEMPLATE,
+    USERS: 'user',
+}
+
+"""
+PARENT_KEYS maps the key of a sub collection (e.g: invoice-items) to the search key of its parent (e.g: invoice_id)
+"""
+
+PARENT_KEYS = {
+    CLIENT_PROPERTIES: 'client_id',
+    CLIENT_TAGS: 'client_id',
+    CONTACTS: 'client_id',
+    SUPPLIER_PROPERTIES: 'supplier_id',
+    SUPPLIER_TAGS: 'supplier_id',
+    ARTICLE_PROPERTIES: 'article_id',
+    ARTICLE_TAGS: 'article_id',
+    INVOICE_ITEMS: 'invoice_id',
+    INVOICE_COMMENTS: 'invoice_id',
+    INVOICE_PAYMENTS: 'invoice_id',
+    INVOICE_TAGS: 'invoice_id',
+    RECURRING_ITEMS: 'recurring_id',
+    RECURRING_TAGS: 'recurring_id',
+    RECURRING_EMAIL_RECEIVERS: 'recurring_id',
+    INCOMING_COMMENTS: 'incoming_id',
+    INCOMING_PAYMENTS: 'incoming_id',
+    INCOMING_PROPERTIES: 'incoming_id',
+    INCOMING_TAGS: 'incoming_id',
+    OFFER_ITEMS: 'offer_id',
+    OFFER_COMMENTS: 'offer_id',
+    OFFER_TAGS: 'offer_id',
+    CREDIT_NOTE_ITEMS: 'credit_note_id',
+    CREDIT_NOTE_COMMENTS: 'credit_note_id',
+    CREDIT_NOTE_PAYMENTS: 'credit_note_id',
+    CREDIT_NOTE_TAGS: 'credit_note_id',
+    CONFIRMATION_ITEMS: 'confirmation_id',
+    CONFIRMATION_COMMENTS: 'confirmation_id',
+    CONFIRMATION_TAGS: 'confirmation_id',
+    REMINDER_ITEMS: 'reminder_id',
+    REMINDER_TAGS: 'reminder_id',
+    DELIVERY_NOTE_ITEMS: 'delivery_note_id',
+    DELIVERY_NOTE_COMMENTS: 'delivery_note_id',
+    DELIVERY_NOTE_TAGS: 'delivery_note_id',
+    LETTER_COMMENTS: 'letter_id',
+    LETTER_TAGS: 'letter_id',
+}
+
 """
 COMMANDS for the API
 """
@@ -0,0 +1,103 @@
+"""
+Lazy random access to the records of a resource
+
+The sequence only requests the pages which hold the requested records. len() needs the first page only,
+because it holds @total. The latest loaded pages are kept in a LRU:
+
+    invoices = billomapy.sequence(INVOICES, params={'status': 'OPEN'})
+    len(invoices)     # 1 request
+    invoices[-50:]    # the last one or two pages
+    invoices[1234]    # the page of the record
+"""
+import threading
+import collections
+
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+from .projection import project_page
+from .resources import *
+
+
+class PagedSequence(Sequence):
+    """
+    :param get_function: returns a page of the resource, gets page and per_page e.g: get_invoices_per_page
+    :param resource: the resource e.g: INVOICES
+    :param per_page: records per page. Billomat may answer with less, then its per_page is used. Default: 100
+    :param max_pages: how many pages the LRU keeps. Default: 16
+    :param fields: only keep these fields of the records, see projection.resolve_fields
+    """
+
+    def __init__(self, get_function, resource, per_page=100, max_pages=16, fields=None):
+        assert (per_page > 0 and max_pages > 0)
+        self.get_function = get_function
+        self.resource = resource
+        self.per_page = per_page
+        self.max_pages = max_pages
+        self.fields = fields
+        self.fetched_pages = 0
+        self._total = None
+        self._pages = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _page(self, page):
+        """
+        Returns the records of a page from the LRU or billomat
+        """
+        with self._lock:
+            if page in self._pages:
+                self._pages.move_to_end(page)
+                return self._pages[page]
+
+        response = project_page(self.get_function(page=page, per_page=self.per_page), self.resource, self.fields)
+        info = response.get(self.resource, {})
+        records = info.get(DATA_KEYS[self.resource], [])
+        if isinstance(records, dict):
+            records = [records]
+
+        with self._lock:
+            self.fetched_pages += 1
+            if self._total is None:
+                self._total = int(info.get('@total', len(records)))
+                per_page = int(info.get('@per_page', self.per_page))
+                if per_page < self.per_page:
+                    # billomat capped the page size, the pages of the requested size are not valid
+                    self.per_page = per_page
+                    self._pages.clear()
+            self._pages[page] = records
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return records
+
+    def __len__(self):
+        if self._total is None:
+            self._page(1)
+        return self._total
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(position) for position in range(*index.indices(len(self)))]
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('{} index out of range'.format(self.resource))
+        return self._record(index)
+
+    def _record(self, index):
+        per_page = self.per_page
+        records = self._page(index // per_page + 1)
+        if per_page != self.per_page:
+            # the first page changed the page size
+            records = self._page(index // self.per_page + 1)
+        return records[index % self.per_page]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._record(index)
+
+    def __repr__(self):
+        total = 'unknown' if self._total is None else self._total
+        return '<PagedSequence {} of {} records>'.format(self.resource, total)
@@ -0,0 +1,64 @@
+"""
+Optional incremental parsing of list pages
+
+If ijson (https://github.com/ICRAR/ijson) is installed, list pages can be parsed while the bytes arrive,
+so the first records are available before the page is complete and a page is never held in memory as a whole:
+
+    for invoice in billomapy.iter_all(INVOICES, stream=True):
+        ...
+"""
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ijson = None
+
+PAGE_INFO_KEYS = ('@page', '@per_page', '@total')
+
+
+class CountingReader(object):
+    """
+    Wraps a file like object and counts the bytes which were read from it
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def iter_records(stream, resource, data_key, page_info):
+    """
+    Yields the records of a list page e.g: invoices.invoice as soon as each of them is parsed
+
+    :param stream: a file like object with the json body
+    :param resource: the head key e.g: invoices
+    :param data_key: the data key e.g: invoice
+    :param page_info: dict which gets @page, @per_page and @total of the page
+    :return: generator of dicts
+    """
+    if ijson is None:
+        raise ImportError('Streaming needs ijson, install it with pip install billomapy[streaming]')
+
+    # billomat returns a list of records or a single record as dict
+    record_prefixes = ('{}.{}.item'.format(resource, data_key), '{}.{}'.format(resource, data_key))
+    page_info_prefixes = dict(('{}.{}'.format(resource, key), key) for key in PAGE_INFO_KEYS)
+    builder = None
+    builder_prefix = None
+
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if event == 'end_map' and prefix == builder_prefix:
+                yield builder.value
+                builder = None
+        elif event == 'start_map' and prefix in record_prefixes:
+            builder = ObjectBuilder()
+            builder_prefix = prefix
+            builder.event(event, value)
+        elif prefix in page_info_prefixes:
+            page_info[page_info_prefixes[prefix]] = value
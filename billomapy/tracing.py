@@ -0,0 +1,85 @@
+"""
+Optional tracing support
+
+If opentelemetry (https://opentelemetry.io/) is installed, billomapy creates a parent span
+for every high level call (get_all_*, bulk operations) and a child span for every http request.
+If it is not installed all functions in here return a shared no-op span, so there is no overhead.
+"""
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+TRACER_NAME = 'billomapy'
+
+RESOURCE = 'billomat.resource'
+PAGE = 'billomat.page'
+PAGES = 'billomat.pages'
+RETRY = 'billomat.retry'
+CACHE_HIT = 'billomat.cache_hit'
+DEADLINE_EXCEEDED = 'billomat.deadline_exceeded'
+STALE = 'billomat.stale'
+CANCELLED = 'billomat.cancelled'
+METHOD = 'http.method'
+STATUS_CODE = 'http.status_code'
+
+
+class _NoopSpan(object):
+    """
+    Stands in for a span if opentelemetry is not installed
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_exception(self, exception):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _clean_attributes(attributes):
+    """
+    Opentelemetry does not accept None as attribute value
+    """
+    if not attributes:
+        return {}
+    return dict((key, value) for key, value in attributes.items() if value is not None)
+
+
+def span(name, attributes=None):
+    """
+    Returns a context manager which opens a span and makes it the current span
+
+    :param name: the name of the span e.g: billomapy.get_all
+    :param attributes: attributes of the span e.g: {RESOURCE: 'invoices'}
+    :return: context manager which yields the span
+    """
+    if trace is None:
+        return NOOP_SPAN
+    return trace.get_tracer(TRACER_NAME).start_as_current_span(name, attributes=_clean_attributes(attributes))
+
+
+def start_span(name, attributes=None):
+    """
+    Starts a child span of the current span without making it the current span
+    You have to call end() on it by yourself, which makes it usable for callbacks
+
+    :param name: the name of the span e.g: billomapy.request
+    :param attributes: attributes of the span
+    :return: span
+    """
+    if trace is None:
+        return NOOP_SPAN
+    return trace.get_tracer(TRACER_NAME).start_span(name, attributes=_clean_attributes(attributes))
@@ -0,0 +1,296 @@
+"""
+Pluggable transports to record and replay the traffic of both clients
+
+A recording is a gzip compressed file with one json object per request and response pair.
+The credentials in the request headers are scrubbed before they get written.
+
+Record with the sync client:
+
+    recording = RecordingAdapter('invoices.jsonl.gz')
+    billomapy = Billomapy('YOUR_COMPANY', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=recording)
+
+Replay at maximum speed (or with speed=1.0 in the original timing):
+
+    replay = ReplayAdapter('invoices.jsonl.gz')
+    billomapy = Billomapy('YOUR_COMPANY', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=replay)
+
+The flood client takes a RecordingHTTPClient or ReplayHTTPClient as transport.
+"""
+import io
+import json
+import gzip
+import time
+import base64
+import threading
+import collections
+
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import RequestException
+from tornado import httpclient, httputil, ioloop
+from tornado.concurrent import Future
+from urllib3.response import HTTPResponse
+
+SCRUBBED_HEADERS = ('x-billomatapikey', 'x-appid', 'x-appsecret', 'authorization', 'cookie')
+SCRUBBED_VALUE = '***'
+# The recorded body is always decoded, so these headers would lie on replay
+DROPPED_RESPONSE_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'set-cookie')
+
+
+class ReplayMissError(RequestException):
+    """
+    The replayed recording has no (more) responses for this request
+    """
+
+    def __init__(self, method, url):
+        super(ReplayMissError, self).__init__('No recorded response for {} {}'.format(method, url))
+        self.method = method
+        self.url = url
+
+
+def request_key(method, url):
+    """
+    Returns the key of a request which does not depend on the host or the order of the query parameters
+    """
+    split_url = urlsplit(url)
+    return '{} {}?{}'.format(method.upper(), split_url.path, urlencode(sorted(parse_qsl(split_url.query))))
+
+
+def scrub_headers(headers):
+    return dict(
+        (key, SCRUBBED_VALUE if key.lower() in SCRUBBED_HEADERS else value)
+        for key, value in headers.items()
+    )
+
+
+def _encode_body(body):
+    if body is None:
+        return {}
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    try:
+        return {'body': body.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'body_base64': base64.b64encode(body).decode('ascii')}
+
+
+def _decode_body(entry):
+    if 'body_base64' in entry:
+        return base64.b64decode(entry['body_base64'])
+    return entry.get('body', '').encode('utf-8')
+
+
+class Recorder(object):
+    """
+    Appends request and response pairs to a recording, safe to use from multiple threads
+
+    :param path: path of the recording e.g: invoices.jsonl.gz
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, method, url, request_headers, request_body, status, response_headers, response_body, elapsed):
+        entry = {
+            'key': request_key(method, url),
+            'method': method.upper(),
+            'url': url,
+            'request_headers': scrub_headers(request_headers),
+            'request': _encode_body(request_body),
+            'status': status,
+            'headers': dict(
+                (key, value) for key, value in response_headers.items()
+                if key.lower() not in DROPPED_RESPONSE_HEADERS
+            ),
+            'elapsed': elapsed,
+        }
+        entry.update(_encode_body(response_body))
+        line = (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+        with self._lock:
+            # Every append is a gzip member of its own, so the file is valid after every request
+            with gzip.open(self.path, 'ab') as recording:
+                recording.write(line)
+
+
+class Recording(object):
+    """
+    Loads a recording and hands out the recorded responses in the recorded order per request
+
+    :param path: path of the recording
+    :param speed: None replays at maximum speed, 1.0 in the original timing, 2.0 twice as fast
+    """
+
+    def __init__(self, path, speed=None):
+        self.path = path
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._entries = collections.defaultdict(collections.deque)
+        with gzip.open(path, 'rb') as recording:
+            for line in recording:
+                if line.strip():
+                    entry = json.loads(line.decode('utf-8'))
+                    self._entries[entry['key']].append(entry)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def pop(self, method, url):
+        """
+        Returns the next recorded entry for the request, the last one is repeated for further requests
+        """
+        key = request_key(method, url)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise ReplayMissError(method, url)
+            return entries.popleft() if len(entries) > 1 else entries[0]
+
+    def delay(self, entry):
+        """
+        Seconds a replayed response has to wait to keep the recorded timing
+        """
+        if not self.speed:
+            return 0.0
+        return entry['elapsed'] / self.speed
+
+    @staticmethod
+    def body(entry):
+        return _decode_body(entry)
+
+
+class RecordingAdapter(BaseAdapter):
+    """
+    Transport for Billomapy.session which sends requests with a HTTPAdapter and records them
+
+    :param path: path of the recording
+    :param adapter: the adapter which really sends the requests. Default: HTTPAdapter()
+    """
+
+    def __init__(self, path, adapter=None):
+        super(RecordingAdapter, self).__init__()
+        self.recorder = Recorder(path)
+        self.adapter = adapter or HTTPAdapter()
+
+    def send(self, request, **kwargs):
+        start = time.time()
+        response = self.adapter.send(request, **kwargs)
+        content = response.content
+        self.recorder.record(
+            method=request.method,
+            url=request.url,
+            request_headers=request.headers,
+            request_body=request.body,
+            status=response.status_code,
+            response_headers=response.headers,
+            response_body=content,
+            elapsed=time.time() - start,
+        )
+        # reading the content consumed the raw stream, streamed reads get the decoded body instead
+        response.raw = HTTPResponse(
+            body=io.BytesIO(content),
+            headers=dict(
+                (key, value) for key, value in response.headers.items()
+                if key.lower() not in DROPPED_RESPONSE_HEADERS
+            ),
+            status=response.status_code,
+            preload_content=False,
+            decode_content=False,
+        )
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    Transport for Billomapy.session which answers requests from a recording without network access
+
+    :param path: path of the recording
+    :param speed: None replays at maximum speed, 1.0 in the original timing
+    """
+
+    def __init__(self, path, speed=None):
+        super(ReplayAdapter, self).__init__()
+        self.recording = Recording(path, speed=speed)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        entry = self.recording.pop(request.method, request.url)
+        delay = self.recording.delay(entry)
+        if delay:
+            time.sleep(delay)
+
+        raw = HTTPResponse(
+            body=io.BytesIO(Recording.body(entry)),
+            headers=entry['headers'],
+            status=entry['status'],
+            preload_content=False,
+            decode_content=False,
+        )
+        return self.build_response(request, raw)
+
+
+class RecordingHTTPClient(object):
+    """
+    Transport for the flood client which fetches with an AsyncHTTPClient and records the responses
+
+    :param path: path of the recording
+    :param http_client: the client which really fetches. Default: AsyncHTTPClient()
+    """
+
+    def __init__(self, path, http_client=None):
+        self.recorder = Recorder(path)
+        self.http_client = http_client or httpclient.AsyncHTTPClient()
+
+    def fetch(self, request, callback=None, **kwargs):
+        def record(response):
+            self.recorder.record(
+                method=request.method,
+                url=request.url,
+                request_headers=request.headers,
+                request_body=request.body,
+                status=response.code,
+                response_headers=response.headers,
+                response_body=response.body,
+                elapsed=response.request_time or 0.0,
+            )
+            if callback:
+                callback(response)
+
+        return self.http_client.fetch(request, record, **kwargs)
+
+
+class ReplayHTTPClient(object):
+    """
+    Transport for the flood client which answers requests from a recording without network access
+
+    :param path: path of the recording
+    :param speed: None replays at maximum speed, 1.0 in the original timing
+    """
+
+    def __init__(self, path, speed=None):
+        self.recording = Recording(path, speed=speed)
+
+    def fetch(self, request, callback=None, **kwargs):
+        entry = self.recording.pop(request.method, request.url)
+        response = httpclient.HTTPResponse(
+            request=request,
+            code=entry['status'],
+            headers=httputil.HTTPHeaders(entry['headers']),
+            buffer=io.BytesIO(Recording.body(entry)),
+            request_time=entry['elapsed'],
+        )
+        future = Future()
+
+        def deliver():
+            future.set_result(response)
+            if callback:
+                callback(response)
+
+        ioloop.IOLoop.current().call_later(self.recording.delay(entry), deliver)
+        return future
+
+    def close(self):
+        pass
@@ -4,6 +4,10 @@ setup(
     name='billomapy',
     version='2.5.3',
     install_requires=['requests==2.20.0', 'tornado==4.2'],
+    extras_require={
+        'tracing': ['opentelemetry-api'],
+        'streaming': ['ijson'],
+    },
     packages=['billomapy'],
     url='https://github.com/bykof/billomapy',
     license='Apache License 2.0',
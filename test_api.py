@@ -1,9 +1,62 @@
+import io
+import os
+import json
+import base64
+import multiprocessing
+import datetime
+import decimal
+import gzip
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 import mock
 
 import requests
 
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+from tornado import gen, ioloop
+from tornado.concurrent import Future
+
+from billomapy import streaming, tracing
+from billomapy.accounts import AccountPool
 from billomapy.billomapy import Billomapy
+from billomapy.cache import FileCache
+from billomapy.damn_flood_billomapy import Billomapy as FloodBillomapy
+from billomapy.aggregation import Aggregation, month
+from billomapy.cancellation import CancellationToken, Cancelled
+from billomapy.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from billomapy.deadline import DeadlineExceeded, PartialResult
+from billomapy.hedging import HedgePolicy
+from billomapy.mirror import BillomatMirror
+from billomapy.outbox import DONE, FAILED, PENDING, UNKNOWN, Outbox, Ref
+from billomapy.mock_server import MockBillomatServer, MockRedisServer
+from billomapy.pagination import AdaptivePageSize
+from billomapy.query import Query
+from billomapy.sequence import PagedSequence
+from billomapy.ratelimit import (
+    BULK, INTERACTIVE, FileTokenBucket, PriorityRateLimiter, RedisConnection, RedisRateLimiter, TokenBucket
+)
+from billomapy.pipeline import DocumentPipeline
+from billomapy.processing import ProcessStage
+from billomapy.transport import Recorder, RecordingAdapter, ReplayAdapter, ReplayHTTPClient, ReplayMissError
+from billomapy.resources import (
+    CLIENTS, CLIENT, DATA_KEYS, INVOICES, INVOICE, INVOICE_ITEM, INVOICE_ITEMS, INVOICE_PAYMENTS, UNITS, UNIT
+)
+
+
+def invoice_total(invoice):
+    return invoice['id'], float(invoice['total_gross'])
+
+
+def take_tokens(path):
+    bucket = FileTokenBucket(path, rate=0.001, capacity=5)
+    return sum(bucket.try_acquire() for _ in range(5))
+
+
+def pdf_summary(document):
+    return document['id'], len(document['content'])
 
 
 class TestBillomapy(unittest.TestCase):
@@ -16,8 +69,1350 @@ class TestBillomapy(unittest.TestCase):
         self.assertEqual(billomapy.api_url, 'https://TEST_ID.billomat.net/api/')
 
     def test_get_clients_per_page(self):
-        # TODO: To be done... someday
-        pass
+        with MockBillomatServer(records={CLIENTS: 30}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+            billomapy.api_url = server.api_url
+            response = billomapy.get_clients_per_page(per_page=20, page=2)
+
+        self.assertEqual(response[CLIENTS]['@total'], '30')
+        self.assertEqual([client['id'] for client in response[CLIENTS][CLIENT]], [str(i) for i in range(21, 31)])
+
+    def test_get_all_requests_every_page(self):
+        billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+        response = mock.Mock(status_code=requests.codes.ok, content=b'', headers={}, raw=None)
+        response.json.return_value = {CLIENTS: {'@total': '3', '@per_page': '2', '@page': '1', 'client': []}}
+
+        with mock.patch.object(billomapy.session, 'request', return_value=response) as request:
+            data = billomapy.get_all_clients()
+
+        self.assertEqual(len(data), 2)
+        self.assertEqual([call[1]['params']['page'] for call in request.call_args_list], [1, 2])
+        self.assertEqual(request.call_args[1]['method'], 'GET')
+
+    def test_get_invoices_with_include(self):
+        with MockBillomatServer(records={CLIENTS: 2, INVOICES: 6}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+            billomapy.api_url = server.api_url
+            invoices = billomapy.get_invoices([3, 1, 2, 4, 5, 6], include=['client', 'items', 'payments'])
+            request_count = server.request_count
+
+        # 6 invoices, 2 distinct clients, 6 item pages and 6 payment pages
+        self.assertEqual(request_count, 20)
+        self.assertEqual([invoice['id'] for invoice in invoices], ['3', '1', '2', '4', '5', '6'])
+        self.assertEqual(invoices[1]['client']['id'], invoices[1]['client_id'])
+        self.assertIs(invoices[1]['client'], invoices[0]['client'])
+        self.assertEqual([item['invoice_id'] for item in invoices[0]['items']], ['3', '3', '3'])
+        self.assertEqual(len(invoices[0]['payments']), 3)
+        with self.assertRaises(ValueError):
+            billomapy.get_invoices([1], include=['offers'])
+
+    def test_concurrent_identical_gets_are_coalesced(self):
+        with MockBillomatServer(latency=0.2) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+            billomapy.api_url = server.api_url
+            results = []
+            threads = [
+                threading.Thread(target=lambda: results.append(billomapy.get_client(1))) for _ in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            billomapy.get_client(2)
+            request_count = server.request_count
+
+        self.assertEqual(request_count, 2)
+        self.assertEqual(billomapy.single_flight.coalesced, 4)
+        self.assertEqual([result[CLIENT]['id'] for result in results], ['1'] * 5)
+
+        results[0][CLIENT]['name'] = 'changed'
+        self.assertNotIn('changed', [result[CLIENT]['name'] for result in results[1:]])
+
+    def test_flood_coalesces_gets_in_flight(self):
+        http_client = mock.Mock()
+        billomapy = FloodBillomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=http_client)
+        first, second = mock.Mock(), mock.Mock()
+        billomapy.queue_get_request(CLIENTS, {'client_id': 1})
+        billomapy._fetch(billomapy._create_http_get_request(CLIENTS, {'client_id': 1}), first)
+        billomapy._fetch(billomapy._create_http_get_request(CLIENTS, {'client_id': 2}), second)
+
+        self.assertEqual(http_client.fetch.call_count, 2)
+        self.assertEqual(billomapy.request_counter, 3)
+        response = mock.Mock(code=200, headers={}, body=b'{}')
+        http_client.fetch.call_args_list[0][0][1](response)
+        first.assert_called_once_with(response)
+        self.assertFalse(second.called)
+
+
+class TestAccountPool(unittest.TestCase):
+    def test_tasks_are_scheduled_round_robin(self):
+        pool = AccountPool(dict(
+            (name, {'billomat_id': name, 'api_key': 'API_KEY', 'app_id': 'APP_ID', 'app_secret': 'APP_SECRET'})
+            for name in ('a', 'b')
+        ), max_workers=1)
+        gate = threading.Event()
+        order = []
+
+        def task(billomapy):
+            gate.wait()
+            order.append(billomapy.billomat_id)
+
+        with pool:
+            futures = [pool.submit('a', task) for _ in range(6)] + [pool.submit('b', task) for _ in range(2)]
+            gate.set()
+            for future in futures:
+                future.result()
+
+        self.assertEqual(order, ['a', 'b', 'a', 'b', 'a', 'a', 'a', 'a'])
+
+    def test_map_with_rate_limits(self):
+        with MockBillomatServer(records={CLIENTS: 3}) as server:
+            accounts = {}
+            for name in ('a', 'b', 'c'):
+                accounts[name] = Billomapy(name, 'API_KEY', 'APP_ID', 'APP_SECRET')
+                accounts[name].api_url = server.api_url
+            with AccountPool(accounts, rate=100, capacity=1) as pool:
+                results = pool.map(lambda billomapy: billomapy.get_all_clients())
+
+        self.assertEqual(list(results), ['a', 'b', 'c'])
+        self.assertEqual(
+            [len(Billomapy.resolve_response_data(CLIENTS, CLIENT, result)) for result in results.values()], [3, 3, 3]
+        )
+        self.assertIsInstance(accounts['a'].rate_limiter, TokenBucket)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        self.assertGreater(bucket.wait_time(), 0)
+        self.assertLessEqual(bucket.wait_time(), 0.1)
+
+
+class TestSharedRateLimit(unittest.TestCase):
+    def test_file_token_bucket_is_shared_by_processes(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'TEST_ID.bucket')
+            pool = multiprocessing.Pool(4)
+            try:
+                taken = pool.map(take_tokens, [path] * 4)
+            finally:
+                pool.close()
+                pool.join()
+            self.assertEqual(sum(taken), 5)
+            self.assertGreater(FileTokenBucket(path, rate=0.001, capacity=5).wait_time(), 100)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_redis_rate_limiter(self):
+        with MockRedisServer() as server:
+            limiters = [
+                RedisRateLimiter(RedisConnection(port=server.port), 'billomapy:TEST_ID', limit=5, window=3600)
+                for _ in range(2)
+            ]
+            taken = [limiter.try_acquire() for _ in range(4) for limiter in limiters]
+            other = RedisRateLimiter(RedisConnection(port=server.port), 'billomapy:OTHER', limit=5, window=3600)
+
+            self.assertEqual(taken.count(True), 5)
+            self.assertGreater(limiters[0].wait_time(), 0)
+            self.assertEqual(other.wait_time(), 0)
+            self.assertTrue(other.try_acquire())
+            self.assertEqual(limiters[0].connection.execute('PING'), 'PONG')
+
+    def test_redis_denied_requests_take_nothing(self):
+        with MockRedisServer() as server:
+            limiter = RedisRateLimiter(RedisConnection(port=server.port), 'billomapy:TEST_ID', limit=2, window=0.4)
+            self.assertEqual([limiter.try_acquire() for _ in range(10)], [True, True] + [False] * 8)
+            wait = limiter.wait_time()
+            self.assertGreater(wait, 0.3)
+            self.assertLessEqual(wait, 0.4)
+            time.sleep(wait)
+            self.assertTrue(limiter.try_acquire())
+
+    def test_redis_never_more_than_limit_in_a_window(self):
+        with MockRedisServer() as server:
+            limiter = RedisRateLimiter(RedisConnection(port=server.port), 'billomapy:TEST_ID', limit=5, window=1.0)
+            granted = [time.time() for _ in range(5) if limiter.try_acquire()]
+            time.sleep(0.6)
+            end = time.time() + 1.5
+            while time.time() < end:
+                if limiter.try_acquire():
+                    granted.append(time.time())
+                time.sleep(0.02)
+
+        self.assertGreaterEqual(len(granted), 10)
+        for start in granted:
+            self.assertLessEqual(len([at for at in granted if start <= at < start + 0.99]), 5)
+
+
+class TestPriorities(unittest.TestCase):
+    def test_bulk_leaves_reserved_tokens(self):
+        limiter = PriorityRateLimiter(TokenBucket(rate=0.001, capacity=3), reserved=1)
+        self.assertTrue(limiter.try_acquire(priority=BULK))
+        self.assertTrue(limiter.try_acquire(priority=BULK))
+        self.assertFalse(limiter.try_acquire(priority=BULK))
+        self.assertGreater(limiter.wait_time(priority=BULK), 100)
+        self.assertEqual(limiter.wait_time(priority=INTERACTIVE), 0)
+        self.assertTrue(limiter.try_acquire(priority=INTERACTIVE))
+
+    def test_reserved_tokens_need_a_larger_bucket(self):
+        with self.assertRaises(ValueError):
+            PriorityRateLimiter(TokenBucket(rate=0.5), reserved=1)
+        limiter = PriorityRateLimiter(TokenBucket(rate=2), reserved=1)
+        self.assertTrue(limiter.try_acquire(priority=BULK))
+
+    def test_bulk_threads_do_not_take_reserved_tokens(self):
+        limiter = PriorityRateLimiter(TokenBucket(rate=0.001, capacity=3), reserved=1)
+        taken = []
+        threads = [threading.Thread(target=lambda: taken.append(limiter.try_acquire(priority=BULK))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(taken.count(True), 2)
+
+    def test_pages_are_bulk_and_single_reads_interactive(self):
+        rate_limiter = mock.Mock(spec=PriorityRateLimiter)
+        with MockBillomatServer(records={CLIENTS: 3}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', rate_limiter=rate_limiter)
+            billomapy.api_url = server.api_url
+            billomapy.get_all_clients()
+            billomapy.get_client(1)
+            with billomapy.priority(INTERACTIVE):
+                billomapy.get_all_clients()
+
+        self.assertEqual(
+            [call[1]['priority'] for call in rate_limiter.acquire.call_args_list], [BULK, INTERACTIVE, INTERACTIVE]
+        )
+
+    def test_flood_interactive_requests_jump_the_queue(self):
+        http_client = mock.Mock()
+        billomapy = FloodBillomapy(
+            'TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=http_client, max_in_flight=3, reserved_in_flight=1
+        )
+        for page in range(1, 6):
+            billomapy.queue_get_request(INVOICES, {'page': page}, priority=BULK)
+        billomapy.queue_get_request(INVOICES + '/42')
+
+        fetched = [call[0][0].url for call in http_client.fetch.call_args_list]
+        self.assertEqual(len(fetched), 3)
+        self.assertTrue(fetched[2].endswith('invoices/42'))
+
+        http_client.fetch.call_args_list[2][0][1](mock.Mock(code=200, headers={}, body=b'{}'))
+        self.assertEqual(http_client.fetch.call_count, 3)
+        http_client.fetch.call_args_list[0][0][1](mock.Mock(code=200, headers={}, body=b'{}'))
+        self.assertEqual(http_client.fetch.call_count, 4)
+        self.assertTrue(http_client.fetch.call_args[0][0].url.endswith('page=3'))
+        self.assertEqual(billomapy.request_counter, 4)
+
+
+class TestHedging(unittest.TestCase):
+    def slow_first_request(self, server):
+        handle = server.handle
+        calls = []
+
+        def slow_handle(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                time.sleep(1.0)
+            return handle(*args)
+
+        server.handle = slow_handle
+        return calls
+
+    def test_slow_get_is_hedged(self):
+        hedge = HedgePolicy(initial_delay=0.05)
+        with MockBillomatServer() as server:
+            calls = self.slow_first_request(server)
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', hedge=hedge)
+            billomapy.api_url = server.api_url
+            start = time.time()
+            data = billomapy.get_client(1)
+            elapsed = time.time() - start
+            billomapy.get_all_clients()
+
+        self.assertEqual(data[CLIENT]['id'], '1')
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual((hedge.hedged, hedge.hedge_wins), (1, 1))
+        self.assertEqual(len(calls), 3)
+
+    def test_hedges_need_budget(self):
+        hedge = HedgePolicy(initial_delay=0.05)
+        with MockBillomatServer() as server:
+            calls = self.slow_first_request(server)
+            billomapy = Billomapy(
+                'TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', hedge=hedge,
+                rate_limiter=TokenBucket(rate=0.001, capacity=1),
+            )
+            billomapy.api_url = server.api_url
+            billomapy.get_client(1)
+
+        self.assertEqual(hedge.hedged, 0)
+        self.assertEqual(len(calls), 1)
+
+    def test_delay_follows_the_percentile(self):
+        hedge = HedgePolicy(percentile=90, min_samples=10, max_delay=0.5)
+        self.assertEqual(hedge.delay(), 0.5)
+        for latency in range(1, 11):
+            hedge.latency.add(latency / 100.0)
+        self.assertEqual(hedge.delay(), 0.09)
+        self.assertFalse(hedge.applies('GET', INVOICES, {'page': 2}))
+        self.assertFalse(hedge.applies('POST', INVOICES))
+
+
+class TestDeadline(unittest.TestCase):
+    def test_get_all_returns_partial_pages(self):
+        with MockBillomatServer(records={CLIENTS: 30}, latency=0.3) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', page_size=10)
+            billomapy.api_url = server.api_url
+            start = time.time()
+            with billomapy.deadline(0.5) as deadline:
+                data = billomapy.get_all_clients()
+            elapsed = time.time() - start
+
+            with self.assertRaises(DeadlineExceeded), billomapy.deadline(0.1):
+                billomapy.get_client(1)
+            with billomapy.deadline(5.0) as complete:
+                complete_data = billomapy.get_all_clients()
+
+        self.assertIsInstance(data, PartialResult)
+        self.assertTrue(deadline.exceeded)
+        self.assertEqual(len(data), 1)
+        self.assertLess(elapsed, 0.8)
+        self.assertFalse(complete.exceeded)
+        self.assertNotIsInstance(complete_data, PartialResult)
+        self.assertEqual(len(complete_data), 3)
+
+    def test_coalesced_callers_keep_their_own_deadline(self):
+        with MockBillomatServer(records={CLIENTS: 3}, latency=0.5) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+            billomapy.api_url = server.api_url
+
+            def run(results, name, seconds):
+                try:
+                    if seconds is None:
+                        results[name] = billomapy.get_client(1)
+                    else:
+                        with billomapy.deadline(seconds):
+                            results[name] = billomapy.get_client(1)
+                except DeadlineExceeded as e:
+                    results[name] = e
+                results[name + '_elapsed'] = time.time() - start
+
+            results = {}
+            for leader, follower in ((0.2, None), (None, 0.2)):
+                start = time.time()
+                threads = [threading.Thread(target=run, args=(results, name, seconds))
+                           for name, seconds in (('leader', leader), ('follower', follower))]
+                threads[0].start()
+                time.sleep(0.05)
+                threads[1].start()
+                for thread in threads:
+                    thread.join()
+                if leader:
+                    self.assertIsInstance(results['leader'], DeadlineExceeded)
+                    self.assertEqual(results['follower'][CLIENT]['id'], '1')
+                else:
+                    self.assertEqual(results['leader'][CLIENT]['id'], '1')
+                    self.assertIsInstance(results['follower'], DeadlineExceeded)
+                    self.assertLess(results['follower_elapsed'], 0.4)
+
+    def test_flood_drops_outstanding_requests(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'items.jsonl.gz')
+            recorder = Recorder(path)
+            for invoice_id, elapsed in ((1, 0.0), (2, 0.05), (3, 2.0)):
+                body = {INVOICE_ITEMS: {'@page': '1', '@per_page': '100', '@total': '1',
+                                        'invoice-item': {'id': str(invoice_id), 'invoice_id': str(invoice_id)}}}
+                recorder.record(
+                    'GET', 'https://TEST_ID.billomat.net/api/invoice-items?per_page=100&page=1&invoice_id={}'.format(
+                        invoice_id
+                    ), {}, None, 200, {}, json.dumps(body), elapsed
+                )
+            billomapy = FloodBillomapy(
+                'TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=ReplayHTTPClient(path, speed=1.0)
+            )
+            start = time.time()
+            with billomapy.deadline(0.5) as deadline:
+                data = billomapy.get_all_invoice_items([1, 2, 3])
+            elapsed = time.time() - start
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertIsInstance(data, PartialResult)
+        self.assertTrue(deadline.exceeded)
+        self.assertEqual(len(data), 2)
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(billomapy.request_counter, 0)
+
+
+class TestCancellation(unittest.TestCase):
+    def test_cancelled_reads_stop_between_pages_and_records(self):
+        with MockBillomatServer(records={CLIENTS: 50}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', page_size=10)
+            billomapy.api_url = server.api_url
+            records = []
+            token = CancellationToken()
+            with billomapy.cancellation(token):
+                for record in billomapy.iter_all(CLIENTS):
+                    records.append(record)
+                    if len(records) == 10:
+                        token.cancel()
+                pages = billomapy.get_all_clients()
+            request_count = server.request_count
+
+            streamed = []
+            token = CancellationToken()
+            with billomapy.cancellation(token):
+                for record in billomapy.iter_all(CLIENTS, stream=True):
+                    streamed.append(record)
+                    if len(streamed) == 5:
+                        token.cancel()
+
+        self.assertEqual(len(records), 10)
+        self.assertEqual(request_count, 1)
+        self.assertIsInstance(pages, PartialResult)
+        self.assertEqual(pages, [])
+        self.assertEqual(len(streamed), 5)
+
+    def test_coalesced_callers_keep_their_own_token(self):
+        class SlowRateLimiter(object):
+            def acquire(self):
+                time.sleep(0.2)
+
+        with MockBillomatServer(records={CLIENTS: 3}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', rate_limiter=SlowRateLimiter())
+            billomapy.api_url = server.api_url
+
+            def run(results, name, token):
+                try:
+                    if token is None:
+                        results[name] = billomapy.get_client(1)
+                    else:
+                        with billomapy.cancellation(token):
+                            results[name] = billomapy.get_client(1)
+                except Cancelled as e:
+                    results[name] = e
+                results[name + '_elapsed'] = time.time() - start
+
+            for cancelled in ('leader', 'follower'):
+                tokens = {'leader': CancellationToken(), 'follower': CancellationToken()}
+                results = {}
+                start = time.time()
+                threads = [threading.Thread(target=run, args=(results, name, tokens[name]))
+                           for name in ('leader', 'follower')]
+                threads[0].start()
+                time.sleep(0.05)
+                threads[1].start()
+                time.sleep(0.05)
+                tokens[cancelled].cancel()
+                for thread in threads:
+                    thread.join()
+
+                other = 'follower' if cancelled == 'leader' else 'leader'
+                self.assertIsInstance(results[cancelled], Cancelled)
+                self.assertEqual(results[other][CLIENT]['id'], '1')
+                if cancelled == 'follower':
+                    self.assertLess(results['follower_elapsed'], 0.2)
+
+    def test_flood_cancel_from_another_thread(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'items.jsonl.gz')
+            recorder = Recorder(path)
+            for invoice_id, elapsed in ((1, 0.0), (2, 2.0), (3, 2.0)):
+                body = {INVOICE_ITEMS: {'@page': '1', '@per_page': '100', '@total': '1',
+                                        'invoice-item': {'id': str(invoice_id), 'invoice_id': str(invoice_id)}}}
+                recorder.record(
+                    'GET', 'https://TEST_ID.billomat.net/api/invoice-items?per_page=100&page=1&invoice_id={}'.format(
+                        invoice_id
+                    ), {}, None, 200, {}, json.dumps(body), elapsed
+                )
+            billomapy = FloodBillomapy(
+                'TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=ReplayHTTPClient(path, speed=1.0)
+            )
+            token = CancellationToken()
+            timer = threading.Timer(0.2, token.cancel)
+            start = time.time()
+            timer.start()
+            with billomapy.cancellation(token):
+                data = billomapy.get_all_invoice_items([1, 2, 3])
+            elapsed = time.time() - start
+            timer.join()
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertIsInstance(data, PartialResult)
+        self.assertEqual(len(data), 1)
+        self.assertLess(elapsed, 1.0)
+
+
+class TestOutbox(unittest.TestCase):
+    def test_writes_are_ordered_and_references_resolved(self):
+        statuses = []
+        with MockBillomatServer() as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+            billomapy.api_url = server.api_url
+            outbox = Outbox(billomapy, on_status=lambda entry: statuses.append((entry['key'], entry['status'])))
+            invoice = outbox.create(INVOICES, {'invoice': {'client_id': '1'}}, entity='order-1', key='order-1-invoice')
+            outbox.create(
+                INVOICE_ITEMS, {'invoice-item': {'invoice_id': Ref(invoice), 'title': 'A'}},
+                entity='order-1', key='order-1-item',
+            )
+            self.assertEqual(outbox.create(INVOICES, {'invoice': {}}, key='order-1-invoice'), invoice)
+            outbox.create('unknown', {'unknown': {}}, entity='order-2', key='order-2-bad')
+            outbox.create(INVOICES, {'invoice': {'client_id': '2'}}, entity='order-2', key='order-2-invoice')
+
+            sent = outbox.drain()
+            item = billomapy.get_invoice_item(outbox.get('order-1-item')['result_id'])
+            posts = server.requests_by_method['POST']
+
+        self.assertEqual(sent, 3)
+        self.assertEqual(posts, 3)
+        self.assertEqual(item[INVOICE_ITEM]['invoice_id'], outbox.get(invoice)['result_id'])
+        self.assertEqual((outbox.count(DONE), outbox.count(FAILED)), (2, 2))
+        self.assertEqual(outbox.get('order-2-invoice')['error'], 'The write order-2-bad failed before')
+        self.assertEqual(sorted(statuses), [
+            ('order-1-invoice', DONE), ('order-1-item', DONE), ('order-2-bad', FAILED), ('order-2-invoice', FAILED)
+        ])
+        self.assertLess(statuses.index(('order-1-invoice', DONE)), statuses.index(('order-1-item', DONE)))
+
+    def test_writes_without_id_or_with_broken_payloads_are_not_done(self):
+        billomapy = mock.Mock()
+        billomapy._create_post_request.side_effect = [
+            None, {'invoice': {'id': '7'}}, {'invoice': {}}, KeyError('client_id')
+        ]
+        outbox = Outbox(billomapy, retry_delay=0)
+        limited = outbox.create(INVOICES, {'invoice': {}}, entity='a')
+        outbox.drain()
+        self.assertEqual(
+            (outbox.get(limited)['status'], outbox.get(limited)['attempts'], outbox.get(limited)['result_id']),
+            (DONE, 2, '7')
+        )
+
+        without_id = outbox.create(INVOICES, {'invoice': {}}, entity='b')
+        broken = outbox.create(CLIENTS, {'client': {}}, entity='c')
+        outbox.drain()
+
+        self.assertEqual(outbox.get(without_id)['status'], FAILED)
+        self.assertEqual(outbox.get(broken)['status'], FAILED)
+        self.assertEqual(outbox.get(broken)['attempts'], 1)
+
+    def test_creates_which_may_be_done_are_not_sent_again(self):
+        def response(status_code):
+            return requests.HTTPError(response=mock.Mock(status_code=status_code))
+
+        errors = {
+            'read timeout': [requests.ReadTimeout()],
+            'reset': [requests.ConnectionError(ProtocolError('Connection aborted.', ConnectionResetError()))],
+            '500': [response(500)],
+            'refused': [requests.ConnectionError(MaxRetryError(None, '/', NewConnectionError(None, 'refused')))],
+            'connect timeout': [requests.ConnectTimeout()],
+            '503': [response(503)],
+        }
+
+        def create(resource, data, **kwargs):
+            note = data[DATA_KEYS[resource]]['note']
+            if errors.get(note):
+                raise errors[note].pop()
+            return {DATA_KEYS[resource]: {'id': note}}
+
+        billomapy = mock.Mock()
+        billomapy._create_post_request.side_effect = create
+        billomapy._create_put_request.side_effect = [requests.ReadTimeout(), {}, {}]
+        outbox = Outbox(billomapy, retry_delay=0)
+        keys = dict((note, outbox.create(INVOICES, {'invoice': {'note': note}}, entity=note)) for note in errors)
+        item = outbox.create(INVOICE_ITEMS, {'invoice-item': {'invoice_id': Ref(keys['reset']), 'note': 'item'}})
+        later = outbox.update(INVOICES, 'read timeout', {'invoice': {}}, entity='read timeout')
+        retried = outbox.update(CLIENTS, 1, {'client': {}})
+        while outbox.drain():
+            pass
+
+        self.assertEqual(
+            [entry['key'] for entry in outbox.entries(UNKNOWN)], [keys['read timeout'], keys['reset'], keys['500']]
+        )
+        self.assertEqual(
+            [outbox.get(keys[note])['status'] for note in ('refused', 'connect timeout', '503')], [DONE] * 3
+        )
+        self.assertEqual((outbox.get(item)['status'], outbox.get(later)['status']), (PENDING, PENDING))
+        self.assertEqual(outbox.get(retried)['status'], DONE)
+
+        outbox.resolve(keys['reset'], 'reset')
+        outbox.retry(keys['read timeout'])
+        outbox.drain()
+        outbox.drain()
+
+        self.assertEqual(outbox.get(item)['status'], DONE)
+        self.assertIn(
+            {'invoice-item': {'invoice_id': 'reset', 'note': 'item'}},
+            [call[0][1] for call in billomapy._create_post_request.call_args_list]
+        )
+        self.assertEqual(outbox.get(keys['read timeout'])['status'], DONE)
+        self.assertEqual(outbox.get(later)['status'], DONE)
+        with self.assertRaises(ValueError):
+            outbox.retry(keys['reset'])
+
+    def test_running_creates_are_unknown_after_a_restart(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'outbox.sqlite')
+            outbox = Outbox(mock.Mock(), path)
+            create = outbox.create(INVOICES, {'invoice': {}})
+            update = outbox.update(INVOICES, 1, {'invoice': {}})
+            outbox._claim()
+            outbox.close()
+            outbox = Outbox(mock.Mock(), path)
+            statuses = (outbox.get(create)['status'], outbox.get(update)['status'])
+            outbox.close()
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(statuses, (UNKNOWN, PENDING))
+
+    def test_background_worker_sends_stored_writes(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'outbox.sqlite')
+            with MockBillomatServer() as server:
+                billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+                billomapy.api_url = server.api_url
+                outbox = Outbox(billomapy, path)
+                key = outbox.create(CLIENTS, {'client': {'name': 'ACME'}})
+                outbox.close()
+
+                done = threading.Event()
+                outbox = Outbox(billomapy, path, on_status=lambda entry: done.set())
+                outbox.start(interval=0.05)
+                self.assertTrue(done.wait(5))
+                outbox.close()
+                client = billomapy.get_client(Outbox(billomapy, path).get(key)['result_id'])
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(client[CLIENT]['name'], 'ACME')
+
+
+class TestAggregation(unittest.TestCase):
+    def test_aggregate_matches_the_materialized_records(self):
+        with MockBillomatServer(records={INVOICES: 250, CLIENTS: 7}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', page_size=100)
+            billomapy.api_url = server.api_url
+            revenue = billomapy.aggregate(INVOICES, group_by='client_id', fields=['total_gross'])
+            by_status_month = billomapy.aggregate(
+                INVOICES, group_by=lambda invoice: (invoice['status'], invoice['date'][:7]), fields=['total_net']
+            )
+            invoices = billomapy.resolve_response_data(INVOICES, INVOICE, billomapy.get_all_invoices())
+
+        expected = {}
+        for invoice in invoices:
+            expected.setdefault(invoice['client_id'], []).append(decimal.Decimal(invoice['total_gross']))
+        self.assertEqual(sorted(revenue), sorted(expected))
+        for client_id, totals in expected.items():
+            self.assertEqual(revenue[client_id]['count'], len(totals))
+            self.assertEqual(revenue[client_id]['total_gross']['sum'], sum(totals))
+            self.assertEqual(revenue[client_id]['total_gross']['min'], min(totals))
+            self.assertEqual(revenue[client_id]['total_gross']['max'], max(totals))
+        self.assertEqual(sum(group['count'] for group in by_status_month.values()), 250)
+
+    def test_merge_partial_aggregations(self):
+        payments = [{'date': '2026-0{}-01'.format(index % 3 + 1), 'amount': '0.10'} for index in range(30)]
+        parts = [Aggregation(month('date'), ['amount']).update(payments[start::3]) for start in range(3)]
+        total = Aggregation(month('date'), ['amount'])
+        for part in parts:
+            total.merge(part)
+        result = total.result()
+
+        self.assertEqual(sorted(result), ['2026-01', '2026-02', '2026-03'])
+        self.assertEqual(result['2026-01']['amount']['sum'], decimal.Decimal('1.00'))
+        self.assertEqual(total.records, 30)
+        self.assertEqual(Aggregation(fields=['amount']).update([{'amount': ''}]).result()[None]['amount']['count'], 0)
+
+
+class TestPagedSequence(unittest.TestCase):
+    def test_fetches_only_the_covering_pages(self):
+        with MockBillomatServer(records={INVOICES: 1234}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+            billomapy.api_url = server.api_url
+            invoices = billomapy.sequence(INVOICES, per_page=100, max_pages=2)
+            self.assertEqual(len(invoices), 1234)
+            self.assertEqual(server.request_count, 1)
+
+            last = invoices[-50:]
+            self.assertEqual(server.request_count, 3)
+            self.assertEqual([invoice['id'] for invoice in last], [str(index) for index in range(1185, 1235)])
+            self.assertEqual(invoices[-1]['id'], '1234')
+            self.assertEqual(invoices[0]['id'], '1')
+            self.assertEqual(server.request_count, 4)
+            self.assertEqual(invoices[10:30:10], [invoices[10], invoices[20]])
+            with self.assertRaises(IndexError):
+                invoices[1234]
+
+    def test_uses_the_page_size_of_billomat(self):
+        records = [{'id': index} for index in range(25)]
+
+        def get_page(page, per_page):
+            per_page = min(per_page, 10)
+            return {INVOICES: {'@total': '25', '@per_page': str(per_page),
+                               INVOICE: records[(page - 1) * per_page:page * per_page]}}
+
+        invoices = PagedSequence(get_page, INVOICES, per_page=100)
+        self.assertEqual(list(invoices), records)
+        self.assertEqual(invoices.fetched_pages, 3)
+        self.assertEqual(len(PagedSequence(lambda page, per_page: {INVOICES: {'@total': '0'}}, INVOICES)), 0)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_probes_and_closes(self):
+        breaker = CircuitBreaker(min_requests=4, failure_rate=0.5, slow_call=1.0, reset_timeout=0.05)
+        for seconds, failed in ((0.1, False), (0.1, True), (0.1, False), (2.0, False)):
+            breaker.allow('TEST_ID', INVOICES)
+            breaker.record('TEST_ID', INVOICES + '/42/pdf', seconds, failed=failed)
+
+        self.assertEqual(breaker.state('TEST_ID', INVOICES), OPEN)
+        self.assertEqual(breaker.state('TEST_ID', CLIENTS), CLOSED)
+        self.assertEqual(breaker.state('OTHER_ID', INVOICES), CLOSED)
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow('TEST_ID', INVOICES + '/1')
+
+        time.sleep(0.06)
+        breaker.allow('TEST_ID', INVOICES)
+        self.assertEqual(breaker.state('TEST_ID', INVOICES), HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow('TEST_ID', INVOICES)
+        breaker.record('TEST_ID', INVOICES, 0.1)
+        self.assertEqual(breaker.state('TEST_ID', INVOICES), CLOSED)
+        self.assertEqual(breaker.rejected, 2)
+
+    def test_open_circuit_serves_stale_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FileCache(directory, ttl=0.01, stale_ttl=3600)
+            breaker = CircuitBreaker(min_requests=3, reset_timeout=60)
+            with MockBillomatServer(records={UNITS: 5}) as server:
+                billomapy = Billomapy(
+                    'TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', cache=cache, circuit_breaker=breaker
+                )
+                billomapy.api_url = server.api_url
+                billomapy.get_unit(1)
+                time.sleep(0.02)
+
+                server.error_rate = 1.0
+                for _ in range(2):
+                    with self.assertRaises(requests.HTTPError):
+                        billomapy.get_unit(2)
+                request_count = server.request_count
+                stale = billomapy.get_unit(1)
+                with self.assertRaises(CircuitOpenError):
+                    billomapy.get_unit(2)
+                self.assertEqual(server.request_count, request_count)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(stale[UNIT]['id'], '1')
+        self.assertEqual(breaker.state('TEST_ID', UNITS), OPEN)
+
+    def test_deadline_timeouts_do_not_open_the_circuit(self):
+        breaker = CircuitBreaker(min_requests=1, failure_rate=0.5)
+        with MockBillomatServer(records={CLIENTS: 3}, latency=0.3) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', circuit_breaker=breaker)
+            billomapy.api_url = server.api_url
+            for _ in range(3):
+                with self.assertRaises(DeadlineExceeded), billomapy.deadline(0.1):
+                    billomapy.get_client(1)
+
+            self.assertEqual(breaker.state('TEST_ID', CLIENTS), CLOSED)
+            self.assertEqual(billomapy.get_client(1)[CLIENT]['id'], '1')
+
+    def test_pipeline_raises_while_the_circuit_is_open(self):
+        http_client = mock.Mock()
+        breaker = CircuitBreaker(min_requests=1, reset_timeout=60)
+        breaker.record('TEST_ID', INVOICES, 0.1, failed=True)
+        billomapy = FloodBillomapy(
+            'TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=http_client, circuit_breaker=breaker
+        )
+        pipeline = DocumentPipeline(billomapy, mock.Mock(), max_in_flight=2)
+        pipeline.add(INVOICES, [1, 2])
+        with self.assertRaises(CircuitOpenError):
+            pipeline.run()
+
+        self.assertFalse(http_client.fetch.called)
+        self.assertEqual((pipeline.in_flight, len(pipeline.pending)), (0, 2))
+
+    def test_flood_fails_fast(self):
+        http_client = mock.Mock()
+        breaker = CircuitBreaker(min_requests=1, reset_timeout=60)
+        breaker.record('TEST_ID', INVOICES, 0.1, failed=True)
+        billomapy = FloodBillomapy(
+            'TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=http_client, circuit_breaker=breaker
+        )
+        billomapy.queue_get_request(INVOICES + '/42')
+        with self.assertRaises(CircuitOpenError):
+            billomapy.start_requests()
+
+        self.assertFalse(http_client.fetch.called)
+        self.assertEqual(billomapy.responses, [])
+        self.assertEqual(billomapy.request_counter, 0)
+        billomapy.start_requests()
+
+
+class TestMockBillomatServer(unittest.TestCase):
+    def setUp(self):
+        self.billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+
+    def test_get_all_invoices(self):
+        with MockBillomatServer(records={INVOICES: 2500}) as server:
+            self.billomapy.api_url = server.api_url
+            data = self.billomapy.get_all_invoices()
+
+        self.assertEqual(len(data), 3)
+        self.assertEqual(len(self.billomapy.resolve_response_data(INVOICES, INVOICE, data)), 2500)
+
+    def test_compressed_responses(self):
+        with MockBillomatServer(records={INVOICES: 500}) as server:
+            self.billomapy.api_url = server.api_url
+            self.billomapy.get_all_invoices()
+
+            uncompressed = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', compress=False)
+            uncompressed.api_url = server.api_url
+            uncompressed.get_all_invoices()
+
+        stats = self.billomapy.transfer_stats
+        self.assertEqual(stats.compressed_responses, 1)
+        self.assertGreater(stats.ratio, 5)
+        self.assertEqual(stats.uncompressed_bytes, uncompressed.transfer_stats.uncompressed_bytes)
+        self.assertEqual(uncompressed.transfer_stats.compressed_responses, 0)
+        self.assertEqual(uncompressed.transfer_stats.saved_bytes, 0)
+
+    def test_rate_limit_and_errors(self):
+        with MockBillomatServer(rate_limit_rate=1.0) as server:
+            self.billomapy.api_url = server.api_url
+            with self.assertRaises(requests.HTTPError) as context:
+                self.billomapy.get_invoice(1)
+        self.assertEqual(context.exception.response.status_code, 429)
+
+        with MockBillomatServer(error_rate=1.0) as server:
+            self.billomapy.api_url = server.api_url
+            with self.assertRaises(requests.HTTPError) as context:
+                self.billomapy.get_invoice(1)
+        self.assertEqual(context.exception.response.status_code, 500)
+
+
+class TestQuery(unittest.TestCase):
+    def test_filters_are_pushed_to_the_server(self):
+        query = Query(INVOICES).status('OPEN', 'OVERDUE').client(2).between(datetime.date(2026, 3, 1), '2026-12-31')
+        self.assertEqual(
+            dict(query), {'status': 'OPEN,OVERDUE', 'client_id': '2', 'from': '2026-03-01', 'to': '2026-12-31'}
+        )
+
+        with MockBillomatServer(records={CLIENTS: 2, INVOICES: 100}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+            billomapy.api_url = server.api_url
+            invoices = billomapy.resolve_response_data(INVOICES, INVOICE, billomapy.get_all_invoices(params=query))
+
+        self.assertTrue(invoices)
+        self.assertNotIn('page', query)
+        for invoice in invoices:
+            self.assertIn(invoice['status'], ('OPEN', 'OVERDUE'))
+            self.assertEqual(invoice['client_id'], '2')
+            self.assertGreaterEqual(invoice['date'], '2026-03-01')
+
+    def test_validation(self):
+        with self.assertRaises(ValueError):
+            Query(INVOICES, name='ACME')
+        with self.assertRaises(ValueError):
+            Query(INVOICES).status('WON')
+        self.assertEqual(Query(INVOICE_ITEMS, invoice_id=42), {'invoice_id': '42'})
+        self.assertEqual(Query(INVOICES, client_id=1).where(client_id=None), {})
+
+    def test_order_by(self):
+        self.assertEqual(Query(INVOICES).order_by('-date', 'id'), {'order_by': 'date DESC,id ASC'})
+        self.assertEqual(Query(INVOICES).order_by('date').order_by(), {})
+        self.assertEqual(Query(INVOICE_ITEMS, order_by='position ASC'), {'order_by': 'position ASC'})
+
+        with MockBillomatServer(records={INVOICES: 50}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+            billomapy.api_url = server.api_url
+            invoices = billomapy.resolve_response_data(
+                INVOICES, INVOICE, billomapy.get_all_invoices(params=Query(INVOICES).order_by('-date'))
+            )
+
+        dates = [invoice['date'] for invoice in invoices]
+        self.assertEqual(len(dates), 50)
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+
+class TestProjection(unittest.TestCase):
+    def test_iter_all_and_get_all_keep_only_the_fields(self):
+        fields = ['id', 'client_id', 'total_gross', 'status', 'date']
+        with MockBillomatServer(records={INVOICES: 250}, payload_bytes=500) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', page_size=100)
+            billomapy.api_url = server.api_url
+            iterated = list(billomapy.iter_all(INVOICES, params=Query(INVOICES).status('OPEN'), fields=fields))
+            complete = billomapy.resolve_response_data(INVOICES, INVOICE, billomapy.get_all_invoices())
+
+            billomapy.fields = {INVOICES: fields}
+            projected = billomapy.resolve_response_data(INVOICES, INVOICE, billomapy.get_all_invoices())
+            items = list(billomapy.iter_all(INVOICE_ITEMS, params={'invoice_id': 1}))
+
+        self.assertEqual(len(iterated), 50)
+        self.assertEqual(set(iterated[0]), set(fields))
+        self.assertIn('note', complete[0])
+        self.assertEqual(len(projected), 250)
+        self.assertEqual([set(invoice) for invoice in projected], [set(fields)] * 250)
+        self.assertEqual(len(items), 3)
+        self.assertIn('title', items[0])
+
+    def test_projection_does_not_change_coalesced_results(self):
+        with MockBillomatServer(records={INVOICES: 50}, latency=0.2) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', page_size=100)
+            billomapy.api_url = server.api_url
+            results = {}
+            thread = threading.Thread(
+                target=lambda: results.update(page=billomapy.get_invoices_per_page(per_page=100, page=1))
+            )
+            thread.start()
+            time.sleep(0.05)
+            projected = list(billomapy.iter_all(INVOICES, fields=['id']))
+            thread.join()
+
+        self.assertEqual(billomapy.single_flight.coalesced, 1)
+        self.assertEqual(set(projected[0]), {'id'})
+        self.assertIn('total_gross', results['page'][INVOICES][INVOICE][0])
+
+    def test_flood_projects_every_page(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'invoices.jsonl.gz')
+            recorder = Recorder(path)
+            for page in (1, 2, 3):
+                invoices = [
+                    {'id': str(index), 'note': 'x'} for index in range(page * 100 - 99, min(page * 100, 250) + 1)
+                ]
+                body = {INVOICES: {'@page': str(page), '@per_page': '100', '@total': '250', INVOICE: invoices}}
+                recorder.record(
+                    'GET', 'https://TEST_ID.billomat.net/api/invoices?per_page=100&page={}'.format(page),
+                    {}, None, 200, {}, json.dumps(body), 0.0
+                )
+            billomapy = FloodBillomapy(
+                'TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET',
+                transport=ReplayHTTPClient(path), fields={INVOICES: ['id']},
+            )
+            pages = billomapy.get_all_invoices()
+        finally:
+            shutil.rmtree(directory)
+
+        invoices = Billomapy.resolve_response_data(INVOICES, INVOICE, pages)
+        self.assertEqual(len(invoices), 250)
+        self.assertEqual([set(invoice) for invoice in invoices], [{'id'}] * 250)
+
+
+class TestProcessStage(unittest.TestCase):
+    def test_iter_all_with_process_stage(self):
+        with MockBillomatServer(records={INVOICES: 250}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', page_size=100)
+            billomapy.api_url = server.api_url
+            with ProcessStage(invoice_total, max_workers=2, chunksize=20) as stage:
+                totals = list(billomapy.iter_all(INVOICES, process=stage))
+
+        self.assertEqual(totals, [(str(index), round(index * 11.9, 2)) for index in range(1, 251)])
+
+
+class TestStreaming(unittest.TestCase):
+    @unittest.skipIf(streaming.ijson is None, 'ijson is not installed')
+    def test_iter_all_stream_yields_the_same_records(self):
+        with MockBillomatServer(records={INVOICES: 1201}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', page_size=400)
+            billomapy.api_url = server.api_url
+            parsed = list(billomapy.iter_all(INVOICES))
+            streamed = list(billomapy.iter_all(INVOICES, stream=True))
+            single = list(billomapy.iter_all(INVOICE_ITEMS, params={'invoice_id': 1}, fields=['id'], stream=True))
+
+        self.assertEqual(len(streamed), 1201)
+        self.assertEqual(streamed, parsed)
+        # 4 pages of invoices per run and 1 page of items
+        self.assertEqual(billomapy.transfer_stats.compressed_responses, 9)
+        self.assertEqual(single, [{'id': '1'}, {'id': '2'}, {'id': '3'}])
+
+    @unittest.skipIf(streaming.ijson is None, 'ijson is not installed')
+    def test_iter_records_of_single_record_page(self):
+        page_info = {}
+        body = io.BytesIO(b'{"invoices": {"@page": "1", "@per_page": "100", "@total": "1", "invoice": {"id": "7"}}}')
+        records = list(streaming.iter_records(body, INVOICES, INVOICE, page_info))
+
+        self.assertEqual(records, [{'id': '7'}])
+        self.assertEqual(page_info, {'@page': '1', '@per_page': '100', '@total': '1'})
+
+
+class TestPagination(unittest.TestCase):
+    def test_adaptive_page_size(self):
+        page_size = AdaptivePageSize(initial=100, max_bytes=100000)
+        self.assertEqual(page_size.per_page(INVOICES, 0), 100)
+
+        page_size.observe(INVOICES, records=100, seconds=0.01, size=100 * 250)
+        self.assertEqual(page_size.target(INVOICES), 400)
+        # the next page has to start at the offset, so per_page has to divide it
+        self.assertEqual(page_size.per_page(INVOICES, 100, current=100), 100)
+        self.assertEqual(page_size.per_page(INVOICES, 1200, current=100), 400)
+        self.assertEqual(page_size.per_page(INVOICES, 0), 400)
+
+    def test_get_all_with_adaptive_page_size(self):
+        with MockBillomatServer(records={INVOICES: 3000}, payload_bytes=1000) as server:
+            billomapy = Billomapy(
+                'TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', page_size=AdaptivePageSize(max_bytes=200000)
+            )
+            billomapy.api_url = server.api_url
+            data = billomapy.get_all_invoices()
+
+        per_pages = [int(page[INVOICES]['@per_page']) for page in data]
+        self.assertEqual(per_pages[0], 100)
+        self.assertGreater(max(per_pages), 100)
+        invoices = billomapy.resolve_response_data(INVOICES, INVOICE, data)
+        self.assertEqual([invoice['id'] for invoice in invoices], [str(i) for i in range(1, 3001)])
+
+
+class TestIndexedCollection(unittest.TestCase):
+    def test_lookup_and_join(self):
+        with MockBillomatServer(records={INVOICES: 30, INVOICE_PAYMENTS: 60}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+            billomapy.api_url = server.api_url
+            invoices = billomapy.resolve_response_data(
+                INVOICES, INVOICE, billomapy.get_all_invoices(), index_keys=True
+            )
+            payments = billomapy.resolve_response_data(
+                INVOICE_PAYMENTS, 'invoice-payment', billomapy.get_all_invoice_payments(), index_keys=True
+            )
+
+        self.assertEqual(len(invoices), 30)
+        self.assertEqual(invoices.by_id(7)['id'], '7')
+        self.assertEqual(
+            invoices.lookup('client_id', 3),
+            [invoice for invoice in invoices if invoice['client_id'] == '3']
+        )
+        joined = dict((invoice['id'], len(matches)) for invoice, matches in invoices.join(payments, 'invoice_id'))
+        self.assertEqual(joined['1'], 3)
+        self.assertEqual(joined['30'], 0)
+
+        invoices.append({'id': '31', 'client_id': '3'})
+        self.assertEqual(invoices.by_id(31)['client_id'], '3')
+        with self.assertRaises(KeyError):
+            invoices.lookup('total_gross', '1.00')
+
+
+class TestMirror(unittest.TestCase):
+    def test_sync_and_query(self):
+        with MockBillomatServer(records={CLIENTS: 10, INVOICES: 50, INVOICE_PAYMENTS: 20}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+            billomapy.api_url = server.api_url
+            mirror = BillomatMirror(billomapy)
+            synced = mirror.sync([CLIENTS, INVOICES, INVOICE_ITEMS, INVOICE_PAYMENTS])
+            requests_after_sync = server.request_count
+
+            invoices = mirror.query(INVOICES, client_id=3, status=['OPEN', 'PAID'])
+            self.assertEqual(server.request_count, requests_after_sync)
+
+        self.assertEqual(synced, {CLIENTS: 10, INVOICES: 50, INVOICE_ITEMS: 25, INVOICE_PAYMENTS: 20})
+        self.assertTrue(invoices)
+        self.assertTrue(all(invoice['client_id'] == '3' for invoice in invoices))
+        self.assertTrue(all(invoice['status'] in ('OPEN', 'PAID') for invoice in invoices))
+        self.assertEqual(mirror.count(INVOICE_ITEMS, invoice_id=2), 3)
+        self.assertEqual(mirror.count(INVOICES, date_from='2026-03-01', date_to='2026-03-31'), 5)
+        self.assertEqual(mirror.get(CLIENTS, 4)['id'], '4')
+        self.assertIsNotNone(mirror.synced_at(INVOICES))
+
+    def test_partial_syncs_keep_the_mirror(self):
+        with MockBillomatServer(records={CLIENTS: 10, INVOICES: 50}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET')
+            billomapy.api_url = server.api_url
+            mirror = BillomatMirror(billomapy)
+            mirror.sync([CLIENTS, INVOICES, INVOICE_ITEMS])
+
+            token = CancellationToken()
+            token.cancel()
+            with billomapy.cancellation(token):
+                cancelled = mirror.sync([CLIENTS, INVOICE_ITEMS])
+            filtered = mirror.sync([CLIENTS, INVOICES], params={INVOICES: {'client_id': '3'}})
+
+        self.assertEqual(cancelled, {})
+        self.assertEqual(mirror.count(INVOICE_ITEMS), 25)
+        self.assertEqual(filtered, {CLIENTS: 10, INVOICES: 5})
+        self.assertEqual(mirror.count(INVOICES, client_id=3), 5)
+
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'recording.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record_and_replay(self):
+        with MockBillomatServer(records={INVOICES: 1500}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=RecordingAdapter(self.path))
+            billomapy.api_url = server.api_url
+            recorded = billomapy.get_all_invoices()
+
+        with gzip.open(self.path, 'rt') as recording:
+            content = recording.read()
+        self.assertNotIn('API_KEY', content)
+        self.assertNotIn('APP_SECRET', content)
+
+        billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=ReplayAdapter(self.path))
+        self.assertEqual(billomapy.get_all_invoices(), recorded)
+        with self.assertRaises(ReplayMissError):
+            billomapy.get_invoice(1)
+
+    @unittest.skipIf(streaming.ijson is None, 'ijson is not installed')
+    def test_streamed_reads_while_recording(self):
+        with MockBillomatServer(records={CLIENTS: 30}) as server:
+            billomapy = Billomapy(
+                'TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=RecordingAdapter(self.path), page_size=10
+            )
+            billomapy.api_url = server.api_url
+            parsed = list(billomapy.iter_all(CLIENTS))
+            streamed = list(billomapy.iter_all(CLIENTS, stream=True))
+
+        self.assertEqual(len(parsed), 30)
+        self.assertEqual(streamed, parsed)
+
+
+class TestDocumentPipeline(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'pdfs.jsonl.gz')
+        recorder = Recorder(self.path)
+        for invoice_id in range(1, 21):
+            body = {'pdf': {'id': str(invoice_id), 'base64file': base64.b64encode(b'%PDF' * 2500).decode('ascii')}}
+            recorder.record('GET', 'https://TEST_ID.billomat.net/api/invoices/{}/pdf'.format(invoice_id), {}, None,
+                            200, {}, json.dumps(body), 0.0)
+        recorder.record('GET', 'https://TEST_ID.billomat.net/api/invoices/21/pdf', {}, None, 404, {}, '{}', 0.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_documents_stream_to_the_sink_with_backpressure(self):
+        billomapy = FloodBillomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=ReplayHTTPClient(self.path))
+        received = []
+
+        def sink(resource, billomat_id, document):
+            received.append((billomat_id, len(document['content'])))
+            future = Future()
+            ioloop.IOLoop.current().call_later(0.005, lambda: future.set_result(None))
+            return future
+
+        pipeline = DocumentPipeline(billomapy, sink, max_in_flight=4, high_water_mark=25000)
+        pipeline.add(INVOICES, range(1, 22))
+        pipeline.run()
+
+        self.assertEqual(pipeline.fetched, 20)
+        self.assertEqual(sorted(int(billomat_id) for billomat_id, _ in received), list(range(1, 21)))
+        self.assertEqual(set(size for _, size in received), {10000})
+        self.assertEqual(pipeline.failed, [(INVOICES, '21', 404)])
+        self.assertLessEqual(pipeline.peak_held_bytes, 25000 + 4 * 10000)
+        self.assertEqual((pipeline.held_bytes, pipeline.in_flight, billomapy.responses), (0, 0, []))
+
+    def test_process_stage_delivers_in_order(self):
+        billomapy = FloodBillomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=ReplayHTTPClient(self.path))
+        received = []
+
+        with ProcessStage(pdf_summary, max_workers=2) as stage:
+            pipeline = DocumentPipeline(
+                billomapy, lambda resource, billomat_id, summary: received.append(summary), process=stage
+            )
+            pipeline.add(INVOICES, [5, 21, 3, 1, 20, 2])
+            pipeline.run()
+
+        self.assertEqual(received, [('5', 10000), ('3', 10000), ('1', 10000), ('20', 10000), ('2', 10000)])
+        self.assertEqual(pipeline.failed, [(INVOICES, '21', 404)])
+
+
+    def test_run_returns_at_the_deadline(self):
+        recorder = Recorder(self.path)
+        for invoice_id, elapsed in ((22, 0.0), (23, 0.0), (24, 2.0), (25, 2.0)):
+            body = {'pdf': {'id': str(invoice_id), 'base64file': base64.b64encode(b'%PDF').decode('ascii')}}
+            recorder.record('GET', 'https://TEST_ID.billomat.net/api/invoices/{}/pdf'.format(invoice_id), {}, None,
+                            200, {}, json.dumps(body), elapsed)
+        billomapy = FloodBillomapy(
+            'TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=ReplayHTTPClient(self.path, speed=1.0),
+            max_in_flight=3,
+        )
+        received = []
+        pipeline = DocumentPipeline(billomapy, lambda resource, billomat_id, document: received.append(billomat_id))
+        pipeline.add(INVOICES, range(22, 26))
+
+        start = time.time()
+        with billomapy.deadline(0.3) as deadline:
+            pipeline.run()
+        elapsed = time.time() - start
+
+        self.assertTrue(deadline.exceeded)
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(received, ['22', '23'])
+        self.assertEqual(list(pipeline.pending), [(INVOICES, '24'), (INVOICES, '25')])
+        self.assertEqual((pipeline.in_flight, pipeline.failed, billomapy.request_counter), (0, [], 0))
+
+    def test_flood_does_not_dispatch_after_the_deadline(self):
+        http_client = mock.Mock()
+        billomapy = FloodBillomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=http_client)
+        with billomapy.deadline(0.0) as deadline:
+            billomapy._fetch(billomapy._create_http_get_request(CLIENTS, {'client_id': 1}), mock.Mock())
+
+        self.assertFalse(http_client.fetch.called)
+        self.assertTrue(deadline.exceeded)
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cold_clients_start_warm(self):
+        with MockBillomatServer(records={UNITS: 30}) as server:
+            clients = []
+            for _ in range(3):
+                billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', cache=FileCache(self.directory))
+                billomapy.api_url = server.api_url
+                clients.append(billomapy)
+            units = [billomapy.get_all_units() for billomapy in clients]
+            clients[0].get_all_invoices()
+            clients[1].get_all_invoices()
+            request_count = server.request_count
+
+        self.assertEqual(request_count, 3)
+        self.assertEqual(units[0], units[2])
+        self.assertEqual(len(Billomapy.resolve_response_data(UNITS, UNIT, units[2])), 30)
+        self.assertEqual((clients[2].cache.hits, clients[2].cache.misses), (1, 0))
+
+    def test_writes_invalidate_the_resource(self):
+        with MockBillomatServer(records={UNITS: 3}) as server:
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', cache=FileCache(self.directory))
+            billomapy.api_url = server.api_url
+            billomapy.get_unit(1)
+            billomapy.get_all_units()
+            billomapy.cache.set('f' * 64, CLIENTS, b'{}')
+            billomapy.update_unit(1, {'unit': {'name': 'hours'}})
+            unit = billomapy.get_unit(1)
+            units = billomapy.resolve_response_data(UNITS, UNIT, billomapy.get_all_units())
+            request_count = server.request_count
+
+        self.assertEqual(unit[UNIT]['name'], 'hours')
+        self.assertIn('hours', [unit['name'] for unit in units])
+        self.assertEqual(request_count, 5)
+        self.assertEqual(billomapy.cache.get('f' * 64), b'{}')
+
+    def test_ttl_and_eviction(self):
+        cache = FileCache(self.directory, ttl={UNITS: 60, None: 0}, max_bytes=250)
+        keys = [FileCache.key('TEST_ID', 'https://TEST_ID.billomat.net/api/units?page={}'.format(page))
+                for page in range(3)]
+        self.assertEqual(
+            FileCache.key('TEST_ID', 'https://TEST_ID.billomat.net/api/units?page=1&per_page=10'),
+            FileCache.key('TEST_ID', 'https://other/api/units?per_page=10&page=1'),
+        )
+        for key in keys:
+            cache.set(key, UNITS, b'x' * 100)
+            time.sleep(0.01)
+        cache.set('f' * 64, INVOICES, b'{}')
+
+        self.assertIsNone(cache.get(keys[0]))
+        self.assertEqual(cache.get(keys[2]), b'x' * 100)
+        self.assertIsNone(cache.get('f' * 64))
+
+    def test_eviction_scans_only_above_the_limit(self):
+        cache = FileCache(self.directory, ttl=60, max_bytes=50000, resources=None, scan_interval=1000)
+        keys = [FileCache.key('TEST_ID', 'https://TEST_ID.billomat.net/api/units?page={}'.format(page))
+                for page in range(200)]
+        for key in keys:
+            cache.set(key, UNITS, b'x' * 1000)
+        for key in keys[:10]:
+            cache.set(key, UNITS, b'x' * 1000)
+
+        size = sum(os.path.getsize(path) for _, _, path in cache._entries())
+        self.assertLessEqual(size, 50000)
+        self.assertLess(cache.scans, 50)
+        self.assertIsNone(cache.get(keys[50]))
+        self.assertEqual(cache.get(keys[199]), b'x' * 1000)
+
+    def test_flood_client_answers_from_cache(self):
+        cache = FileCache(self.directory)
+        http_client = mock.Mock()
+        billomapy = FloodBillomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', transport=http_client, cache=cache)
+        http_request = billomapy._create_http_get_request(UNITS, {'page': 1})
+        cache.set(FileCache.key('TEST_ID', http_request.url), UNITS, b'{"units": {}}')
+        callback = mock.Mock()
+
+        billomapy._fetch(http_request, callback, resource=UNITS)
+        ioloop.IOLoop.current().run_sync(lambda: gen.sleep(0.01))
+
+        self.assertFalse(http_client.fetch.called)
+        self.assertEqual(callback.call_args[0][0].body, b'{"units": {}}')
+
+
+class TestTracing(unittest.TestCase):
+    def test_noop_span_without_opentelemetry(self):
+        with mock.patch.object(tracing, 'trace', None):
+            with tracing.span('billomapy.get_all', {tracing.RESOURCE: CLIENTS}) as span:
+                span.set_attribute(tracing.PAGE, 1)
+            self.assertIs(span, tracing.NOOP_SPAN)
+            self.assertIs(tracing.start_span('billomapy.request'), tracing.NOOP_SPAN)
+
+    def test_spans_of_a_paginated_get_all_with_retry(self):
+        spans = []
+
+        class FakeSpan(object):
+            def __init__(self, name, attributes):
+                self.name = name
+                self.attributes = dict(attributes)
+                spans.append(self)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, exc_type, exc_value, traceback):
+                return False
+
+            def set_attribute(self, key, value):
+                self.attributes[key] = value
+
+            def end(self):
+                pass
+
+        tracer = mock.Mock(start_as_current_span=FakeSpan, start_span=FakeSpan)
+        fake_trace = mock.Mock(get_tracer=mock.Mock(return_value=tracer))
+
+        with MockBillomatServer(records={CLIENTS: 30}) as server, mock.patch.object(tracing, 'trace', fake_trace):
+            handle = server.handle
+            limited = []
+
+            def rate_limit_page_two(method, path, params, data):
+                if params.get('page') == '2' and not limited:
+                    limited.append(path)
+                    return 429, {}, None
+                return handle(method, path, params, data)
+
+            server.handle = rate_limit_page_two
+            billomapy = Billomapy('TEST_ID', 'API_KEY', 'APP_ID', 'APP_SECRET', page_size=10)
+            billomapy.api_url = server.api_url
+            billomapy.rate_limit_exceeded = lambda response: billomapy._send_request(
+                'GET', CLIENTS, response.request.url
+            )
+            data = billomapy.get_all_clients()
+
+        self.assertEqual(len(Billomapy.resolve_response_data(CLIENTS, CLIENT, data)), 30)
+        get_all = [span for span in spans if span.name == 'billomapy.get_all']
+        self.assertEqual(len(get_all), 1)
+        self.assertEqual(get_all[0].attributes[tracing.RESOURCE], CLIENTS)
+        self.assertEqual(get_all[0].attributes[tracing.PAGES], 3)
+        requests_spans = [span.attributes for span in spans if span.name == 'billomapy.request']
+        self.assertEqual(
+            [(span.get(tracing.PAGE), span[tracing.STATUS_CODE], span.get(tracing.RETRY)) for span in requests_spans],
+            [(1, 200, None), (2, 429, True), (None, 200, None), (3, 200, None)]
+        )
+        self.assertTrue(all(span[tracing.RESOURCE] == CLIENTS and span[tracing.METHOD] == 'GET'
+                            for span in requests_spans))
 
 
 if __name__ == '__main__':